@@ -0,0 +1,245 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import os
+import sqlite3
+import time
+from collections import defaultdict
+
+from utils import get_db_files, normalize_title, shard_number
+from starter import table_exists
+
+# The graph spans every shard, so it lives in a database of its own next to them
+GRAPH_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_files', 'category_graph.db')
+CATEGORY_PREFIX = 'Category:'
+DEFAULT_MAX_DEPTH = 8
+
+def create_graph_tables(c):
+    # Categories get ids of their own, shards number their categories independently
+    c.execute('''
+    CREATE TABLE category_nodes (
+        category_id INTEGER PRIMARY KEY,
+        name TEXT UNIQUE,
+        page_id INTEGER
+    )
+    ''')
+    c.execute('''
+    CREATE TABLE category_edges (
+        parent_id INTEGER,
+        child_id INTEGER,
+        PRIMARY KEY (parent_id, child_id)
+    ) WITHOUT ROWID
+    ''')
+    c.execute('''
+    CREATE TABLE category_members (
+        category_id INTEGER,
+        article_id INTEGER,
+        PRIMARY KEY (category_id, article_id)
+    ) WITHOUT ROWID
+    ''')
+    # Every category a category is under, with the length of the shortest path to it.
+    # Keyed so that the descendants of an ancestor up to a depth are one range of the table.
+    c.execute('''
+    CREATE TABLE category_closure (
+        ancestor_id INTEGER,
+        depth INTEGER,
+        descendant_id INTEGER,
+        PRIMARY KEY (ancestor_id, depth, descendant_id)
+    ) WITHOUT ROWID
+    ''')
+
+class CategoryIds:
+    """Name -> id dictionary of the graph's categories, buffering the new ones for insertion."""
+    def __init__(self):
+        self.ids = {}
+        self.new = []
+
+    def get(self, name):
+        category_id = self.ids.get(name)
+        if category_id is None:
+            category_id = len(self.ids) + 1
+            self.ids[name] = category_id
+            self.new.append((category_id, name))
+        return category_id
+
+def load_shard(c, shard, category_ids):
+    """Add the category pages, parent edges and article memberships of one shard."""
+    shard.execute('SELECT category_id, name FROM categories')
+    shard_categories = {category_id: category_ids.get(category_name(name)) for category_id, name in shard.fetchall()}
+
+    # Category page titles sort together, so this is a range of the title index
+    shard.execute('SELECT article_id, title FROM articles WHERE title >= ? AND title < ?',
+                  (CATEGORY_PREFIX, CATEGORY_PREFIX[:-1] + ';'))
+    pages = [(page_id, category_ids.get(category_name(title))) for page_id, title in shard.fetchall()]
+    category_pages = dict(pages)
+
+    edges, members = [], []
+    shard.execute('SELECT article_id, category_id FROM article_categories')
+    for article_id, shard_category_id in shard:
+        parent_id = shard_categories[shard_category_id]
+        child_id = category_pages.get(article_id)
+        if child_id is None:
+            members.append((parent_id, article_id))
+        elif child_id != parent_id:
+            edges.append((parent_id, child_id))
+
+    c.executemany('INSERT INTO category_nodes (category_id, name) VALUES (?, ?)', category_ids.new)
+    category_ids.new = []
+    c.executemany('UPDATE category_nodes SET page_id = ? WHERE category_id = ?', pages)
+    c.executemany('INSERT OR IGNORE INTO category_edges (parent_id, child_id) VALUES (?, ?)', edges)
+    c.executemany('INSERT OR IGNORE INTO category_members (category_id, article_id) VALUES (?, ?)', members)
+    return len(edges), len(members)
+
+def build_closure(c, max_depth, batch_size=100000):
+    """
+    Walk down from every category breadth first and store each category reached, with its
+    depth, up to max_depth. A category is visited once per walk, so cycles end the walk
+    instead of looping, and the depth stored is that of the shortest path.
+    """
+    children = defaultdict(list)
+    c.execute('SELECT parent_id, child_id FROM category_edges')
+    for parent_id, child_id in c.fetchall():
+        children[parent_id].append(child_id)
+
+    c.execute('SELECT category_id FROM category_nodes')
+    category_ids = [row[0] for row in c.fetchall()]
+
+    rows, total = [], 0
+    for ancestor_id in category_ids:
+        rows.append((ancestor_id, 0, ancestor_id))
+        visited = {ancestor_id}
+        level = [ancestor_id]
+        for depth in range(1, max_depth + 1):
+            next_level = []
+            for category_id in level:
+                for child_id in children.get(category_id, ()):
+                    if child_id not in visited:
+                        visited.add(child_id)
+                        next_level.append(child_id)
+                        rows.append((ancestor_id, depth, child_id))
+            if not next_level:
+                break
+            level = next_level
+
+        if len(rows) >= batch_size:
+            c.executemany('INSERT INTO category_closure (ancestor_id, depth, descendant_id) VALUES (?, ?, ?)', rows)
+            total += len(rows)
+            rows = []
+    c.executemany('INSERT INTO category_closure (ancestor_id, depth, descendant_id) VALUES (?, ?, ?)', rows)
+    return total + len(rows)
+
+def build_category_graph(db_files=None, graph_file=GRAPH_FILE, max_depth=DEFAULT_MAX_DEPTH):
+    """
+    Build the category graph of all shards into graph_file.
+
+    The graph is rebuilt from scratch into a temporary file that then replaces the old one,
+    so searches keep reading the previous graph while it is built. max_depth bounds the
+    closure, which grows quickly with depth on the full Wikipedia category graph.
+    """
+    start_time = time.time()
+    if db_files is None:
+        db_files = get_db_files()
+    if not db_files:
+        print("No shards to build the category graph from.")
+        return
+
+    tmp_file = graph_file + '.tmp'
+    if os.path.exists(tmp_file):
+        os.remove(tmp_file)
+    conn = sqlite3.connect(tmp_file)
+    conn.execute('PRAGMA journal_mode=OFF;')
+    conn.execute('PRAGMA synchronous=OFF;')
+    conn.execute('PRAGMA cache_size=-1000000;')
+    c = conn.cursor()
+    create_graph_tables(c)
+
+    category_ids = CategoryIds()
+    for db_file in sorted(db_files, key=shard_number):
+        shard = sqlite3.connect(db_file)
+        if table_exists(shard.cursor(), 'article_categories'):
+            edge_count, member_count = load_shard(c, shard.cursor(), category_ids)
+            print(f"Read {edge_count} category edges and {member_count} memberships from {os.path.basename(db_file)}")
+        shard.close()
+    conn.commit()
+
+    closure_count = build_closure(c, max_depth)
+    c.execute('CREATE INDEX idx_category_edges_child ON category_edges (child_id, parent_id)')
+    c.execute('CREATE INDEX idx_category_members_article ON category_members (article_id)')
+    c.execute('CREATE INDEX idx_category_closure_descendant ON category_closure (descendant_id, depth)')
+    conn.commit()
+    conn.execute('ANALYZE;')
+    conn.close()
+
+    os.replace(tmp_file, graph_file)
+    print(f"Built the category graph of {len(category_ids.ids)} categories ({closure_count} closure rows, "
+          f"depth <= {max_depth}) in {time.time() - start_time:.1f}s")
+
+def connect_graph(graph_file=GRAPH_FILE):
+    return sqlite3.connect(f'file:{graph_file}?mode=ro', uri=True)
+
+def category_name(category):
+    """
+    Accept category names with or without the 'Category:' prefix. The name after the prefix
+    is normalized too, so [[Category:foo]] and the page Category:Foo get the same name.
+    """
+    category = normalize_title(category)
+    if category.startswith(CATEGORY_PREFIX):
+        category = normalize_title(category[len(CATEGORY_PREFIX):])
+    return CATEGORY_PREFIX + category
+
+def subcategories(c, category, max_depth=1):
+    """(name, depth) of every category under category, up to max_depth levels down."""
+    c.execute('''
+    SELECT n.name, cl.depth
+    FROM category_closure cl
+    JOIN category_nodes n ON n.category_id = cl.descendant_id
+    WHERE cl.ancestor_id = (SELECT category_id FROM category_nodes WHERE name = ?)
+    AND cl.depth BETWEEN 1 AND ?
+    ORDER BY cl.depth, n.name
+    ''', (category_name(category), max_depth))
+    return c.fetchall()
+
+def articles_under_category(c, category, max_depth=0, limit=None):
+    """
+    (article_id, depth) of the articles in category or in a category up to max_depth levels
+    under it, depth being that of the closest such category.
+    """
+    c.execute('''
+    SELECT m.article_id, MIN(cl.depth) AS depth
+    FROM category_closure cl
+    JOIN category_members m ON m.category_id = cl.descendant_id
+    WHERE cl.ancestor_id = (SELECT category_id FROM category_nodes WHERE name = ?)
+    AND cl.depth <= ?
+    GROUP BY m.article_id
+    ORDER BY depth, m.article_id
+    LIMIT ?
+    ''', (category_name(category), max_depth, -1 if limit is None else limit))
+    return c.fetchall()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the category hierarchy of the imported shards.")
+    parser.add_argument("db_files", nargs="*", help="Shards to read (default: every db_files/wikipedia_*.db)")
+    parser.add_argument("--output", default=GRAPH_FILE, help="Category graph database to write")
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_MAX_DEPTH, help="Deepest level stored in the ancestor closure")
+    args = parser.parse_args()
+
+    build_category_graph(args.db_files or None, graph_file=args.output, max_depth=args.max_depth)
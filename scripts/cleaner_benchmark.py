@@ -0,0 +1,255 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import random
+import re
+import sys
+import time
+
+import mwparserfromhell
+
+from dump_reader import iter_xml_pages
+from multistream import iter_dump_pages
+from utils import remove_specific_tags, remove_specific_tags_regex, find_closing, TEMPLATE_BRACES, LINK_BRACKETS, REF_TAG
+from wiki_parser import split_sections
+
+
+# Pieces of the synthetic sections, '#' standing for a number: the markup of real articles,
+# nested and spanning lines included
+SYNTHETIC_PIECES = [
+    "Sentence # about [[Topic #]] and [[Other topic|#]]. ",
+    "It measures {{convert|#|km}} across. ",
+    "{{cite web|url=http://example.org/#|title={{lang|fr|Titre #}}}} ",
+    "{{cite book\n|title=Book #\n|year=19#\n}}\n",
+    "Claim #.<ref>Source #</ref> ",
+    "Claim #.<ref name=\"r#\" /> ",
+    "Claim #.<ref name=\"n#\">{{cite news|title=News #}}</ref> ",
+    "Claim #.<ref>Source # spread\nover two lines</ref>\n",
+    "<!-- note # --> ",
+    "<!-- note # spread\nover two lines -->\n",
+    "[[File:Image #.jpg|thumb|Caption about [[Place #]]]]\n",
+    "[[File:Map #.png|thumb|Map of {{circa|19#}}]]\n",
+    "\n{| class=\"wikitable\"\n! Name !! Value\n|-\n| Row # || #\n|}\n",
+    "{{Infobox thing\n| name = Thing #\n| size = {{convert|#|m}}\n}}\n",
+    "\n\nParagraph # of plain text.\n",
+]
+
+def synthetic_sections(count, seed=0):
+    """count sections made of random SYNTHETIC_PIECES, the same ones for a given seed."""
+    rng = random.Random(seed)
+    return [''.join(rng.choice(SYNTHETIC_PIECES).replace('#', str(rng.randint(1, 999))) for _ in range(rng.randint(3, 15)))
+            for _ in range(count)]
+
+def load_sections(dump_path, max_pages=None, index_path=None):
+    """Return the raw text of every section of the dump, split the way the importer splits them."""
+    sections = []
+    raw_pages = iter_dump_pages(dump_path, index_path) if index_path else iter_xml_pages(dump_path)
+    for pages, raw_page in enumerate(raw_pages, start=1):
+        is_redirect = raw_page.text.strip().lower().startswith("#redirect")
+        for _section_title, section_text, _infoboxes in split_sections(mwparserfromhell.parse(raw_page.text), is_redirect):
+            sections.append(section_text)
+        if max_pages and pages >= max_pages:
+            break
+    return sections
+
+def construct_end(text, start):
+    """End of the template, comment, ref or file link starting at start, -1 if none does or it is never closed."""
+    if text.startswith('{{', start):
+        return find_closing(text, start, TEMPLATE_BRACES, '{{')
+    if text.startswith('[[File:', start):
+        return find_closing(text, start, LINK_BRACKETS, '[[')
+    if text.startswith('<!--', start):
+        end = text.find('-->', start + len('<!--'))
+        return end + len('-->') if end != -1 else -1
+    tag = REF_TAG.match(text, start)
+    if tag is None:
+        return -1
+    if tag.group(1):
+        return tag.end()
+    end = text.find('</ref>', tag.end())
+    return end + len('</ref>') if end != -1 else -1
+
+# Marks put into a section before the regex chain runs on it, so its output shows where it
+# cut markup (see mark_cuts)
+TAIL_MARK = '\x00'
+FILE_MARK = '\x01'
+MARKS = str.maketrans('', '', TAIL_MARK + FILE_MARK)
+
+def mark_cuts(section_text):
+    """
+    The section with a TAIL_MARK for every template the {{...}} pass of the regex chain
+    leaves open, where its match stops at the }} of a nested template, and a FILE_MARK
+    before every [[File: (the old scan leaves the last ] of a caption ending in a link).
+    Neither changes what the regex passes match.
+    """
+    parts = []
+    position = 0
+    for match in re.finditer(r'\{\{.*?\}\}', section_text):
+        left_open = match.group().count('{{') - match.group().count('}}')
+        if left_open > 0:
+            parts.append(section_text[position:match.end()] + TAIL_MARK * left_open)
+            position = match.end()
+    parts.append(section_text[position:])
+    return ''.join(parts).replace('[[File:', FILE_MARK + '[[File:')
+
+def tail_end(text, start, left_open):
+    """
+    End of the rest of the templates the regex chain left open at start: up to their
+    closing }}, counting the templates it cut open again on the way. -1 if a template
+    starts first or they are not all closed.
+    """
+    position = start
+    while left_open > 0:
+        if text.startswith('{{', position) or position >= len(text):
+            return -1
+        if text[position] == TAIL_MARK:
+            left_open += 1
+            position += 1
+        elif text.startswith('}}', position):
+            left_open -= 1
+            position += len('}}')
+        else:
+            position += 1
+    return position
+
+def skip_spaces(text, position):
+    while position < len(text) and text[position].isspace():
+        position += 1
+    return position
+
+def only_leftover_removed(expected, cleaned):
+    """
+    Whether the single pass text is the regex chain text with only the markup the regex
+    chain left behind removed. expected is the regex chain output of the marked section. The texts are walked side by side: a construct still whole in
+    the regex chain text may be missing from the single pass text, and so may the rest of
+    a template right where the regex chain cut it, or the ] it left of a file link.
+    Whitespace is not compared, removing a construct leaves blank lines and changes what
+    strip() takes off.
+    """
+    position = cleaned_position = 0
+    while True:
+        position, cleaned_position = skip_spaces(expected, position), skip_spaces(cleaned, cleaned_position)
+        if position == len(expected):
+            return cleaned_position == len(cleaned)
+        character = expected[position]
+        if character == TAIL_MARK:
+            left_open = 0
+            while expected.startswith(TAIL_MARK, position):
+                left_open += 1
+                position += 1
+            end = tail_end(expected, position, left_open)
+            tail = expected[position:end].translate(MARKS).strip()
+            if end != -1 and not cleaned.startswith(tail, cleaned_position):
+                position = end
+            continue
+        if character == FILE_MARK:
+            position = skip_spaces(expected, position + 1)
+            if expected.startswith(']', position) and not cleaned.startswith(']', cleaned_position):
+                position += 1
+            continue
+        end = construct_end(expected, position)
+        if end != -1 and not cleaned.startswith(expected[position:end].translate(MARKS), cleaned_position):
+            position = end
+        elif cleaned_position < len(cleaned) and character == cleaned[cleaned_position]:
+            position += 1
+            cleaned_position += 1
+        else:
+            return False
+
+def compare_cleaners(sections):
+    """
+    Count the sections both cleaners agree on, the ones where the single pass only removed
+    markup the regex chain left behind, and the unexplained differences (returned for
+    inspection).
+    """
+    identical = fixed = 0
+    unexplained = []
+    for section_text in sections:
+        expected = remove_specific_tags_regex(section_text)
+        cleaned = remove_specific_tags(section_text)
+        if cleaned == expected:
+            identical += 1
+        elif cleaned[1] == expected[1] and only_leftover_removed(remove_specific_tags_regex(mark_cuts(section_text))[0], cleaned[0]):
+            fixed += 1
+        else:
+            unexplained.append((section_text, expected, cleaned))
+    return identical, fixed, unexplained
+
+def time_cleaner(cleaner, sections, repeat=3):
+    """Best of repeat runs of cleaner over all sections, in seconds."""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for section_text in sections:
+            cleaner(section_text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def image_heavy_section(images):
+    """A gallery-like section with many [[File:...]] links whose captions hold links and templates."""
+    return '\n'.join(f"[[File:Image {i}.jpg|thumb|Caption {i} about [[Topic {i}]] {{{{circa|{1900 + i % 100}}}}}]]\n"
+                     f"Paragraph {i} with a [[link]] and a reference.<ref>Source {i}</ref>" for i in range(images))
+
+def report(name, sections, repeat):
+    size_kb = sum(len(section_text) for section_text in sections) / 1024
+    regex_time = time_cleaner(remove_specific_tags_regex, sections, repeat)
+    single_pass_time = time_cleaner(remove_specific_tags, sections, repeat)
+    print(f"{name:<32} {len(sections):>8} {size_kb:>9.0f} {regex_time * 1000:>10.1f} {single_pass_time * 1000:>12.1f} "
+          f"{regex_time / single_pass_time:>8.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the single-pass wikitext cleaner with the old regex chain.")
+    parser.add_argument("--dump", default="data/example_wikipedia-articles.xml", help="Dump to take sections from")
+    parser.add_argument("--index", default=None, help="Index of a multistream --dump")
+    parser.add_argument("--pages", type=int, default=None, help="Only read this many pages of the dump")
+    parser.add_argument("--synthetic", type=int, default=5000, help="Also compare this many generated sections")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated sections")
+    parser.add_argument("--largest", type=int, default=10, help="Also time the N largest sections on their own")
+    parser.add_argument("--images", type=int, default=2000, help="[[File:...]] links in the image-heavy section")
+    parser.add_argument("--repeat", type=int, default=10, help="Timing runs, the best one is reported")
+    parser.add_argument("--check", action="store_true", help="Exit with status 1 on unexplained differences")
+    args = parser.parse_args()
+
+    sections = load_sections(args.dump, args.pages, args.index)
+    print(f"Read {len(sections)} sections from {args.dump}")
+
+    unexplained = []
+    for name, corpus in [(args.dump, sections), ("generated sections", synthetic_sections(args.synthetic, args.seed))]:
+        identical, fixed, corpus_unexplained = compare_cleaners(corpus)
+        print(f"{name}: identical output: {identical}, only leftover markup of the regex chain removed: {fixed}, "
+              f"unexplained: {len(corpus_unexplained)}")
+        unexplained.extend(corpus_unexplained)
+    for section_text, expected, cleaned in unexplained[:5]:
+        print("-" * 40)
+        print(f"Section: {section_text[:200]!r}")
+        print(f"Regex chain: {expected[0][:200]!r}")
+        print(f"Single pass: {cleaned[0][:200]!r}")
+
+    print()
+    print(f"{'input':<32} {'sections':>8} {'size KB':>9} {'regex ms':>10} {'single ms':>12} {'speedup':>9}")
+    report("all sections", sections, args.repeat)
+    largest = sorted(sections, key=len, reverse=True)[:args.largest]
+    report(f"{len(largest)} largest sections", largest, args.repeat)
+    report(f"image-heavy ({args.images} files)", [image_heavy_section(args.images)], args.repeat)
+
+    if args.check and unexplained:
+        sys.exit(1)
@@ -0,0 +1,145 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import sqlite3
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib compressed and plain shards can always be read
+    zstandard = None
+
+from starter import table_exists
+
+# First byte of a compressed value. Uncompressed values stay TEXT, compressed ones are BLOBs.
+ZLIB = b'\x01'
+ZSTD = b'\x02'
+ZSTD_DICT = b'\x03'
+
+METHODS = ('zlib', 'zstd')
+
+class ShardCodec:
+    """
+    Compresses and decompresses the section_content and wikitables values of one shard.
+
+    method is the codec used for new values (None stores plain TEXT). zstd values are
+    compressed with the shard's trained dictionary when it has one. Decompression looks at
+    the tag byte of each value, so shards mixing plain, zlib and zstd rows read fine.
+    compressed tells readers whether the shard may hold compressed rows at all.
+    """
+    def __init__(self, method=None, dictionary=None, compressed=False, level=3):
+        if method not in (None,) + METHODS:
+            raise ValueError(f"Unknown compression method {method}, expected one of {METHODS}")
+        if method == 'zstd' and zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package (pip install zstandard)")
+        self.method = method
+        self.dictionary = dictionary
+        self.compressed = compressed or method is not None
+        self.level = level
+        self._compressor = None
+        self._decompressors = {}
+
+    def _zstd_dict(self):
+        return zstandard.ZstdCompressionDict(self.dictionary)
+
+    def compress(self, text):
+        if self.method is None or text is None:
+            return text
+        data = text.encode('utf-8')
+        if self.method == 'zlib':
+            return ZLIB + zlib.compress(data, 6)
+
+        if self._compressor is None:
+            if self.dictionary:
+                self._compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self._zstd_dict())
+            else:
+                self._compressor = zstandard.ZstdCompressor(level=self.level)
+        return (ZSTD_DICT if self.dictionary else ZSTD) + self._compressor.compress(data)
+
+    def decompress(self, value):
+        if not isinstance(value, bytes):
+            return value
+        tag, payload = value[:1], value[1:]
+        if tag == ZLIB:
+            return zlib.decompress(payload).decode('utf-8')
+
+        if zstandard is None:
+            raise ImportError("This shard holds zstd compressed rows, install the zstandard package to read them")
+        decompressor = self._decompressors.get(tag)
+        if decompressor is None:
+            if tag == ZSTD_DICT:
+                decompressor = zstandard.ZstdDecompressor(dict_data=self._zstd_dict())
+            else:
+                decompressor = zstandard.ZstdDecompressor()
+            self._decompressors[tag] = decompressor
+        return decompressor.decompress(payload).decode('utf-8')
+
+    def content_column(self, column):
+        """SQL expression reading column as text (through wiki_decompress on compressed shards)."""
+        return f'wiki_decompress({column})' if self.compressed else column
+
+def train_dictionary(samples, dict_size=112640):
+    """Train a zstd dictionary on a sample of section texts."""
+    return zstandard.train_dictionary(dict_size, [sample.encode('utf-8') for sample in samples]).as_bytes()
+
+def save_dictionary(conn, method, dictionary=None):
+    """Mark a shard as compressed with method, storing its zstd dictionary if it has one."""
+    c = conn.cursor()
+    if not table_exists(c, 'compression_dicts'):
+        c.execute('''
+        CREATE TABLE compression_dicts (
+            id INTEGER PRIMARY KEY,
+            method TEXT,
+            dictionary BLOB
+        )
+        ''')
+    c.execute('INSERT OR REPLACE INTO compression_dicts (id, method, dictionary) VALUES (1, ?, ?)', (method, dictionary))
+
+def load_codec(conn, method=None):
+    """
+    Build the codec of a shard, picking up the method and dictionary it was compressed with.
+    method overrides the codec used for new values; by default a compressed shard keeps its own.
+    """
+    c = conn.cursor()
+    row = None
+    if table_exists(c, 'compression_dicts'):
+        c.execute('SELECT method, dictionary FROM compression_dicts WHERE id = 1')
+        row = c.fetchone()
+    if row is None:
+        return ShardCodec(method)
+    return ShardCodec(method or row[0], row[1], compressed=True)
+
+class ShardConnection(sqlite3.Connection):
+    """
+    sqlite3 connection to a shard that reads compressed columns transparently.
+
+    conn.codec decompresses fetched values and wiki_decompress(column) does the same in SQL,
+    e.g. for LIKE filters over section_content. wiki_decompress goes through conn.codec on
+    every call, so a writer that replaces the codec (once it trained a dictionary) is
+    followed by the full-text triggers calling it.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.codec = load_codec(self)
+        self.create_function('wiki_decompress', 1, self.decompress, deterministic=True)
+
+    def decompress(self, value):
+        return self.codec.decompress(value)
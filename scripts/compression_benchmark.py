@@ -0,0 +1,94 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import sys
+import time
+
+from compression import ShardCodec, train_dictionary, zstandard
+from utils import connect_shard, get_db_files
+
+def load_sections(db_file, limit):
+    """Read up to limit section texts (content and wikitables) from a shard as plain text."""
+    conn = connect_shard(db_file)
+    c = conn.cursor()
+    c.execute('SELECT section_content, wikitables FROM article_sections LIMIT ?', (limit,))
+    texts = []
+    for section_content, wikitables in c.fetchall():
+        for value in (section_content, wikitables):
+            value = conn.codec.decompress(value)
+            if value:
+                texts.append(value)
+    conn.close()
+    return texts
+
+def benchmark_codec(codec, texts):
+    """Return (compressed bytes, seconds to compress, seconds to decompress) for all texts."""
+    start_time = time.perf_counter()
+    values = [codec.compress(text) for text in texts]
+    compress_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for value in values:
+        codec.decompress(value)
+    decompress_time = time.perf_counter() - start_time
+
+    size = sum(len(value) if isinstance(value, bytes) else len(value.encode('utf-8')) for value in values)
+    return size, compress_time, decompress_time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare section compression methods on rows of an existing shard.")
+    parser.add_argument("--db-file", help="Shard to sample (defaults to the first one in db_files/)")
+    parser.add_argument("--sections", type=int, default=20000, help="Number of sections to read")
+    parser.add_argument("--train-sections", type=int, default=2000, help="Sections used to train the zstd dictionary")
+    args = parser.parse_args()
+
+    db_file = args.db_file
+    if db_file is None:
+        db_files = sorted(get_db_files())
+        if not db_files:
+            print("No shards found in db_files/, import a dump first or pass --db-file")
+            sys.exit(1)
+        db_file = db_files[0]
+
+    texts = load_sections(db_file, args.sections)
+    if not texts:
+        print(f"{db_file} has no sections to compress")
+        sys.exit(1)
+    raw_size = sum(len(text.encode('utf-8')) for text in texts)
+    print(f"Sampled {len(texts)} values ({raw_size / (1024 ** 2):.1f} MB) from {db_file}")
+
+    codecs = [('none', ShardCodec()), ('zlib', ShardCodec('zlib'))]
+    if zstandard is None:
+        print("zstandard is not installed, skipping zstd")
+    else:
+        codecs.append(('zstd', ShardCodec('zstd')))
+        try:
+            dictionary = train_dictionary(texts[:args.train_sections])
+            codecs.append(('zstd+dict', ShardCodec('zstd', dictionary)))
+        except Exception as e:
+            print(f"Could not train a zstd dictionary: {e}")
+
+    print(f"{'method':<10} {'size MB':>9} {'ratio':>7} {'compress MB/s':>14} {'decompress us/row':>18}")
+    for name, codec in codecs:
+        size, compress_time, decompress_time = benchmark_codec(codec, texts)
+        compress_speed = raw_size / (1024 ** 2) / compress_time if compress_time else float('inf')
+        print(f"{name:<10} {size / (1024 ** 2):>9.2f} {raw_size / size:>7.2f} {compress_speed:>14.1f} {decompress_time / len(texts) * 1e6:>18.1f}")
@@ -1,6 +1,8 @@
 import sqlite3
 import glob
 
+from utils import connect_shard
+
 def generate_cleaning_report():
     db_files = glob.glob('wikipedia_*.db')
     changes = []
@@ -15,7 +17,7 @@ def generate_cleaning_report():
         changes = []
         print(f"Parsing DB# {counter_db}")
         counter_db += 1
-        conn = sqlite3.connect(db_file)
+        conn = connect_shard(db_file)
         c = conn.cursor()
 
         query_sections = '''
@@ -34,6 +36,7 @@ def generate_cleaning_report():
 
             counter += 1
 
+            section_content = conn.codec.decompress(section_content)
             stripped_content = section_content.strip()
             if section_content != stripped_content:
                 changes.append((db_file, section_id, article_id, len(section_content)- len(stripped_content)))
@@ -74,7 +77,7 @@ def apply_cleaning_changes():
             db_file_changes[current_db_file].append((section_id, stripped))
 
     for db_file, changes in db_file_changes.items():
-        conn = sqlite3.connect(db_file)
+        conn = connect_shard(db_file)
         c = conn.cursor()
 
         for section_id, stripped_content in changes:
@@ -83,7 +86,7 @@ def apply_cleaning_changes():
             SET section_content = ?
             WHERE id = ?
             '''
-            c.execute(update_query, (stripped_content, section_id))
+            c.execute(update_query, (conn.codec.compress(stripped_content), section_id))
         
         conn.commit()
         conn.close()
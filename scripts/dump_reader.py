@@ -0,0 +1,152 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import xml.etree.ElementTree as ET
+from collections import deque, namedtuple
+
+PAGE_TAG = b'<page>'
+
+# The fields of a dump page the importer uses, taken from its latest revision. offset is the
+# byte position of the page's <page> tag, or of its bz2 stream in a multistream dump.
+# revision_id and sha1 identify the revision, so an update can tell whether a page changed.
+RawPage = namedtuple('RawPage', ['page_id', 'title', 'namespace', 'text', 'offset', 'revision_id', 'sha1'])
+
+def local_name(tag):
+    """Strip the export namespace from an element tag, e.g. '{http://...}page' -> 'page'."""
+    return tag.rsplit('}', 1)[-1]
+
+def find_child(elem, name):
+    for child in elem:
+        if local_name(child.tag) == name:
+            return child
+    return None
+
+def page_from_element(page_elem, offset=None):
+    """
+    Build a RawPage out of a <page> element, using the latest revision.
+
+    Returns None when the page has no revision text, the same pages parse_dump skips.
+    """
+    latest_revision = None
+    for child in page_elem:
+        if local_name(child.tag) == 'revision':
+            latest_revision = child
+
+    if latest_revision is None:
+        return None
+    text_elem = find_child(latest_revision, 'text')
+    if text_elem is None or not text_elem.text:
+        return None
+
+    page_id = int(find_child(page_elem, 'id').text)
+    title = find_child(page_elem, 'title').text
+    ns_elem = find_child(page_elem, 'ns')
+    namespace = int(ns_elem.text) if ns_elem is not None else 0
+    revision_elem = find_child(latest_revision, 'id')
+    revision_id = int(revision_elem.text) if revision_elem is not None else None
+    sha1_elem = find_child(latest_revision, 'sha1')
+    sha1 = sha1_elem.text if sha1_elem is not None else None
+    return RawPage(page_id, title, namespace, text_elem.text, offset, revision_id, sha1)
+
+def iter_fragment_pages(xml_bytes, offset=None):
+    """
+    Yield a RawPage for every <page> in a fragment of a dump.
+
+    A fragment is a run of <page> elements without the <mediawiki> root, as found in a single
+    bz2 stream of a multistream dump. Anything before the first <page> or after the last
+    </page> (the siteinfo header or the closing tag) is ignored. Every page gets offset.
+    """
+    start = xml_bytes.find(PAGE_TAG)
+    end = xml_bytes.rfind(b'</page>')
+    if start == -1 or end == -1:
+        return
+
+    root = ET.fromstring(b'<pages>' + xml_bytes[start:end + len(b'</page>')] + b'</pages>')
+    for page_elem in root:
+        raw_page = page_from_element(page_elem, offset)
+        if raw_page:
+            yield raw_page
+
+def iter_xml_pages(file_path, start_offset=0, chunk_size=1024 * 1024):
+    """
+    Yield a RawPage for every page of a plain XML dump, in constant memory.
+
+    Each page carries the byte offset of its <page> tag, so a later run can seek straight
+    back to it with start_offset instead of parsing the dump from the beginning. When
+    start_offset is not 0 it must point at a <page> tag; the pages from there on are parsed
+    as if they were still wrapped in the <mediawiki> root.
+
+    Nothing outlives its page: a finished page is cleared and detached from the root, and
+    within a page only the newest revision is kept, so full history dumps stay flat as well.
+    """
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    if start_offset:
+        parser.feed(b'<mediawiki>')
+
+    # A literal <page> can only be a tag (text content escapes '<'), so the n-th <page> found
+    # in the raw bytes is the start of the n-th page element the parser will close.
+    page_offsets = deque()
+    root = None
+    page_elem = None
+    latest_revision = None
+    position = start_offset
+    tail = b''
+
+    with open(file_path, 'rb') as dump_file:
+        dump_file.seek(start_offset)
+        while True:
+            chunk = dump_file.read(chunk_size)
+            if not chunk:
+                break
+
+            window = tail + chunk
+            window_start = position - len(tail)
+            found = window.find(PAGE_TAG)
+            while found != -1:
+                page_offsets.append(window_start + found)
+                found = window.find(PAGE_TAG, found + 1)
+            tail = window[-(len(PAGE_TAG) - 1):]
+            position += len(chunk)
+
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                name = local_name(elem.tag)
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    elif name == 'page':
+                        page_elem, latest_revision = elem, None
+                    continue
+
+                if name == 'revision' and page_elem is not None:
+                    if latest_revision is not None:
+                        page_elem.remove(latest_revision)
+                    latest_revision = elem
+                elif name == 'page':
+                    raw_page = page_from_element(elem, page_offsets.popleft())
+                    elem.clear()
+                    root.remove(elem)
+                    page_elem = None
+                    if raw_page:
+                        yield raw_page
+                elif name == 'siteinfo':
+                    root.remove(elem)
+        parser.close()
@@ -0,0 +1,223 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+DTYPES = ('float16', 'int8')
+
+class EmbeddingStore:
+    """
+    Section embeddings of one shard, kept outside of SQLite.
+
+    The vectors are one contiguous row-major matrix in <base>.vectors, memory-mapped for
+    reads, and <base>.ids holds the article_sections id of every row. Rows are appended in
+    increasing section id order, so a section is found with a binary search over the ids.
+    float16 stores keep the vectors as they are; int8 stores quantize each row symmetrically
+    and keep its float32 scale in <base>.scales. Dimension and dtype live in <base>.json.
+    Sections removed from the shard are listed in <base>.deleted and skipped by every read.
+    """
+    def __init__(self, base_path, dim=None, dtype='float16'):
+        self.base_path = base_path
+        header_path = base_path + '.json'
+        if os.path.exists(header_path):
+            with open(header_path, 'r') as f:
+                header = json.load(f)
+            dim, dtype = header["dim"], header["dtype"]
+        else:
+            if dim is None:
+                raise ValueError(f"No embedding store at {base_path}, a dimension is needed to create one")
+            if dtype not in DTYPES:
+                raise ValueError(f"Unsupported embedding dtype {dtype}, expected one of {DTYPES}")
+            with open(header_path, 'w') as f:
+                json.dump({"dim": dim, "dtype": dtype}, f)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self._maps = None
+        self._deleted = None
+
+    @classmethod
+    def for_db_file(cls, db_file, dim=None, dtype='float16'):
+        """Open (or create) the store that sits next to a wikipedia_N.db shard."""
+        return cls(store_path(db_file), dim=dim, dtype=dtype)
+
+    def _map(self, suffix, dtype, shape):
+        path = self.base_path + suffix
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+    def _truncate(self, suffix, size):
+        path = self.base_path + suffix
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            os.truncate(path, size)
+
+    def _load(self):
+        if self._maps is None:
+            ids_path = self.base_path + '.ids'
+            rows = os.path.getsize(ids_path) // 8 if os.path.exists(ids_path) else 0
+            ids = self._map('.ids', np.int64, (rows,))
+            vectors = self._map('.vectors', self.dtype, (rows, self.dim))
+            scales = self._map('.scales', np.float32, (rows,)) if self.dtype == np.int8 else None
+            self._maps = ids, vectors, scales
+        return self._maps
+
+    def _load_deleted(self):
+        if self._deleted is None:
+            path = self.base_path + '.deleted'
+            self._deleted = np.fromfile(path, dtype=np.int64) if os.path.exists(path) else np.empty(0, dtype=np.int64)
+        return self._deleted
+
+    def __len__(self):
+        return len(self._load()[0])
+
+    def remove(self, section_ids):
+        """
+        Mark sections as deleted and return how many were not already. Their rows stay in the
+        files but are never returned again.
+        """
+        deleted = self._load_deleted()
+        new_ids = np.setdiff1d(np.asarray(section_ids, dtype=np.int64), deleted)
+        if len(new_ids) == 0:
+            return 0
+        tmp_path = self.base_path + '.deleted.tmp'
+        np.union1d(deleted, new_ids).tofile(tmp_path)
+        os.replace(tmp_path, self.base_path + '.deleted')
+        self._deleted = None
+        return len(new_ids)
+
+    def append(self, section_ids, vectors):
+        """Append the embeddings of sections whose ids are higher than any already stored."""
+        section_ids = np.asarray(section_ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(section_ids), self.dim)
+        if len(section_ids) == 0:
+            return
+
+        ids = self._load()[0]
+        previous = np.concatenate([ids[-1:], section_ids])
+        if np.any(np.diff(previous) <= 0):
+            raise ValueError("Section ids must be appended in increasing order")
+
+        # An append that crashed before writing its ids left rows (or part of an id) behind,
+        # cut every file back to the rows that have an id so the new rows line up with theirs
+        rows = len(ids)
+        self._maps = None
+        self._truncate('.ids', rows * 8)
+        self._truncate('.vectors', rows * self.dim * self.dtype.itemsize)
+        self._truncate('.scales', rows * 4)
+
+        if self.dtype == np.int8:
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            stored = np.round(vectors / scales[:, None]).astype(np.int8)
+            with open(self.base_path + '.scales', 'ab') as f:
+                f.write(scales.astype(np.float32).tobytes())
+        else:
+            stored = vectors.astype(self.dtype)
+
+        # Ids last: rows written before a crash have no id, are never read and are cut off
+        # by the next append
+        with open(self.base_path + '.vectors', 'ab') as f:
+            f.write(stored.tobytes())
+        with open(self.base_path + '.ids', 'ab') as f:
+            f.write(section_ids.tobytes())
+        self._maps = None
+
+    def rows(self, start, stop):
+        """Zero-copy view of the stored rows [start, stop) and their section ids."""
+        ids, vectors, _scales = self._load()
+        return ids[start:stop], vectors[start:stop]
+
+    def _to_float(self, vectors, scales):
+        vectors = vectors.astype(np.float32)
+        if scales is not None:
+            vectors *= scales[:, None]
+        return vectors
+
+    def get_many(self, section_ids):
+        """Return the float32 embeddings of section_ids, raising KeyError for unknown or removed ids."""
+        ids, vectors, scales = self._load()
+        section_ids = np.asarray(section_ids, dtype=np.int64)
+        if len(ids) == 0:
+            positions, found = section_ids, np.zeros(len(section_ids), dtype=bool)
+        else:
+            positions = np.minimum(np.searchsorted(ids, section_ids), len(ids) - 1)
+            found = (ids[positions] == section_ids) & ~np.isin(section_ids, self._load_deleted())
+        if not found.all():
+            raise KeyError(f"No embedding for section ids {section_ids[~found][:10].tolist()}")
+        return self._to_float(vectors[positions], None if scales is None else scales[positions])
+
+    def get(self, section_id):
+        return self.get_many([section_id])[0]
+
+    def search(self, query, top_k=10, batch_rows=65536):
+        """
+        Cosine similarity of query against every stored row, read in batches of batch_rows.
+
+        Returns [(section_id, score), ...] for the top_k best matches, best first.
+        """
+        ids, vectors, scales = self._load()
+        deleted = self._load_deleted()
+        query = np.asarray(query, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+
+        best_scores = np.empty(0, dtype=np.float32)
+        best_ids = np.empty(0, dtype=np.int64)
+        for start in range(0, len(ids), batch_rows):
+            stop = start + batch_rows
+            batch = self._to_float(vectors[start:stop], None if scales is None else scales[start:stop])
+            norms = np.linalg.norm(batch, axis=1)
+            norms[norms == 0] = 1.0
+            scores = batch @ query / norms
+            if len(deleted):
+                scores[np.isin(ids[start:stop], deleted)] = -np.inf
+
+            best_scores = np.concatenate([best_scores, scores])
+            best_ids = np.concatenate([best_ids, ids[start:stop]])
+            if len(best_scores) > top_k:
+                keep = np.argpartition(-best_scores, top_k)[:top_k]
+                best_scores, best_ids = best_scores[keep], best_ids[keep]
+
+        order = np.argsort(-best_scores)[:top_k]
+        return [(int(best_ids[i]), float(best_scores[i])) for i in order if best_scores[i] > -np.inf]
+
+def store_path(db_file):
+    return os.path.splitext(db_file)[0] + '.embeddings'
+
+def remove_deleted_sections(db_file):
+    """
+    Remove the sections listed in the deleted_sections table of a shard from the embedding
+    store next to it, if there is one. Returns the number of ids newly removed.
+    """
+    if not os.path.exists(store_path(db_file) + '.json'):
+        return 0
+    conn = sqlite3.connect(db_file)
+    try:
+        section_ids = np.array([row[0] for row in conn.execute('SELECT id FROM deleted_sections')], dtype=np.int64)
+    except sqlite3.OperationalError:
+        # A shard no update has written to yet
+        section_ids = np.empty(0, dtype=np.int64)
+    conn.close()
+
+    return EmbeddingStore.for_db_file(db_file).remove(section_ids)
@@ -0,0 +1,146 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import get_db_files, connect_shard, shard_number
+from starter import table_exists
+from redirects import resolve_redirects
+from category_graph import build_category_graph
+from link_graph import build_link_graph
+from title_index import build_title_index
+from query_cache import bump_generation
+
+# Secondary indexes the searcher relies on. They are left out while shards are bulk loaded,
+# so inserts only have to maintain the primary keys, and built once by finalize_shards.
+INDEXES = [
+    ('idx_article_sections_article', 'article_sections', '(article_id, section_order)'),
+    ('idx_article_categories_article', 'article_categories', '(article_id, category_id)'),
+    ('idx_article_categories_category', 'article_categories', '(category_id, article_id)'),
+    ('idx_articles_title', 'articles', '(title)'),
+    ('idx_infobox_fields_key', 'infobox_fields', '(key, article_id)'),
+    ('idx_infobox_fields_type', 'infobox_fields', '(infobox_type, key)'),
+    ('idx_infobox_fields_article', 'infobox_fields', '(article_id)'),
+    ('idx_redirects_target_title', 'redirects', '(target_title)'),
+    ('idx_redirects_target_id', 'redirects', '(target_id)'),
+]
+
+# Full-text indexes over titles and section text. They are external content tables, so the
+# text is not stored twice; sections are read through a view that decompresses them.
+FTS_TABLES = [
+    ('articles_fts', 'articles', 'article_id', 'title'),
+    ('sections_fts', 'article_sections_text', 'id', 'section_content'),
+]
+FTS_OPTIONS = "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+
+def create_fts(conn):
+    """
+    Build the full-text indexes of a shard the first time it is finalized.
+
+    The indexes are filled in one pass over the loaded shard, not while it is bulk loaded.
+    Afterwards triggers keep them in sync with articles and article_sections, so the pages
+    written by later updates are indexed as they are written. The triggers read sections
+    through wiki_decompress, which connections writing to the shard have to provide (see
+    compression.ShardConnection).
+    """
+    c = conn.cursor()
+    if table_exists(c, 'sections_fts'):
+        return
+    c.execute('''
+    CREATE VIEW IF NOT EXISTS article_sections_text AS
+    SELECT id, wiki_decompress(section_content) AS section_content FROM article_sections
+    ''')
+    for fts_table, content_table, rowid_column, column in FTS_TABLES:
+        c.execute(f"CREATE VIRTUAL TABLE {fts_table} USING fts5({column}, content='{content_table}', content_rowid='{rowid_column}', {FTS_OPTIONS})")
+        c.execute(f"INSERT INTO {fts_table}({fts_table}) VALUES('rebuild')")
+
+    for fts_table, content_table, rowid_column, column, value in [
+        ('articles_fts', 'articles', 'article_id', 'title', '{}.title'),
+        ('sections_fts', 'article_sections', 'id', 'section_content', 'wiki_decompress({}.section_content)'),
+    ]:
+        insert = f"INSERT INTO {fts_table}(rowid, {column}) VALUES (new.{rowid_column}, {value.format('new')});"
+        delete = f"INSERT INTO {fts_table}({fts_table}, rowid, {column}) VALUES ('delete', old.{rowid_column}, {value.format('old')});"
+        c.execute(f'CREATE TRIGGER {fts_table}_insert AFTER INSERT ON {content_table} BEGIN {insert} END')
+        c.execute(f'CREATE TRIGGER {fts_table}_delete AFTER DELETE ON {content_table} BEGIN {delete} END')
+        c.execute(f'CREATE TRIGGER {fts_table}_update AFTER UPDATE OF {column} ON {content_table} BEGIN {delete} {insert} END')
+    conn.commit()
+
+def finalize_shard(db_file):
+    """Create the secondary and full-text indexes of one shard and refresh its planner statistics."""
+    start_time = time.time()
+    conn = connect_shard(db_file)
+    conn.execute('PRAGMA journal_mode=WAL;')
+    conn.execute('PRAGMA temp_store=MEMORY;')
+    conn.execute('PRAGMA cache_size=-1000000;')  # ~1 GB page cache for the index sorts
+
+    c = conn.cursor()
+    for index_name, table_name, columns in INDEXES:
+        # Shards written before a table was introduced do not have it
+        if not table_exists(c, table_name):
+            continue
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} {columns}')
+    conn.commit()
+    create_fts(conn)
+
+    conn.execute('ANALYZE;')
+    conn.commit()
+    conn.close()
+    return db_file, time.time() - start_time
+
+def finalize_shards(db_files=None, workers=None):
+    """
+    Finalize every shard, several shards at a time, then resolve their redirect targets and
+    rebuild the category and link graphs and the title index. Cached searches are invalidated.
+    """
+    if db_files is None:
+        db_files = get_db_files()
+    db_files = sorted(db_files, key=shard_number)
+    if not db_files:
+        print("No shards to finalize.")
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(db_files))
+    print(f"Finalizing {len(db_files)} shards with {workers} workers...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(finalize_shard, db_file) for db_file in db_files]
+        for future in as_completed(futures):
+            db_file, elapsed_time = future.result()
+            print(f"Finalized {os.path.basename(db_file)} in {elapsed_time:.1f}s")
+
+    # Needs the title index of every shard, so only once they are all finalized
+    resolve_redirects(db_files, workers=workers)
+    build_category_graph()
+    build_link_graph()
+    # Ranks titles by the links to them, so after the link graph
+    build_title_index()
+    # Searches cached before finalize are stale
+    bump_generation()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build indexes and statistics on the imported shards.")
+    parser.add_argument("db_files", nargs="*", help="Shards to finalize (default: every db_files/wikipedia_*.db)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of shards finalized at the same time")
+    args = parser.parse_args()
+
+    finalize_shards(args.db_files or None, workers=args.workers)
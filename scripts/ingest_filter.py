@@ -0,0 +1,117 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import re
+from collections import Counter
+
+REDIRECT_MODES = ('keep', 'skip', 'only')
+
+class IngestFilter:
+    """
+    Decides from cheap page metadata which pages of the dump are imported at all.
+
+    Applied where the dump is read (see wiki_parser.read_pages), so rejected pages never
+    reach mwparserfromhell. Every rejection is counted under the reason of the first check
+    that failed; take_counts() hands the counts gathered since its last call to the writer,
+    as the filter may run in the reader or parser processes.
+
+    Parameters:
+        namespaces (iterable of int): Namespaces to keep (None keeps all), e.g. {0} for articles only.
+        redirects (str): 'keep', 'skip' or 'only' redirect pages.
+        include_titles (list of str): Regexes, a title must match at least one of them.
+        exclude_titles (list of str): Regexes, a title matching any of them is skipped.
+        max_text_bytes (int): Skip pages whose wikitext is larger than this (UTF-8 bytes).
+    """
+    def __init__(self, namespaces=None, redirects='keep', include_titles=None, exclude_titles=None, max_text_bytes=None):
+        if redirects not in REDIRECT_MODES:
+            raise ValueError(f"Unknown redirects mode {redirects}, expected one of {REDIRECT_MODES}")
+        self.namespaces = frozenset(namespaces) if namespaces is not None else None
+        self.redirects = redirects
+        self.include_titles = [re.compile(pattern) for pattern in include_titles or []]
+        self.exclude_titles = [re.compile(pattern) for pattern in exclude_titles or []]
+        self.max_text_bytes = max_text_bytes
+        self.counts = Counter()
+
+        self.checks = []
+        if self.namespaces is not None:
+            self.checks.append(('namespace', self.namespace_allowed))
+        if self.redirects != 'keep':
+            self.checks.append(('redirect', self.redirect_allowed))
+        if self.include_titles or self.exclude_titles:
+            self.checks.append(('title', self.title_allowed))
+        if self.max_text_bytes is not None:
+            self.checks.append(('text_size', self.size_allowed))
+
+    def add_check(self, reason, check):
+        """Run check(raw_page) after the configured ones, counting rejections under reason."""
+        self.checks.append((reason, check))
+
+    def __bool__(self):
+        return bool(self.checks)
+
+    def __call__(self, raw_page):
+        for reason, check in self.checks:
+            if not check(raw_page):
+                self.counts[reason] += 1
+                return False
+        return True
+
+    def take_counts(self):
+        counts, self.counts = dict(self.counts), Counter()
+        return counts
+
+    def namespace_allowed(self, raw_page):
+        return raw_page.namespace in self.namespaces
+
+    def redirect_allowed(self, raw_page):
+        # Same test parse_page uses to flag redirects
+        is_redirect = raw_page.text.lstrip()[:9].lower() == '#redirect'
+        return is_redirect == (self.redirects == 'only')
+
+    def title_allowed(self, raw_page):
+        title = raw_page.title or ''
+        if self.include_titles and not any(pattern.search(title) for pattern in self.include_titles):
+            return False
+        return not any(pattern.search(title) for pattern in self.exclude_titles)
+
+    def size_allowed(self, raw_page):
+        text = raw_page.text
+        # A character takes 1 to 4 bytes, only encode when the length alone does not decide
+        if len(text) * 4 <= self.max_text_bytes:
+            return True
+        if len(text) > self.max_text_bytes:
+            return False
+        return len(text.encode('utf-8')) <= self.max_text_bytes
+
+def add_filter_arguments(parser):
+    """Add the ingest filter options to an argparse parser."""
+    parser.add_argument("--namespaces", help="Comma separated namespaces to import, e.g. 0 for articles or 0,14 for articles and categories (default: all)")
+    parser.add_argument("--redirects", choices=REDIRECT_MODES, default='keep', help="Import redirect pages, skip them or import only them")
+    parser.add_argument("--include-title", action="append", default=[], help="Only import pages whose title matches this regex (repeatable)")
+    parser.add_argument("--exclude-title", action="append", default=[], help="Skip pages whose title matches this regex (repeatable)")
+    parser.add_argument("--max-text-bytes", type=int, default=None, help="Skip pages whose wikitext is larger than this many bytes")
+
+def filter_from_args(args):
+    namespaces = None
+    if args.namespaces:
+        namespaces = [int(namespace) for namespace in args.namespaces.split(',')]
+    return IngestFilter(namespaces=namespaces, redirects=args.redirects, include_titles=args.include_title,
+                        exclude_titles=args.exclude_title, max_text_bytes=args.max_text_bytes)
@@ -0,0 +1,169 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import psutil
+
+# Stages of the import, in pipeline order. read, parse and clean are measured where they
+# run (the reader and parser processes when --workers > 1), write, commit and rotate in the writer.
+STAGES = ('read', 'parse', 'clean', 'wait', 'write', 'commit', 'rotate')
+
+COUNTERS = ('pages', 'sections', 'categories', 'bytes_read', 'commits', 'shard_rotations', 'skipped_pages')
+
+class IngestMetrics:
+    """
+    Per-stage timers and counters of an import, periodically written out as a JSON-lines
+    file and/or a Prometheus text-format file (for the node_exporter textfile collector).
+
+    Throughput is reported both cumulatively and over the window since the previous emit.
+    Stage seconds are summed over processes, so with several parser workers parse and clean
+    can add up to more than the wall clock time.
+    """
+    def __init__(self, metrics_file=None, prometheus_file=None, interval=10.0):
+        self.metrics_file = metrics_file
+        self.prometheus_file = prometheus_file
+        self.interval = interval
+        self.process = psutil.Process(os.getpid())
+
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.filtered = {}
+        self.commit_max = 0.0
+
+        self.start_time = time.time()
+        self.last_emit_time = self.start_time
+        self.last_emit_counters = dict(self.counters)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def add(self, stage, seconds):
+        self.stage_seconds[stage] += seconds
+
+    def add_timings(self, timings):
+        """Add the stage timings measured in another process (a dict of stage to seconds)."""
+        for stage, seconds in timings.items():
+            self.stage_seconds[stage] += seconds
+
+    def add_filtered(self, counts):
+        """Add the pages an ingest filter rejected, counted by reason."""
+        for reason, n in counts.items():
+            self.filtered[reason] = self.filtered.get(reason, 0) + n
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] += time.perf_counter() - start
+
+    def observe_commit(self, seconds):
+        self.counters['commits'] += 1
+        self.stage_seconds['commit'] += seconds
+        self.commit_max = max(self.commit_max, seconds)
+
+    def snapshot(self, now=None):
+        now = now or time.time()
+        elapsed = now - self.start_time
+        window = now - self.last_emit_time
+        window_pages = self.counters['pages'] - self.last_emit_counters['pages']
+        window_bytes = self.counters['bytes_read'] - self.last_emit_counters['bytes_read']
+        commits = self.counters['commits']
+        return {
+            'time': datetime.fromtimestamp(now).isoformat(timespec='seconds'),
+            'elapsed_seconds': round(elapsed, 3),
+            'counters': dict(self.counters),
+            'filtered': dict(self.filtered),
+            'stage_seconds': {stage: round(seconds, 6) for stage, seconds in self.stage_seconds.items()},
+            'commit_seconds': {
+                'count': commits,
+                'mean': round(self.stage_seconds['commit'] / commits, 6) if commits else 0.0,
+                'max': round(self.commit_max, 6),
+            },
+            'throughput': {
+                'pages_per_second': self.counters['pages'] / elapsed if elapsed > 0 else 0.0,
+                'window_seconds': round(window, 3),
+                'window_pages_per_second': window_pages / window if window > 0 else 0.0,
+                'window_bytes_per_second': window_bytes / window if window > 0 else 0.0,
+            },
+            'memory_rss_bytes': self.process.memory_info().rss,
+        }
+
+    def maybe_emit(self):
+        """Emit when the interval has passed since the previous emit."""
+        now = time.time()
+        if now - self.last_emit_time >= self.interval:
+            self.emit(now)
+
+    def emit(self, now=None):
+        now = now or time.time()
+        snapshot = self.snapshot(now)
+        if self.metrics_file:
+            with open(self.metrics_file, 'a') as metrics_file:
+                metrics_file.write(json.dumps(snapshot) + '\n')
+        if self.prometheus_file:
+            write_prometheus(self.prometheus_file, snapshot)
+        self.last_emit_time = now
+        self.last_emit_counters = dict(self.counters)
+        return snapshot
+
+    def summary(self):
+        """The time spent per stage and the pages filtered out per reason, for the end of an import."""
+        summary = 'Time by stage: ' + ', '.join(f'{stage} {seconds:.1f}s' for stage, seconds in self.stage_seconds.items())
+        if self.filtered:
+            summary += '\nFiltered out: ' + ', '.join(f'{n} pages by {reason}' for reason, n in self.filtered.items())
+        return summary
+
+def write_prometheus(file_path, snapshot):
+    """Write a snapshot in the Prometheus text exposition format, replacing the file atomically."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in samples:
+            lines.append(f'{name}{labels} {value}')
+
+    for counter, value in snapshot['counters'].items():
+        metric(f'wiki_ingest_{counter}_total', 'counter', f'Total {counter.replace("_", " ")} of the import.', [('', value)])
+    if snapshot['filtered']:
+        metric('wiki_ingest_filtered_pages_total', 'counter', 'Pages rejected by the ingest filter, by reason.',
+               [(f'{{reason="{reason}"}}', n) for reason, n in snapshot['filtered'].items()])
+    metric('wiki_ingest_stage_seconds_total', 'counter', 'Seconds spent per import stage.',
+           [(f'{{stage="{stage}"}}', seconds) for stage, seconds in snapshot['stage_seconds'].items()])
+    metric('wiki_ingest_commit_seconds_max', 'gauge', 'Slowest shard commit.', [('', snapshot['commit_seconds']['max'])])
+    metric('wiki_ingest_pages_per_second', 'gauge', 'Pages imported per second.',
+           [('{window="cumulative"}', snapshot['throughput']['pages_per_second']),
+            ('{window="interval"}', snapshot['throughput']['window_pages_per_second'])])
+    metric('wiki_ingest_bytes_per_second', 'gauge', 'Dump bytes read per second over the last interval.',
+           [('', snapshot['throughput']['window_bytes_per_second'])])
+    metric('wiki_ingest_memory_rss_bytes', 'gauge', 'Resident memory of the writer process.', [('', snapshot['memory_rss_bytes'])])
+
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'w') as prometheus_file:
+        prometheus_file.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, file_path)
@@ -0,0 +1,345 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import time
+
+import numpy as np
+
+from utils import get_db_files, connect_shard, normalize_title, shard_number
+from starter import table_exists
+
+# The link graph spans every shard and is kept next to them as memory-mappable .npy files
+LINK_GRAPH_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_files', 'link_graph')
+
+# Links with one of these prefixes do not point to articles (or are interwiki links)
+NON_ARTICLE_PREFIXES = {
+    'category', 'file', 'image', 'media', 'special', 'talk', 'user', 'wikipedia', 'wp', 'project',
+    'template', 'help', 'portal', 'draft', 'module', 'mediawiki', 'timedtext', 'book',
+    'wikt', 'wiktionary', 'commons', 'meta', 'm', 'wikisource', 's', 'wikiquote', 'q', 'wikibooks', 'b',
+    'wikinews', 'n', 'wikiversity', 'v', 'wikivoyage', 'voy', 'wikidata', 'd', 'species', 'mw', 'phab',
+}
+
+def extract_links(wikilinks):
+    """Normalized titles of the articles a page links to, in order of first appearance."""
+    links = []
+    seen = set()
+    for link in wikilinks:
+        title = normalize_title(str(link.title))
+        if not title or title in seen:
+            continue
+        if ':' in title:
+            prefix = title.split(':', 1)[0].strip().lower()
+            if prefix in NON_ARTICLE_PREFIXES or prefix.endswith(' talk'):
+                continue
+        seen.add(title)
+        links.append(title)
+    return links
+
+def title_hashes(titles):
+    """64 bit hashes of titles, so the title lookup of the build fits in numpy arrays."""
+    return np.fromiter((int.from_bytes(hashlib.blake2b(title.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+                        for title in titles), dtype=np.int64, count=len(titles))
+
+class TitleLookup:
+    """Title hash -> node index over the articles of every shard, redirects included."""
+    def __init__(self, hashes, nodes):
+        # Stable sort with article titles first: a redirect never shadows an article's title
+        order = np.argsort(hashes, kind='stable')
+        hashes, nodes = hashes[order], nodes[order]
+        hashes, first = np.unique(hashes, return_index=True)
+        self.hashes, self.nodes = hashes, nodes[first]
+
+    def find(self, titles):
+        """Node index of every title, -1 for titles that are not in the graph."""
+        hashes = title_hashes(titles)
+        if len(self.hashes) == 0:
+            return np.full(len(titles), -1, dtype=np.int32)
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        return np.where(self.hashes[positions] == hashes, self.nodes[positions], -1).astype(np.int32)
+
+def iter_hashed_rows(c, batch_rows):
+    """(ids, title hashes) arrays of the (title, id) rows of a query, batch_rows rows at a time."""
+    while True:
+        rows = c.fetchmany(batch_rows)
+        if not rows:
+            return
+        titles, ids = zip(*rows)
+        yield np.array(ids, dtype=np.int64), title_hashes(titles)
+
+def concatenate(chunks, dtype):
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+def load_nodes(db_files, batch_rows=65536):
+    """
+    Article ids of the graph nodes (every page that is not a redirect) and the title lookup.
+
+    Titles are hashed as they are read, batch_rows at a time, so only their hashes are kept
+    and the title lookup is built from numpy arrays without a list of every title.
+    """
+    article_ids, hashes = [], []
+    redirect_targets, redirect_hashes = [], []
+    for db_file in db_files:
+        conn = connect_shard(db_file)
+        c = conn.cursor()
+        c.execute('SELECT title, article_id FROM articles WHERE is_redirect = 0')
+        for ids, title_hash in iter_hashed_rows(c, batch_rows):
+            article_ids.append(ids)
+            hashes.append(title_hash)
+        if table_exists(c, 'redirects'):
+            c.execute('''
+            SELECT a.title, r.target_id
+            FROM redirects r
+            JOIN articles a ON a.article_id = r.source_id
+            WHERE r.target_id IS NOT NULL
+            ''')
+            for targets, title_hash in iter_hashed_rows(c, batch_rows):
+                redirect_targets.append(targets)
+                redirect_hashes.append(title_hash)
+        conn.close()
+
+    article_ids = concatenate(article_ids, np.int64)
+    node_ids = np.unique(article_ids)
+    nodes = np.searchsorted(node_ids, article_ids)
+    del article_ids
+    # Redirects to a page that is not a node (such as a double redirect) lead nowhere
+    targets = concatenate(redirect_targets, np.int64)
+    target_nodes = np.minimum(np.searchsorted(node_ids, targets), max(len(node_ids) - 1, 0))
+    resolved = node_ids[target_nodes] == targets if len(node_ids) else np.zeros(len(targets), dtype=bool)
+
+    hashes = np.concatenate([concatenate(hashes, np.int64), concatenate(redirect_hashes, np.int64)[resolved]])
+    lookup = TitleLookup(hashes, np.concatenate([nodes, target_nodes[resolved]]).astype(np.int32))
+    return node_ids, lookup
+
+def iter_edge_chunks(db_files, node_ids, lookup, chunk_edges):
+    """
+    Yield the edges of the graph as (sources, targets) node index arrays of up to about
+    chunk_edges edges. The links of an article are never split over two chunks, so the
+    edges of a chunk are made unique (and sorted) on their own.
+    """
+    def to_edges(sources, counts, titles):
+        sources = np.repeat(np.array(sources, dtype=np.int64), counts)
+        targets = lookup.find(titles).astype(np.int64)
+        keep = (targets >= 0) & (targets != sources)
+        edges = np.unique((sources[keep] << 32) | targets[keep])
+        return (edges >> 32).astype(np.int32), (edges & 0xFFFFFFFF).astype(np.int32)
+
+    sources, counts, titles = [], [], []
+    for db_file in db_files:
+        conn = connect_shard(db_file)
+        c = conn.cursor()
+        if not table_exists(c, 'article_links'):
+            conn.close()
+            continue
+        decompress = conn.codec.decompress
+        c.execute('SELECT article_id, targets FROM article_links')
+        for article_id, targets in c:
+            node = np.searchsorted(node_ids, article_id)
+            if node == len(node_ids) or node_ids[node] != article_id:
+                continue
+            links = decompress(targets).split('\n')
+            sources.append(node)
+            counts.append(len(links))
+            titles.extend(links)
+            if len(titles) >= chunk_edges:
+                yield to_edges(sources, counts, titles)
+                sources, counts, titles = [], [], []
+        conn.close()
+    if titles:
+        yield to_edges(sources, counts, titles)
+
+def sort_rows(adjacency, offsets, block_edges):
+    """
+    Sort every row of a CSR array in place, rows of about block_edges values at a time.
+    Rows are usually in order already, as shards hold ascending article id ranges, so a
+    block is only sorted when it is found out of order.
+    """
+    node_count = len(offsets) - 1
+    start = 0
+    while start < node_count:
+        stop = int(np.searchsorted(offsets, offsets[start] + block_edges, side='right')) - 1
+        stop = min(max(stop, start + 1), node_count)
+        values = np.asarray(adjacency[offsets[start]:offsets[stop]])
+        keys = np.repeat(np.arange(start, stop), np.diff(offsets[start:stop + 1]))
+        if np.any((np.diff(values) < 0) & (np.diff(keys) == 0)):
+            adjacency[offsets[start]:offsets[stop]] = values[np.lexsort((values, keys))]
+        start = stop
+
+def fill_adjacency(chunk_files, key_column, node_count, path, block_edges):
+    """
+    Write the CSR arrays of the edges in chunk_files, grouped by key_column (0 for outgoing
+    links, 1 for backlinks), to path_offsets.npy and the memory-mapped path.npy, one chunk
+    in memory at a time. Rows are then sorted block_edges values at a time.
+    """
+    degrees = np.zeros(node_count, dtype=np.int64)
+    for chunk_file in chunk_files:
+        keys = np.load(chunk_file)[key_column]
+        degrees += np.bincount(keys, minlength=node_count)
+    offsets = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(degrees, out=offsets[1:])
+    np.save(path + '_offsets.npy', offsets)
+
+    adjacency = np.lib.format.open_memmap(path + '.npy', mode='w+', dtype=np.int32, shape=(int(offsets[-1]),))
+    cursor = offsets[:-1].copy()
+    for chunk_file in chunk_files:
+        edges = np.load(chunk_file)
+        keys, values = edges[key_column], edges[1 - key_column]
+        order = np.argsort(keys, kind='stable')
+        keys, values = keys[order], values[order]
+        # Position of each edge among the edges of its node in this chunk
+        rank = np.arange(len(keys)) - np.searchsorted(keys, keys)
+        adjacency[cursor[keys] + rank] = values
+        cursor += np.bincount(keys, minlength=node_count)
+    sort_rows(adjacency, offsets, block_edges)
+    adjacency.flush()
+    del adjacency
+
+def build_link_graph(db_files=None, output_dir=LINK_GRAPH_DIR, memory_mb=1024):
+    """
+    Build the CSR adjacency of the links between articles of all shards into output_dir.
+
+    Nodes are the pages that are not redirects, numbered in article id order (node_ids.npy).
+    Links to a redirect point to its target. Edges are gathered in chunks sized to
+    memory_mb and spilled to disk, and the adjacency arrays are written through memory maps,
+    so the build stays within about memory_mb on top of the title lookup (12 bytes a title).
+    The graph replaces the previous one only once it is complete.
+    """
+    start_time = time.time()
+    if db_files is None:
+        db_files = get_db_files()
+    db_files = sorted(db_files, key=shard_number)
+    if not db_files:
+        print("No shards to build the link graph from.")
+        return
+
+    tmp_dir = output_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    node_ids, lookup = load_nodes(db_files)
+    np.save(os.path.join(tmp_dir, 'node_ids.npy'), node_ids)
+    print(f"Loaded {len(node_ids)} articles and {len(lookup.hashes)} titles in {time.time() - start_time:.1f}s")
+
+    # About 32 bytes an edge while a chunk is sorted and scattered
+    chunk_edges = max(memory_mb * 1024 * 1024 // 32, 1)
+    chunk_files, edge_count = [], 0
+    for chunk in iter_edge_chunks(db_files, node_ids, lookup, chunk_edges):
+        chunk_file = os.path.join(tmp_dir, f'edges_{len(chunk_files)}.npy')
+        np.save(chunk_file, np.stack(chunk))
+        chunk_files.append(chunk_file)
+        edge_count += len(chunk[0])
+    del lookup
+
+    fill_adjacency(chunk_files, 0, len(node_ids), os.path.join(tmp_dir, 'targets'), chunk_edges)
+    fill_adjacency(chunk_files, 1, len(node_ids), os.path.join(tmp_dir, 'sources'), chunk_edges)
+    for chunk_file in chunk_files:
+        os.remove(chunk_file)
+
+    old_dir = output_dir + '.old'
+    if os.path.exists(output_dir):
+        os.replace(output_dir, old_dir)
+    os.replace(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"Built the link graph of {len(node_ids)} articles and {edge_count} links in {time.time() - start_time:.1f}s")
+
+class LinkGraph:
+    """
+    The link graph built by build_link_graph, memory-mapped.
+
+    targets_offsets.npy and targets.npy are the CSR arrays of the outgoing links: the links
+    of node i are targets[targets_offsets[i]:targets_offsets[i + 1]], sorted. sources and
+    sources_offsets hold the backlinks the same way. Nodes are indexes into node_ids, the
+    sorted article ids. Only the pages that are touched are read, so the graph of all of
+    Wikipedia opens in any amount of RAM and traversals run on numpy slices, not queries.
+    """
+    def __init__(self, path=LINK_GRAPH_DIR):
+        self.path = path
+        self.node_ids = np.load(os.path.join(path, 'node_ids.npy'), mmap_mode='r')
+        self.targets_offsets = np.load(os.path.join(path, 'targets_offsets.npy'), mmap_mode='r')
+        self.targets = np.load(os.path.join(path, 'targets.npy'), mmap_mode='r')
+        self.sources_offsets = np.load(os.path.join(path, 'sources_offsets.npy'), mmap_mode='r')
+        self.sources = np.load(os.path.join(path, 'sources.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def node(self, article_id):
+        """Node index of an article, raising KeyError when it is not in the graph."""
+        node = int(np.searchsorted(self.node_ids, article_id))
+        if node == len(self.node_ids) or self.node_ids[node] != article_id:
+            raise KeyError(f"Article {article_id} is not in the link graph")
+        return node
+
+    def out_neighbors(self, node):
+        """Zero-copy view of the nodes node links to."""
+        return self.targets[self.targets_offsets[node]:self.targets_offsets[node + 1]]
+
+    def in_neighbors(self, node):
+        """Zero-copy view of the nodes linking to node."""
+        return self.sources[self.sources_offsets[node]:self.sources_offsets[node + 1]]
+
+    def links(self, article_id):
+        """Article ids an article links to."""
+        return self.node_ids[self.out_neighbors(self.node(article_id))]
+
+    def backlinks(self, article_id):
+        """Article ids of the articles linking to an article."""
+        return self.node_ids[self.in_neighbors(self.node(article_id))]
+
+    def expand(self, nodes, reverse=False):
+        """Unique neighbors of a set of nodes, following backlinks when reverse is set."""
+        neighbors = self.in_neighbors if reverse else self.out_neighbors
+        if len(nodes) == 0:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate([neighbors(node) for node in nodes]))
+
+    def traverse(self, article_id, max_depth=2, reverse=False, limit=None):
+        """
+        Breadth first walk from an article. Returns {article_id: depth} of every article
+        reached within max_depth links, stopping early once limit articles are reached.
+        """
+        start = self.node(article_id)
+        visited = np.zeros(len(self.node_ids), dtype=bool)
+        visited[start] = True
+        depths = {int(self.node_ids[start]): 0}
+        frontier = np.array([start], dtype=np.int32)
+        for depth in range(1, max_depth + 1):
+            frontier = self.expand(frontier, reverse)
+            frontier = frontier[~visited[frontier]]
+            if limit is not None:
+                frontier = frontier[:max(limit - len(depths), 0)]
+            if len(frontier) == 0:
+                break
+            visited[frontier] = True
+            depths.update((int(article), depth) for article in self.node_ids[frontier])
+        return depths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the link graph of the imported shards.")
+    parser.add_argument("db_files", nargs="*", help="Shards to read (default: every db_files/wikipedia_*.db)")
+    parser.add_argument("--output", default=LINK_GRAPH_DIR, help="Directory the graph files are written to")
+    parser.add_argument("--memory-mb", type=int, default=1024, help="Memory for edges while the graph is built")
+    args = parser.parse_args()
+
+    build_link_graph(args.db_files or None, output_dir=args.output, memory_mb=args.memory_mb)
@@ -0,0 +1,144 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import bz2
+import argparse
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+import numpy as np
+
+from dump_reader import iter_fragment_pages
+
+# One independently decompressible bz2 stream of a multistream dump
+Stream = namedtuple('Stream', ['offset', 'first_page_id', 'last_page_id', 'pages'])
+
+def read_index(index_path):
+    """
+    Read a multistream index (-index.txt.bz2) into a list of Stream, ordered by offset.
+
+    Each index line has the form "offset:page_id:title", where offset is the byte position
+    of the bz2 stream that holds the page.
+    """
+    streams = {}
+    with bz2.open(index_path, 'rt', encoding='utf-8') as index_file:
+        for line in index_file:
+            if not line.strip():
+                continue
+            offset, page_id, _title = line.rstrip('\n').split(':', 2)
+            offset, page_id = int(offset), int(page_id)
+            if offset in streams:
+                stream = streams[offset]
+                streams[offset] = stream._replace(first_page_id=min(stream.first_page_id, page_id),
+                                                  last_page_id=max(stream.last_page_id, page_id),
+                                                  pages=stream.pages + 1)
+            else:
+                streams[offset] = Stream(offset, page_id, page_id, 1)
+    return [streams[offset] for offset in sorted(streams)]
+
+def read_index_page_ids(index_path):
+    """Return the id of every page listed in a multistream index, as an int64 array."""
+    with bz2.open(index_path, 'rt', encoding='utf-8') as index_file:
+        return np.fromiter((int(line.split(':', 2)[1]) for line in index_file if line.strip()), dtype=np.int64)
+
+def count_index_pages(index_path):
+    return sum(stream.pages for stream in read_index(index_path))
+
+def read_stream(dump_path, offset, chunk_size=256 * 1024):
+    """Decompress the single bz2 stream starting at byte offset of the dump."""
+    decompressor = bz2.BZ2Decompressor()
+    data = []
+    with open(dump_path, 'rb') as dump_file:
+        dump_file.seek(offset)
+        while not decompressor.eof:
+            chunk = dump_file.read(chunk_size)
+            if not chunk:
+                raise EOFError(f"bz2 stream at offset {offset} of {dump_path} is truncated")
+            data.append(decompressor.decompress(chunk))
+    return b''.join(data)
+
+def iter_stream_pages(dump_path, offset):
+    """Yield a RawPage for every page of the stream at offset."""
+    return iter_fragment_pages(read_stream(dump_path, offset), offset)
+
+def iter_streams(index_path, last_page_id=None, start_offset=0):
+    """Yield the streams at or after start_offset that still hold pages after last_page_id."""
+    for stream in read_index(index_path):
+        if stream.offset < start_offset:
+            continue
+        if last_page_id is not None and stream.last_page_id <= last_page_id:
+            continue
+        yield stream
+
+def iter_dump_pages(dump_path, index_path, last_page_id=None, start_offset=0):
+    """
+    Yield a RawPage for every page of a multistream dump after last_page_id.
+
+    A page's offset is the byte position of the bz2 stream holding it, the position a
+    checkpoint records so a resumed import only has to reopen that one stream.
+    """
+    for stream in iter_streams(index_path, last_page_id, start_offset):
+        for raw_page in iter_stream_pages(dump_path, stream.offset):
+            if last_page_id is not None and raw_page.page_id <= last_page_id:
+                continue
+            yield raw_page
+
+def write_multistream(xml_path, dump_path, index_path, pages_per_stream=100):
+    """
+    Build a multistream dump and its index from a plain XML dump.
+
+    Mirrors the layout of the official dumps: the siteinfo header and the closing tag get a
+    stream of their own, and every pages_per_stream pages are compressed as one stream.
+    Used to make small fixtures so the multistream ingest can be exercised offline.
+    """
+    with open(xml_path, 'rb') as xml_file:
+        xml_bytes = xml_file.read()
+
+    starts = []
+    position = xml_bytes.find(b'<page>')
+    while position != -1:
+        starts.append(position)
+        position = xml_bytes.find(b'<page>', position + 1)
+    last_page = xml_bytes.rfind(b'</page>') + len(b'</page>')
+
+    # Split on <page> boundaries so the decompressed streams concatenate back to the input
+    boundaries = starts[::pages_per_stream] + [last_page]
+    with open(dump_path, 'wb') as dump_file, bz2.open(index_path, 'wt', encoding='utf-8') as index_file:
+        dump_file.write(bz2.compress(xml_bytes[:starts[0]]))
+        for start, end in zip(boundaries, boundaries[1:]):
+            offset = dump_file.tell()
+            group = xml_bytes[start:end]
+            dump_file.write(bz2.compress(group))
+            for page_elem in ET.fromstring(b'<pages>' + group + b'</pages>'):
+                index_file.write(f"{offset}:{page_elem.findtext('id')}:{page_elem.findtext('title')}\n")
+        dump_file.write(bz2.compress(xml_bytes[last_page:]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a multistream bz2 dump and index from a plain XML dump.")
+    parser.add_argument("xml_path", help="Path to the extracted XML file")
+    parser.add_argument("--pages-per-stream", type=int, default=100, help="Pages compressed into each bz2 stream")
+    args = parser.parse_args()
+
+    base_path = args.xml_path[:-len(".xml")] if args.xml_path.endswith(".xml") else args.xml_path
+    dump_path = base_path + "-multistream.xml.bz2"
+    index_path = base_path + "-multistream-index.txt.bz2"
+    write_multistream(args.xml_path, dump_path, index_path, pages_per_stream=args.pages_per_stream)
+    print(f"Wrote {dump_path} and {index_path}")
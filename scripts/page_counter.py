@@ -19,31 +19,111 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import mwxml
 import time
 import json
 import os
+import mmap
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from multistream import count_index_pages
+
+PAGE_TAG = b'<page>'
+
+def read_page_id(mm, page_start):
+    """Return the id of the page whose <page> tag starts at page_start (its first <id> element)."""
+    id_start = mm.find(b'<id>', page_start)
+    id_end = mm.find(b'</id>', id_start)
+    return int(mm[id_start + len(b'<id>'):id_end])
+
+def scan_chunk(file_path, start, end):
+    """
+    Count the <page> tags starting inside [start, end) of the dump.
+
+    Returns a dict with the chunk bounds, its page count and the ids of its first and last
+    page, read straight from the raw bytes without parsing any XML.
+    """
+    with open(file_path, 'rb') as dump_file:
+        with mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # Overlap by len(PAGE_TAG) - 1 so a tag straddling the boundary is counted once, here
+            window_end = min(end + len(PAGE_TAG) - 1, len(mm))
+            pages = mm[start:window_end].count(PAGE_TAG)
+
+            first_page_id = last_page_id = None
+            if pages:
+                first_page_id = read_page_id(mm, mm.find(PAGE_TAG, start, window_end))
+                last_page_id = read_page_id(mm, mm.rfind(PAGE_TAG, start, window_end))
+
+    return {
+        "start": start,
+        "end": end,
+        "pages": pages,
+        "first_page_id": first_page_id,
+        "last_page_id": last_page_id,
+    }
+
+def scan_chunk_ids(file_path, start, end):
+    """Return the ids of the pages whose <page> tag starts inside [start, end) of the dump, as an int64 array."""
+    page_ids = []
+    with open(file_path, 'rb') as dump_file:
+        with mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            window_end = min(end + len(PAGE_TAG) - 1, len(mm))
+            page_start = mm.find(PAGE_TAG, start, window_end)
+            while page_start != -1:
+                page_ids.append(read_page_id(mm, page_start))
+                page_start = mm.find(PAGE_TAG, page_start + 1, window_end)
+    return np.array(page_ids, dtype=np.int64)
+
+def scan_page_ids(file_path, workers=None, chunk_size=64 * 1024 * 1024):
+    """
+    Return the ids of every page of a plain XML dump as an int64 array, in dump order,
+    scanning chunks in parallel. Only each chunk's ids are ever held as Python ints.
+    """
+    file_size = os.path.getsize(file_path)
+    bounds = [(start, min(start + chunk_size, file_size)) for start in range(0, file_size, chunk_size)]
+
+    chunks, count = [], 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(scan_chunk_ids, file_path, start, end) for start, end in bounds]
+        for future in futures:
+            chunks.append(future.result())
+            count += len(chunks[-1])
+            print(f'Listed {count} page ids so far\r', end="")
+    print()
+    return np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int64)
+
+def scan_pages(file_path, workers=None, chunk_size=64 * 1024 * 1024):
+    """
+    Count the pages of a plain XML dump by scanning memory-mapped chunks in several processes.
+
+    Besides the total, the per-chunk byte ranges and first/last page ids are returned so
+    progress through the dump can be expressed (and estimated) by byte position.
+    """
+    file_size = os.path.getsize(file_path)
+    bounds = [(start, min(start + chunk_size, file_size)) for start in range(0, file_size, chunk_size)]
 
-def count_pages(file_path):
-    dump = mwxml.Dump.from_file(open(file_path, 'rb'))
-    count = 0
     start_time = time.time()
-    
-    page=None
-    for page in dump:
-        count += 1
-        
-        if count % 25000 == 0:
+    chunks = []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(scan_chunk, file_path, start, end) for start, end in bounds]
+        for future in futures:
+            chunks.append(future.result())
+            count = sum(chunk["pages"] for chunk in chunks)
             elapsed_time = time.time() - start_time
-            pages_per_second = count / elapsed_time
-            print(f'Counted {count} pages so far, {pages_per_second:.2f} pages per second\r', end="")
-    print("___Example___")
-    print(f"Type:\t{type(page)}")
-    print(f"Page:\t{page}")
+            print(f'Counted {count} pages so far, {chunks[-1]["end"] / (1024 ** 2) / max(elapsed_time, 1e-9):.2f} MB per second\r', end="")
+
+    return {
+        "total_pages": sum(chunk["pages"] for chunk in chunks),
+        "file_size": file_size,
+        "chunks": chunks,
+    }
 
-    return count
+def count_pages(file_path, workers=None):
+    return scan_pages(file_path, workers=workers)["total_pages"]
 
-def counter_(input_file_path, output_json_path):
+def counter_(input_file_path, output_json_path, index_path=None, workers=None):
     # Path to your extracted XML file
     file_path = input_file_path
     json_path = output_json_path
@@ -52,16 +132,33 @@ def counter_(input_file_path, output_json_path):
     if not os.path.exists(json_path):
         # Count total pages
         print('Counting total pages...')
-        total_pages = count_pages(file_path)
+        if index_path:
+            # Multistream dumps list every page in their index, no need to decompress the dump
+            page_counts = {
+                "total_pages": count_index_pages(index_path),
+                "file_size": os.path.getsize(file_path),
+            }
+        else:
+            page_counts = scan_pages(file_path, workers=workers)
+        total_pages = page_counts["total_pages"]
         print()
         print(f'Total pages in the dump: {total_pages}')
 
         # Save to JSON file
         with open(json_path, 'w') as f:
-            json.dump({"total_pages": total_pages}, f)
+            json.dump(page_counts, f)
     else:
         # Load total pages from JSON file
         with open(json_path, 'r') as f:
             total_pages = json.load(f)["total_pages"]
 
     print(f'Total pages expected: {total_pages}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Count the pages of a Wikipedia dump file.")
+    parser.add_argument("file_path", help="Path to the extracted XML file")
+    parser.add_argument("--workers", type=int, default=None, help="Number of processes scanning the dump")
+    args = parser.parse_args()
+
+    counter_(input_file_path=args.file_path, output_json_path=args.file_path.replace(".xml", "_pageCount.json"),
+             workers=args.workers)
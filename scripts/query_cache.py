@@ -0,0 +1,285 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import hashlib
+import inspect
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from utils import get_db_files
+from category_graph import GRAPH_FILE
+
+DB_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_files')
+# Bumped by finalize (or by hand) to drop every cached result, whatever the shard files say
+GENERATION_FILE = os.path.join(DB_FILES_DIR, 'generation')
+DISK_CACHE_FILE = os.path.join(DB_FILES_DIR, 'query_cache.db')
+
+# Returned by QueryCache.get when there is no valid entry, as None is a valid result
+MISSING = object()
+
+def read_generation():
+    try:
+        with open(GENERATION_FILE) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+def bump_generation():
+    """Invalidate the cached results of every process using the shards, returns the new generation."""
+    generation = read_generation() + 1
+    os.makedirs(DB_FILES_DIR, exist_ok=True)
+    tmp_file = GENERATION_FILE + '.tmp'
+    with open(tmp_file, 'w') as f:
+        f.write(str(generation))
+    os.replace(tmp_file, GENERATION_FILE)
+    return generation
+
+def data_state():
+    """
+    Token of the data the searches read: the generation and the identity, size and
+    modification time of every shard, of its WAL (where writes land until a checkpoint)
+    and of the category graph. Any write to them gives another token.
+    """
+    signature = [read_generation()]
+    for path in sorted(get_db_files()) + [GRAPH_FILE]:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        signature.append((os.path.basename(path), stat.st_ino, stat.st_size, stat.st_mtime_ns))
+        # Readers create an empty WAL when there is none, only writes give it content
+        try:
+            stat = os.stat(path + '-wal')
+        except FileNotFoundError:
+            continue
+        if stat.st_size:
+            signature.append((stat.st_size, stat.st_mtime_ns))
+    return hashlib.blake2b(repr(signature).encode('utf-8'), digest_size=16).hexdigest()
+
+def cache_key(name, arguments):
+    return hashlib.blake2b(repr((name, arguments)).encode('utf-8'), digest_size=20).hexdigest()
+
+class QueryCache:
+    """
+    Search results kept by key, least recently used first out once they take more than
+    max_bytes. Results are stored pickled: that is what their size is measured on, and every
+    hit gets a copy of its own to modify.
+
+    With disk_file, results are also written to an SQLite database, bounded by
+    max_disk_bytes, which outlives the process and is shared by every process using it.
+    A memory miss looks there before running the search.
+
+    Every entry records the data_state it was computed in. The state is checked again at
+    most every state_ttl seconds (a stat of each shard); once it changed, the entries of
+    the old state are dropped from both tiers, so a result can be stale for state_ttl at most.
+    """
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_file=None, max_disk_bytes=1024 * 1024 * 1024, state_ttl=1.0):
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.state_ttl = state_ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> pickled result, most recently used last
+        self.size = 0
+        self.state = None
+        self.state_checked = 0.0
+        self.counters = {'hits': 0, 'misses': 0, 'disk_hits': 0, 'evictions': 0, 'disk_evictions': 0,
+                         'invalidations': 0}
+        self.disk = self.open_disk(disk_file) if disk_file else None
+
+    def open_disk(self, disk_file):
+        os.makedirs(os.path.dirname(os.path.abspath(disk_file)), exist_ok=True)
+        conn = sqlite3.connect(disk_file, check_same_thread=False, timeout=30)
+        conn.execute('PRAGMA journal_mode=WAL;')
+        conn.execute('PRAGMA synchronous=NORMAL;')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            state TEXT NOT NULL,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            last_used REAL NOT NULL
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_results_last_used ON results (last_used)')
+        conn.commit()
+        return conn
+
+    def current_state(self):
+        """The data_state, dropping the entries of the previous one when it changed."""
+        now = time.monotonic()
+        if self.state is not None and now - self.state_checked < self.state_ttl:
+            return self.state
+        state = data_state()
+        with self.lock:
+            if state != self.state:
+                self.counters['invalidations'] += len(self.entries)
+                self.entries.clear()
+                self.size = 0
+                if self.disk is not None:
+                    deleted = self.disk.execute('DELETE FROM results WHERE state != ?', (state,)).rowcount
+                    self.disk.commit()
+                    self.counters['invalidations'] += deleted
+                self.state = state
+            self.state_checked = now
+        return state
+
+    def get(self, key, state):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+                self.counters['hits'] += 1
+                return pickle.loads(value)
+
+            if self.disk is not None:
+                row = self.disk.execute('SELECT value FROM results WHERE key = ? AND state = ?', (key, state)).fetchone()
+                if row is not None:
+                    self.disk.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+                    self.disk.commit()
+                    self.counters['hits'] += 1
+                    self.counters['disk_hits'] += 1
+                    self.store(key, row[0])
+                    return pickle.loads(row[0])
+
+            self.counters['misses'] += 1
+        return MISSING
+
+    def put(self, key, state, result):
+        value = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            # Computed from data that changed meanwhile
+            if state != self.state:
+                return
+            self.store(key, value)
+            if self.disk is not None:
+                self.disk.execute('INSERT OR REPLACE INTO results (key, state, value, size, last_used) VALUES (?, ?, ?, ?, ?)',
+                                  (key, state, value, len(value), time.time()))
+                self.evict_disk()
+                self.disk.commit()
+
+    def store(self, key, value):
+        """Keep value in memory, evicting the least recently used entries beyond max_bytes."""
+        if len(value) > self.max_bytes:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.entries[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            evicted_key, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.counters['evictions'] += 1
+
+    def evict_disk(self):
+        excess = self.disk.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0] - self.max_disk_bytes
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self.disk.execute('SELECT key, size FROM results ORDER BY last_used'):
+            evicted.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.disk.executemany('DELETE FROM results WHERE key = ?', evicted)
+        self.counters['disk_evictions'] += len(evicted)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            if self.disk is not None:
+                self.disk.execute('DELETE FROM results')
+                self.disk.commit()
+
+    def stats(self):
+        """The counters, with the number and size of the entries held in memory."""
+        with self.lock:
+            return dict(self.counters, entries=len(self.entries), bytes=self.size)
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+            self.disk = None
+
+# The cache the searches of this process share, off until configure_query_cache turns it on
+_default_cache = None
+
+def configure_query_cache(enabled=True, **options):
+    """Replace the shared cache with one opened with other options (see QueryCache), or turn it off."""
+    global _default_cache
+    if _default_cache is not None:
+        _default_cache.close()
+    _default_cache = QueryCache(**options) if enabled else None
+
+def query_cache_stats():
+    return _default_cache.stats() if _default_cache is not None else {}
+
+def cached_search(func):
+    """
+    Decorator caching the results of a search function once configure_query_cache was
+    called. The key is the function and the exact values of all of its arguments (defaults
+    included): searches differing only in case or spacing are cached apart, as some of them
+    (exact category names, LIKE fallbacks) do not match the same articles.
+    """
+    signature = inspect.signature(func)
+    name = f"{func.__module__}.{func.__qualname__}"
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = _default_cache
+        if cache is None:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = cache_key(name, tuple(bound.arguments.items()))
+
+        state = cache.current_state()
+        result = cache.get(key, state)
+        if result is MISSING:
+            result = func(*args, **kwargs)
+            cache.put(key, state, result)
+        return result
+    return wrapper
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Invalidate or inspect the cached search results.")
+    parser.add_argument("--bump", action="store_true", help="Invalidate the results cached by every process")
+    parser.add_argument("--clear", action="store_true", help="Empty the on-disk cache")
+    parser.add_argument("--disk-file", default=DISK_CACHE_FILE, help="On-disk cache database")
+    args = parser.parse_args()
+
+    if args.bump:
+        print(f"Generation {bump_generation()}")
+    if os.path.exists(args.disk_file):
+        cache = QueryCache(disk_file=args.disk_file)
+        if args.clear:
+            cache.clear()
+        count, size = cache.disk.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+        print(f"{count} results ({size / 1024 / 1024:.1f} MB) cached on disk")
+        cache.close()
@@ -0,0 +1,104 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import psutil
+
+from dump_reader import iter_xml_pages
+
+HEADER = '''<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <dbname>enwiki</dbname>
+  </siteinfo>
+'''
+
+PAGE = '''  <page>
+    <title>Synthetic page {page_id}</title>
+    <ns>{namespace}</ns>
+    <id>{page_id}</id>
+{revisions}  </page>
+'''
+
+REVISION = '''    <revision>
+      <id>{revision_id}</id>
+      <text bytes="{size}" xml:space="preserve">{text}</text>
+    </revision>
+'''
+
+def write_synthetic_dump(file_path, pages, text_size=2000, revisions_every=50):
+    """Write a dump of synthetic pages; every revisions_every-th page carries a 20 revision history."""
+    body = ("'''Synthetic''' article text with a [[Link]], a {{template|x=1}} and a [[Category:Synthetic]]. " * (text_size // 90 + 1))[:text_size]
+    with open(file_path, 'w', encoding='utf-8') as dump_file:
+        dump_file.write(HEADER)
+        for page_id in range(1, pages + 1):
+            history = 20 if page_id % revisions_every == 0 else 1
+            revisions = ''.join(REVISION.format(revision_id=page_id * 100 + r, size=len(body), text=body)
+                                for r in range(history))
+            dump_file.write(PAGE.format(page_id=page_id, namespace=page_id % 3 and 0 or 14, revisions=revisions))
+        dump_file.write('</mediawiki>\n')
+
+def measure_reader(file_path, warmup_pages=1000, sample_every=1000):
+    """Read the whole dump and return (pages, baseline RSS, peak RSS) in bytes."""
+    process = psutil.Process(os.getpid())
+    baseline = peak = process.memory_info().rss
+    pages = 0
+    for _raw_page in iter_xml_pages(file_path):
+        pages += 1
+        if pages % sample_every == 0:
+            rss = process.memory_info().rss
+            if pages <= warmup_pages:
+                baseline = peak = rss
+            peak = max(peak, rss)
+    return pages, baseline, peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the dump reader runs in bounded memory.")
+    parser.add_argument("--pages", type=int, default=200000, help="Number of synthetic pages to generate")
+    parser.add_argument("--max-growth-mb", type=float, default=32.0, help="Allowed RSS growth after warmup")
+    parser.add_argument("--dump", help="Read this dump instead of generating a synthetic one")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = args.dump
+        if file_path is None:
+            file_path = os.path.join(tmp_dir, "synthetic-pages-articles.xml")
+            print(f"Writing {args.pages} synthetic pages...")
+            write_synthetic_dump(file_path, args.pages)
+        print(f"Reading {file_path} ({os.path.getsize(file_path) / (1024 ** 2):.0f} MB)...")
+
+        start_time = time.time()
+        pages, baseline, peak = measure_reader(file_path)
+        elapsed_time = time.time() - start_time
+
+    growth_mb = (peak - baseline) / (1024 ** 2)
+    print(f"Read {pages} pages in {elapsed_time:.1f}s, {pages / elapsed_time:.0f} pages per second")
+    print(f"RSS after warmup: {baseline / (1024 ** 2):.1f} MB, peak: {peak / (1024 ** 2):.1f} MB, growth: {growth_mb:.1f} MB")
+
+    if growth_mb > args.max_growth_mb:
+        print(f"FAILED: memory grew by more than {args.max_growth_mb} MB")
+        sys.exit(1)
+    print("OK: memory stayed flat")
@@ -0,0 +1,124 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from utils import get_db_files, normalize_title
+from starter import table_exists
+
+def parse_redirect_target(wikilinks):
+    """Return the title a '#REDIRECT [[Target#fragment|label]]' page points to, or None."""
+    for link in wikilinks:
+        target = normalize_title(str(link.title))
+        return target or None
+    return None
+
+def resolve_shard_redirects(db_file, target_files):
+    """
+    Fill in target_id for the unresolved redirects of one shard.
+
+    Every shard is attached in turn and its articles are matched on the indexed title, so a
+    redirect costs one index lookup per shard and no title list is held in memory.
+    """
+    start_time = time.time()
+    conn = sqlite3.connect(db_file)
+    conn.execute('PRAGMA journal_mode=WAL;')
+    c = conn.cursor()
+    if not table_exists(c, 'redirects'):
+        conn.close()
+        return db_file, 0, time.time() - start_time
+
+    resolved = 0
+    for target_file in target_files:
+        if os.path.abspath(target_file) == os.path.abspath(db_file):
+            schema = 'main'
+        else:
+            conn.execute('ATTACH DATABASE ? AS target', (target_file,))
+            schema = 'target'
+        c.execute(f'''
+        UPDATE redirects
+        SET target_id = (SELECT a.article_id FROM {schema}.articles a WHERE a.title = redirects.target_title)
+        WHERE target_id IS NULL
+        AND EXISTS (SELECT 1 FROM {schema}.articles a WHERE a.title = redirects.target_title)
+        ''')
+        resolved += c.rowcount
+        conn.commit()
+        if schema == 'target':
+            conn.execute('DETACH DATABASE target')
+
+    conn.close()
+    return db_file, resolved, time.time() - start_time
+
+def clear_redirect_targets(db_files, article_ids):
+    """
+    Reset target_id to NULL for the redirects of db_files that point at one of article_ids,
+    so the next resolve_redirects looks their target title up again. Returns the number of
+    redirects cleared.
+    """
+    article_ids = [(int(article_id),) for article_id in article_ids]
+    cleared = 0
+    for db_file in db_files:
+        conn = sqlite3.connect(db_file)
+        c = conn.cursor()
+        if table_exists(c, 'redirects'):
+            # One lookup of idx_redirects_target_id per id: target ids are only set by
+            # resolve_redirects, which runs on finalized shards, and finalize creates the index
+            c.executemany('UPDATE redirects SET target_id = NULL WHERE target_id = ?', article_ids)
+            cleared += c.rowcount
+            conn.commit()
+        conn.close()
+    return cleared
+
+def resolve_redirects(db_files=None, workers=None):
+    """
+    Resolve the redirect targets of the given shards (default: all) against every shard,
+    the given ones included.
+
+    Runs after the shards are finalized, as it relies on the articles title index. Only
+    redirects without a target_id are looked up, so it can be repeated after an update to
+    pick up new redirects and new target articles.
+    """
+    if db_files is None:
+        db_files = get_db_files()
+    target_files = sorted({os.path.abspath(db_file) for db_file in get_db_files() + list(db_files)})
+    if not db_files:
+        print("No shards to resolve redirects in.")
+        return
+
+    workers = min(workers or os.cpu_count() or 1, len(db_files))
+    print(f"Resolving redirects in {len(db_files)} shards with {workers} workers...")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(resolve_shard_redirects, db_file, target_files) for db_file in db_files]
+        for future in as_completed(futures):
+            db_file, resolved, elapsed_time = future.result()
+            print(f"Resolved {resolved} redirects in {os.path.basename(db_file)} in {elapsed_time:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resolve the redirect targets of the imported shards to article ids.")
+    parser.add_argument("db_files", nargs="*", help="Shards to resolve (default: every db_files/wikipedia_*.db)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of shards resolved at the same time")
+    args = parser.parse_args()
+
+    resolve_redirects(args.db_files or None, workers=args.workers)
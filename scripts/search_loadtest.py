@@ -0,0 +1,152 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import sqlite3
+import time
+from collections import Counter
+
+from utils import get_db_files
+from search_server import DEFAULT_PORT
+
+def sample_titles(count, seed=0):
+    """Titles of count random articles of the shards, to build queries from."""
+    rng = random.Random(seed)
+    shards = []
+    for db_file in get_db_files():
+        conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+        low, high = conn.execute('SELECT MIN(article_id), MAX(article_id) FROM articles').fetchone()
+        if low is not None:
+            shards.append((conn, low, high))
+    titles = []
+    for i in range(count * 10 if shards else 0):
+        conn, low, high = rng.choice(shards)
+        row = conn.execute('SELECT title FROM articles WHERE article_id >= ? AND is_redirect = 0 ORDER BY article_id LIMIT 1',
+                           (rng.randint(low, high),)).fetchone()
+        if row is not None:
+            titles.append(row[0])
+        if len(titles) == count:
+            break
+    for conn, low, high in shards:
+        conn.close()
+    return titles
+
+def build_requests(queries, ops, page_size, timeout):
+    """One request per query and op, in a shuffled order."""
+    requests = []
+    for query in queries:
+        words = query.split()
+        for op in ops:
+            if op == 'title':
+                params = {'title': query, 'page_size': page_size}
+            elif op == 'text':
+                params = {'text': words[0], 'page_size': page_size}
+            elif op == 'category':
+                params = {'category': words[0], 'page_size': page_size}
+            elif op == 'prefix':
+                params = {'prefix': query[:3], 'limit': page_size}
+            else:
+                raise ValueError(f"Unsupported op {op}")
+            requests.append({'op': op, 'params': params, 'timeout': timeout})
+    random.Random(1).shuffle(requests)
+    return requests
+
+async def run_client(host, port, requests, deadline, latencies, outcomes):
+    """Send requests one after the other until deadline, recording their latencies."""
+    reader, writer = await asyncio.open_connection(host, port, limit=64 * 1024 * 1024)
+    try:
+        for request_id, request in enumerate(requests):
+            if time.perf_counter() >= deadline:
+                break
+            start_time = time.perf_counter()
+            writer.write(json.dumps(dict(request, id=request_id)).encode('utf-8') + b'\n')
+            await writer.drain()
+            response = json.loads(await reader.readline())
+            latencies.append(time.perf_counter() - start_time)
+            outcomes['ok' if response['ok'] else response['error'].split(':')[0]] += 1
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float('nan')
+
+async def run_level(host, port, requests, concurrency, duration):
+    """Throughput and latency of concurrency clients sending requests for duration seconds."""
+    latencies, outcomes = [], Counter()
+    start_time = time.perf_counter()
+    deadline = start_time + duration
+    # Every client starts at its own place in the requests
+    await asyncio.gather(*(run_client(host, port, itertools.islice(itertools.cycle(requests), client * 7919 % len(requests), None),
+                                      deadline, latencies, outcomes)
+                           for client in range(concurrency)))
+    elapsed_time = time.perf_counter() - start_time
+    latencies.sort()
+    return {'concurrency': concurrency, 'requests': len(latencies), 'throughput': len(latencies) / elapsed_time,
+            'p50_ms': percentile(latencies, 0.50) * 1000, 'p99_ms': percentile(latencies, 0.99) * 1000, 'outcomes': dict(outcomes)}
+
+async def fetch_stats(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(b'{"op": "stats"}\n')
+    await writer.drain()
+    response = json.loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return response['result']
+
+async def load_test(host, port, requests, levels, duration):
+    print(f"{'clients':>8} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}  outcomes")
+    results = []
+    for concurrency in levels:
+        result = await run_level(host, port, requests, concurrency, duration)
+        results.append(result)
+        print(f"{result['concurrency']:>8} {result['requests']:>9} {result['throughput']:>9.1f} "
+              f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f}  {result['outcomes']}")
+    print(f"Server: {await fetch_stats(host, port)}")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the throughput and latency of a running search_server.py.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the server")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port of the server")
+    parser.add_argument("--levels", default="1,2,4,8,16,32", help="Comma separated numbers of concurrent clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds each level runs")
+    parser.add_argument("--ops", default="title,text,category,prefix", help="Comma separated operations to send")
+    parser.add_argument("--queries", default=None, help="File with one query per line (default: titles sampled from the shards)")
+    parser.add_argument("--sample", type=int, default=200, help="Number of titles sampled when no query file is given")
+    parser.add_argument("--page-size", type=int, default=20, help="page_size (or limit) of every request")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Timeout of every request in seconds")
+    args = parser.parse_args()
+
+    if args.queries:
+        with open(args.queries, 'r', encoding='utf-8') as f:
+            queries = [line.strip() for line in f if line.strip()]
+    else:
+        queries = sample_titles(args.sample)
+    if not queries:
+        parser.error("No queries to send")
+    requests = build_requests(queries, args.ops.split(','), args.page_size, args.timeout)
+    print(f"{len(requests)} distinct requests from {len(queries)} queries")
+    asyncio.run(load_test(args.host, args.port, requests, [int(level) for level in args.levels.split(',')], args.duration))
@@ -0,0 +1,244 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import wiki_searcher
+from utils import get_db_files
+from shard_fanout import configure_pool
+from shard_pool import configure_shard_pool, shard_connection, cancel_event
+from query_cache import configure_query_cache, query_cache_stats, DISK_CACHE_FILE
+
+DEFAULT_PORT = 8765
+
+# Operations of the protocol and the searches answering them, the request params being
+# their keyword arguments
+OPERATIONS = {
+    'title': wiki_searcher.search_articles_by_title_page,
+    'text': wiki_searcher.search_articles_by_text_page,
+    'category': wiki_searcher.search_articles_by_category_page,
+    'infobox': wiki_searcher.search_articles_by_infobox_page,
+    'category_tree': wiki_searcher.search_articles_by_category_tree,
+    'article': wiki_searcher.search_article_by_id,
+    'prefix': wiki_searcher.search_titles_by_prefix,
+}
+# These return (results, cursor of the next page)
+PAGED_OPERATIONS = ('title', 'text', 'category', 'infobox')
+# Arguments bounding the number of results, capped by the server
+SIZE_ARGUMENTS = ('page_size', 'limit')
+
+def run_search(search, params, cancelled):
+    """Run in a thread of the server, the queries of the search stopping once cancelled is set."""
+    token = cancel_event.set(cancelled)
+    try:
+        return search(**params)
+    finally:
+        cancel_event.reset(token)
+
+class SearchServer:
+    """
+    Answers searches sent as JSON lines over TCP, one response line per request:
+
+        {"id": 1, "op": "title", "params": {"title": "Ada", "page_size": 20}, "timeout": 5}
+        {"id": 1, "ok": true, "result": [...], "cursor": "..."}
+
+    Requests of a connection are answered as they complete, not in order, so a client can
+    send several at once and match the responses by id. {"op": "cancel", "target": id}
+    stops a search of the same connection, {"op": "stats"} returns the counters.
+
+    Searches run in a pool of workers threads, which is also the number of searches run at
+    the same time; the others wait for a free thread within their timeout. A search that
+    times out, is cancelled or whose client disconnects has its queries interrupted.
+    Shards are always searched in the thread pool of shard_fanout: worker processes would
+    see neither the cancellation of a search nor the per-shard query limits.
+    """
+    def __init__(self, workers=8, timeout=10.0, max_results=1000):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='search')
+        self.slots = asyncio.Semaphore(workers)
+        self.timeout = timeout
+        self.max_results = max_results
+        self.counters = {'connections': 0, 'requests': 0, 'errors': 0, 'timeouts': 0, 'cancelled': 0, 'active': 0}
+
+    def stats(self):
+        return dict(self.counters, cache=query_cache_stats())
+
+    def warm_up(self):
+        """Open every shard and the title index before the first search."""
+        for db_file in get_db_files():
+            with shard_connection(db_file):
+                pass
+        try:
+            wiki_searcher.search_titles_by_prefix('a', limit=1)
+        except FileNotFoundError:
+            print("No title index, prefix searches will fail until finalize builds it")
+
+    async def search(self, search, params, cancelled):
+        await self.slots.acquire()
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, run_search, search, params, cancelled)
+        # The slot is taken until the thread is done, not just until the request gives up
+        future.add_done_callback(lambda future: self.slots.release())
+        return await asyncio.shield(future)
+
+    def parse_params(self, op, params):
+        """The keyword arguments of a request, with its result size capped."""
+        if not isinstance(params, dict):
+            raise ValueError("params must be an object")
+        inspect.signature(OPERATIONS[op]).bind(**params)
+        for name in SIZE_ARGUMENTS:
+            if name in params:
+                if not isinstance(params[name], int) or params[name] < 1:
+                    raise ValueError(f"{name} must be a positive integer")
+                params[name] = min(params[name], self.max_results)
+        return params
+
+    async def handle_request(self, request, inflight):
+        request_id = request.get('id')
+        op = request.get('op')
+        if not isinstance(request_id, (str, int, type(None))):
+            return {'id': None, 'ok': False, 'error': "Bad request: id must be a string or an integer"}
+        if op == 'stats':
+            return {'id': request_id, 'ok': True, 'result': self.stats()}
+        if op == 'cancel':
+            cancelled = inflight.get(request.get('target'))
+            if cancelled is not None:
+                cancelled.set()
+            return {'id': request_id, 'ok': True, 'result': cancelled is not None}
+        if op not in OPERATIONS:
+            return {'id': request_id, 'ok': False, 'error': f"Unknown op {op}, expected one of {sorted(OPERATIONS)}"}
+        if request_id is not None and request_id in inflight:
+            return {'id': request_id, 'ok': False, 'error': f"Request {request_id} is already running"}
+        try:
+            params = self.parse_params(op, request.get('params', {}))
+            timeout = float(request.get('timeout', self.timeout))
+        except (TypeError, ValueError) as e:
+            return {'id': request_id, 'ok': False, 'error': f"Bad request: {e}"}
+
+        cancelled = threading.Event()
+        if request_id is not None:
+            inflight[request_id] = cancelled
+        self.counters['requests'] += 1
+        self.counters['active'] += 1
+        try:
+            result = await asyncio.wait_for(self.search(OPERATIONS[op], params, cancelled), timeout)
+        except asyncio.TimeoutError:
+            cancelled.set()
+            self.counters['timeouts'] += 1
+            return {'id': request_id, 'ok': False, 'error': 'timeout'}
+        except asyncio.CancelledError:
+            # The connection is closing
+            cancelled.set()
+            raise
+        except Exception as e:
+            if cancelled.is_set():
+                self.counters['cancelled'] += 1
+                return {'id': request_id, 'ok': False, 'error': 'cancelled'}
+            self.counters['errors'] += 1
+            return {'id': request_id, 'ok': False, 'error': f"{type(e).__name__}: {e}"}
+        finally:
+            self.counters['active'] -= 1
+            if request_id is not None:
+                inflight.pop(request_id, None)
+
+        if op in PAGED_OPERATIONS:
+            result, cursor = result
+            return {'id': request_id, 'ok': True, 'result': result, 'cursor': cursor}
+        return {'id': request_id, 'ok': True, 'result': result}
+
+    async def respond(self, line, inflight, writer, write_lock):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("not an object")
+        except ValueError as e:
+            response = {'id': None, 'ok': False, 'error': f"Invalid request: {e}"}
+        else:
+            response = await self.handle_request(request, inflight)
+        data = json.dumps(response, default=str).encode('utf-8') + b'\n'
+        async with write_lock:
+            writer.write(data)
+            await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        self.counters['connections'] += 1
+        inflight = {}  # request id -> Event cancelling its search
+        tasks = set()
+        write_lock = asyncio.Lock()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                task = asyncio.create_task(self.respond(line, inflight, writer, write_lock))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # The client is done sending, answer what it already asked
+            await asyncio.gather(*tasks, return_exceptions=True)
+        except (ConnectionError, ValueError):
+            # Gone (or sent a line over the limit), its searches are stopped
+            for task in tasks:
+                task.cancel()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, quiet=False):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=1024 * 1024)
+        print(f"Serving searches on {host}:{port}")
+        if quiet:
+            # Silences the progress messages the searches print
+            sys.stdout.flush()
+            sys.stdout = open(os.devnull, 'w')
+        async with server:
+            await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve searches of the shards as JSON lines over TCP.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=8, help="Searches run at the same time")
+    parser.add_argument("--per-shard", type=int, default=4, help="Queries run on one shard at the same time")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Default request timeout in seconds")
+    parser.add_argument("--max-results", type=int, default=1000, help="Cap on limit and page_size")
+    parser.add_argument("--pool-workers", type=int, default=None, help="Number of shards searched at the same time")
+    parser.add_argument("--cache-mb", type=int, default=64, help="Memory for cached search results (0 turns the cache off)")
+    parser.add_argument("--disk-cache", action="store_true", help="Also keep search results in db_files/query_cache.db")
+    parser.add_argument("--quiet", action="store_true", help="Do not print the progress messages of every search")
+    args = parser.parse_args()
+
+    # Cancellation and the per-shard limits only reach shard searches run in threads
+    configure_pool('thread', args.pool_workers)
+    configure_shard_pool(max_active=args.per_shard)
+    configure_query_cache(enabled=args.cache_mb > 0, max_bytes=args.cache_mb * 1024 * 1024,
+                          disk_file=DISK_CACHE_FILE if args.disk_cache else None)
+
+    search_server = SearchServer(workers=args.workers, timeout=args.timeout, max_results=args.max_results)
+    search_server.warm_up()
+    print(f"Opened {len(get_db_files())} shards")
+    asyncio.run(search_server.serve(args.host, args.port, quiet=args.quiet))
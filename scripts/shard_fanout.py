@@ -0,0 +1,184 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import base64
+import contextvars
+import hashlib
+import heapq
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
+
+POOLS = ('thread', 'process')
+
+# The pool the searches of this process share, created on first use
+_pool = {'kind': 'thread', 'workers': None, 'executor': None}
+
+def configure_pool(kind='thread', workers=None):
+    """
+    Choose the pool shards are searched in. Threads suit most searches, as sqlite3 releases
+    the GIL while a query runs; processes also parallelize the Python work on the rows
+    (decompression, building results) at the cost of pickling them back.
+    """
+    if kind not in POOLS:
+        raise ValueError(f"Unknown pool {kind}, expected one of {POOLS}")
+    shutdown_pool()
+    _pool['kind'], _pool['workers'] = kind, workers
+
+def get_executor():
+    if _pool['executor'] is None:
+        if _pool['kind'] == 'process':
+            _pool['executor'] = ProcessPoolExecutor(max_workers=_pool['workers'] or os.cpu_count())
+        else:
+            _pool['executor'] = ThreadPoolExecutor(max_workers=_pool['workers'] or min(32, (os.cpu_count() or 1) + 4),
+                                                   thread_name_prefix='shard')
+    return _pool['executor']
+
+def shutdown_pool():
+    if _pool['executor'] is not None:
+        _pool['executor'].shutdown(wait=False, cancel_futures=True)
+        _pool['executor'] = None
+
+def submit_shard(shard_search, db_file, *args):
+    """Start shard_search(db_file, *args), in the context of the caller when in a thread."""
+    executor = get_executor()
+    if _pool['kind'] == 'thread':
+        # Carries the cancellation of the search (see shard_pool.cancel_event) to the thread
+        return executor.submit(contextvars.copy_context().run, shard_search, db_file, *args)
+    return executor.submit(shard_search, db_file, *args)
+
+def submit_shards(shard_search, db_files, *args):
+    """Start shard_search(db_file, *args) for every shard, returning the futures in shard order."""
+    return [submit_shard(shard_search, db_file, *args) for db_file in db_files]
+
+def merge_ranked(shard_search, db_files, *args, limit, key):
+    """
+    Global top limit of a ranked search. Every shard returns at most limit results sorted by
+    key, so a k-way merge of the partial results gives the best limit overall.
+    """
+    partials = [future.result() for future in submit_shards(shard_search, db_files, *args)]
+    return list(islice(heapq.merge(*partials, key=key), limit))
+
+def collect_unranked(shard_search, db_files, *args, limit=None):
+    """
+    First limit results of an unranked search, in shard order as a sequential scan would
+    find them. Once there are enough, the shards not started yet are cancelled.
+    """
+    results = []
+    futures = submit_shards(shard_search, db_files, *args)
+    try:
+        for future in futures:
+            results.extend(future.result())
+            if limit is not None and len(results) >= limit:
+                break
+    finally:
+        for future in futures:
+            future.cancel()
+    return results if limit is None else results[:limit]
+
+# Pages of a search are read with a cursor: the position reached in each shard, as the sort
+# key of the last result taken from it. The next page asks every shard for the results
+# after its position only, so no page rescans the results of the previous ones.
+
+def search_fingerprint(shard_page, args):
+    return hashlib.blake2b(repr((shard_page.__name__, args)).encode('utf-8'), digest_size=8).hexdigest()
+
+def encode_cursor(state):
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor, fingerprint):
+    """The state of a cursor, checked to come from the same search."""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (ValueError, UnicodeError):
+        raise ValueError("Invalid cursor")
+    if not isinstance(state, dict) or state.get('search') != fingerprint:
+        raise ValueError("The cursor belongs to another search")
+    return state
+
+def merge_ranked_page(shard_page, db_files, *args, page_size, cursor=None):
+    """
+    One page of a ranked search and the cursor of the next page, None after the last one.
+
+    shard_page(db_file, *args, limit, after) returns up to limit (key, result) pairs of a
+    shard, sorted by key and all after the key after (from the start when None). Keys must
+    be unique across shards, (score, article_id) for instance. A shard that returned all of
+    its results is not searched again.
+    """
+    fingerprint = search_fingerprint(shard_page, args)
+    state = decode_cursor(cursor, fingerprint) if cursor else {'search': fingerprint, 'after': {}, 'done': []}
+    after, done = state['after'], set(state['done'])
+
+    futures = {}
+    for db_file in db_files:
+        name = os.path.basename(db_file)
+        if name not in done:
+            futures[name] = submit_shard(shard_page, db_file, *args, page_size, after.get(name))
+    partials = {name: future.result() for name, future in futures.items()}
+
+    merged = heapq.merge(*([(key, name, result) for key, result in partial] for name, partial in partials.items()),
+                         key=lambda item: item[0])
+    page = list(islice(merged, page_size))
+
+    taken = dict.fromkeys(partials, 0)
+    for key, name, result in page:
+        after[name] = key
+        taken[name] += 1
+    for name, partial in partials.items():
+        if len(partial) < page_size and taken[name] == len(partial):
+            done.add(name)
+
+    results = [result for key, name, result in page]
+    if all(os.path.basename(db_file) in done for db_file in db_files):
+        return results, None
+    return results, encode_cursor({'search': fingerprint, 'after': after, 'done': sorted(done)})
+
+def collect_unranked_page(shard_page, db_files, *args, page_size, cursor=None):
+    """
+    One page of an unranked search in shard order and the cursor of the next page, None
+    after the last one. shard_page is as for merge_ranked_page, keys only have to be unique
+    and sorted within a shard. The cursor holds the shard the page ended in and the key
+    reached in it; the next page starts there and skips the shards before it.
+    """
+    fingerprint = search_fingerprint(shard_page, args)
+    names = [os.path.basename(db_file) for db_file in db_files]
+    start, after = 0, None
+    if cursor:
+        state = decode_cursor(cursor, fingerprint)
+        if state['shard'] not in names:
+            raise ValueError(f"Shard {state['shard']} of the cursor is gone")
+        start, after = names.index(state['shard']), state['after']
+
+    futures = [submit_shard(shard_page, db_files[index], *args, page_size, after if index == start else None)
+               for index in range(start, len(db_files))]
+    results = []
+    try:
+        for index, future in enumerate(futures, start):
+            for key, result in future.result()[:page_size - len(results)]:
+                results.append(result)
+                after, shard = key, names[index]
+            if len(results) == page_size:
+                return results, encode_cursor({'search': fingerprint, 'shard': shard, 'after': after})
+    finally:
+        for future in futures:
+            future.cancel()
+    return results, None
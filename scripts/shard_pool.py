@@ -0,0 +1,171 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import contextvars
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from compression import ShardConnection
+
+# Set by a caller (the search server) to an Event that stops the queries of its search once
+# set. Shard threads of the fan-out pool run in the context of the search that started them.
+cancel_event = contextvars.ContextVar('cancel_event', default=None)
+# SQLite virtual machine steps between two checks of the event
+PROGRESS_STEPS = 10000
+
+class SearchCancelled(Exception):
+    pass
+
+def check_cancelled(cancelled):
+    if cancelled is not None and cancelled.is_set():
+        raise SearchCancelled("The search was cancelled")
+
+class ShardPool:
+    """
+    Read-only connections to the shards, opened once and reused by every search.
+
+    Each shard keeps a queue of idle connections; a search takes one (opening another when
+    all of them are in use, so concurrent searches never share a connection) and puts it
+    back when done, with its page cache, memory map and prepared statements intact.
+    Connections are opened with mode=ro and query_only. immutable=True also skips file
+    locking, which is only safe while nothing writes to the shards.
+
+    Before a connection is handed out the shard file is checked with a stat: when it was
+    replaced or changed size or modification time (an update, a rebuild, a VACUUM) the idle
+    connections are dropped and new ones opened, so searches never read a stale file.
+
+    max_active bounds the connections of a shard in use at the same time, further searches
+    wait for one to be returned. The queries of a search whose cancel_event is set fail with
+    SearchCancelled, or an "interrupted" sqlite3.OperationalError when already running.
+    """
+    def __init__(self, mmap_size=30000000000, cache_size_kb=32768, max_idle=8, cached_statements=256, immutable=False,
+                 max_active=None):
+        self.mmap_size = mmap_size
+        self.cache_size_kb = cache_size_kb
+        self.max_idle = max_idle
+        self.cached_statements = cached_statements
+        self.immutable = immutable
+        self.max_active = max_active
+        self.lock = threading.Lock()
+        self.shards = {}  # db_file -> (file signature, queue of idle connections)
+        self.slots = {}  # db_file -> semaphore of its connections in use, with max_active
+
+    def file_signature(self, db_file):
+        stat = os.stat(db_file)
+        return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def open(self, db_file):
+        uri = f"file:{os.path.abspath(db_file)}?mode=ro" + ("&immutable=1" if self.immutable else "")
+        conn = sqlite3.connect(uri, uri=True, factory=ShardConnection, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)};')
+        conn.execute(f'PRAGMA cache_size=-{int(self.cache_size_kb)};')
+        conn.execute('PRAGMA temp_store=MEMORY;')
+        conn.execute('PRAGMA query_only=1;')
+        return conn
+
+    def idle_connections(self, db_file):
+        """The idle queue of a shard, emptied first if the shard file changed since it was opened."""
+        signature = self.file_signature(db_file)
+        with self.lock:
+            shard = self.shards.get(db_file)
+            if shard is not None and shard[0] == signature:
+                return shard[1]
+            self.shards[db_file] = (signature, queue.Queue())
+        if shard is not None:
+            self.close_idle(shard[1])
+        return self.shards[db_file][1]
+
+    def active_slots(self, db_file):
+        if self.max_active is None:
+            return None
+        with self.lock:
+            if db_file not in self.slots:
+                self.slots[db_file] = threading.BoundedSemaphore(self.max_active)
+            return self.slots[db_file]
+
+    @contextmanager
+    def connection(self, db_file):
+        cancelled = cancel_event.get()
+        slots = self.active_slots(db_file)
+        if slots is not None:
+            # Wait for a connection of the shard to be returned, or for the search to be cancelled
+            while not slots.acquire(timeout=0.05):
+                check_cancelled(cancelled)
+        try:
+            check_cancelled(cancelled)
+            with self.pooled_connection(db_file) as conn:
+                if cancelled is not None:
+                    conn.set_progress_handler(cancelled.is_set, PROGRESS_STEPS)
+                try:
+                    yield conn
+                finally:
+                    if cancelled is not None:
+                        conn.set_progress_handler(None, 0)
+        finally:
+            if slots is not None:
+                slots.release()
+
+    @contextmanager
+    def pooled_connection(self, db_file):
+        idle = self.idle_connections(db_file)
+        try:
+            conn = idle.get_nowait()
+        except queue.Empty:
+            conn = self.open(db_file)
+        try:
+            yield conn
+        finally:
+            # Connections of a shard that changed meanwhile are not put back
+            shard = self.shards.get(db_file)
+            if shard is not None and shard[1] is idle and idle.qsize() < self.max_idle:
+                idle.put(conn)
+            else:
+                conn.close()
+
+    def close_idle(self, idle):
+        while True:
+            try:
+                idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def close(self):
+        with self.lock:
+            shards, self.shards = self.shards, {}
+        for signature, idle in shards.values():
+            self.close_idle(idle)
+
+# The pool the searches of this process share
+_default_pool = ShardPool()
+
+def configure_shard_pool(**options):
+    """Replace the shared pool with one opened with other options (see ShardPool)."""
+    global _default_pool
+    _default_pool.close()
+    _default_pool = ShardPool(**options)
+
+def shard_connection(db_file):
+    """Context manager lending a pooled read-only connection to db_file."""
+    return _default_pool.connection(db_file)
@@ -0,0 +1,132 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import sqlite3
+
+import numpy as np
+
+from utils import shard_number
+from starter import column_exists
+
+class StoredPages:
+    """
+    The article and revision ids held by every shard, kept as sorted numpy arrays.
+
+    Used by the update mode to tell which pages of a newer dump changed and to route every
+    page to the shard that already holds it. Shards are filled in page id order, so a page
+    that is not stored yet belongs to the first shard whose last id is past it, and pages
+    past every shard go to the newest one. Updates send the new pages of a full shard to the
+    newest one instead, so the id ranges of shards can overlap: stored pages are looked up
+    in one sorted array of the ids of every shard, with the shard of each id next to it.
+    """
+    def __init__(self, db_files):
+        self.db_files = {}
+        self.newest_index = 0
+        shard_indexes, last_ids, ids, revisions, shards = [], [], [], [], []
+        for db_file in sorted(db_files, key=shard_number):
+            db_index = shard_number(db_file)
+            self.db_files[db_index] = db_file
+            self.newest_index = max(self.newest_index, db_index)
+
+            conn = sqlite3.connect(db_file)
+            c = conn.cursor()
+            # Shards imported before revision ids were recorded count as changed everywhere
+            revision_column = 'COALESCE(revision_id, -1)' if column_exists(c, 'articles', 'revision_id') else '-1'
+            rows = np.fromiter(c.execute(f'SELECT article_id, {revision_column} FROM articles ORDER BY article_id'),
+                               dtype=[('article_id', np.int64), ('revision_id', np.int64)])
+            conn.close()
+            if len(rows):
+                shard_indexes.append(db_index)
+                last_ids.append(rows['article_id'][-1])
+                ids.append(rows['article_id'])
+                revisions.append(rows['revision_id'])
+                shards.append(np.full(len(rows), db_index, dtype=np.int32))
+
+        self.shard_indexes = shard_indexes
+        # Running maximum: a shard that got pages of a full one may end below the shard before it
+        self.last_ids = np.maximum.accumulate(np.array(last_ids, dtype=np.int64)) if last_ids else np.empty(0, dtype=np.int64)
+        self.ids = np.concatenate(ids) if ids else np.empty(0, dtype=np.int64)
+        self.revisions = np.concatenate(revisions) if revisions else np.empty(0, dtype=np.int64)
+        self.shards = np.concatenate(shards) if shards else np.empty(0, dtype=np.int32)
+        if np.any(np.diff(self.ids) < 0):
+            order = np.argsort(self.ids, kind='stable')
+            self.ids, self.revisions, self.shards = self.ids[order], self.revisions[order], self.shards[order]
+        self._connections = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getstate__(self):
+        # Worker processes open their own connections for sha1 lookups
+        state = self.__dict__.copy()
+        state['_connections'] = {}
+        return state
+
+    def _find(self, page_id):
+        """Row of a stored page in the id arrays, -1 when it is not stored."""
+        row = int(np.searchsorted(self.ids, page_id))
+        return row if row < len(self.ids) and self.ids[row] == page_id else -1
+
+    def shard_for(self, page_id):
+        """Index of the shard a page is (or, for a new page, should be) stored in."""
+        row = self._find(page_id)
+        if row != -1:
+            return int(self.shards[row])
+        position = int(np.searchsorted(self.last_ids, page_id))
+        return self.newest_index if position == len(self.last_ids) else self.shard_indexes[position]
+
+    def contains(self, page_id):
+        return self._find(page_id) != -1
+
+    def stored_sha1(self, db_index, page_id):
+        conn = self._connections.get(db_index)
+        if conn is None:
+            conn = sqlite3.connect(f'file:{self.db_files[db_index]}?mode=ro', uri=True)
+            if not column_exists(conn.cursor(), 'articles', 'sha1'):
+                conn.close()
+                conn = False
+            self._connections[db_index] = conn
+        if not conn:
+            return None
+        row = conn.execute('SELECT sha1 FROM articles WHERE article_id = ?', (page_id,)).fetchone()
+        return row[0] if row else None
+
+    def changed(self, raw_page):
+        """
+        Whether a page of the newer dump has to be (re)imported: it is new, or its revision id
+        differs from the stored one and so does its sha1 (a null edit or a revert to the same
+        text keeps the sha1 and is skipped).
+        """
+        row = self._find(raw_page.page_id)
+        if row == -1:
+            return True
+        if raw_page.revision_id is not None and self.revisions[row] == raw_page.revision_id:
+            return False
+        if raw_page.sha1:
+            return self.stored_sha1(int(self.shards[row]), raw_page.page_id) != raw_page.sha1
+        return True
+
+    def missing(self, dump_page_ids):
+        """Return {shard index: ids of the stored pages that are not in dump_page_ids}."""
+        dump_page_ids = np.asarray(dump_page_ids, dtype=np.int64)
+        gone = np.isin(self.ids, dump_page_ids, invert=True)
+        ids, shards = self.ids[gone], self.shards[gone]
+        return {int(db_index): ids[shards == db_index] for db_index in np.unique(shards)}
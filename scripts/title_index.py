@@ -0,0 +1,357 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import heapq
+import json
+import os
+import shutil
+import tempfile
+import time
+import unicodedata
+
+import numpy as np
+
+from utils import get_db_files, connect_shard, shard_number
+from starter import table_exists
+from link_graph import LINK_GRAPH_DIR
+
+# The title index spans every shard and is kept next to them as raw memory-mappable files
+TITLE_INDEX_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'db_files', 'title_index')
+
+# Prefixes matching more titles than this get their top titles precomputed at build time,
+# ranking a range this size at query time takes a fraction of a millisecond
+RANK_WINDOW = 16384
+TOP_K = 100
+
+# Sorts after every byte of a UTF-8 key, so key + KEY_END bounds the keys starting with key
+KEY_END = b'\xff'
+
+def normalize_key(title):
+    """Lowercase the title, drop its diacritics and collapse whitespace and underscores."""
+    title = title.replace('_', ' ')
+    if not title.isascii():
+        title = ''.join(char for char in unicodedata.normalize('NFKD', title) if not unicodedata.combining(char))
+    return ' '.join(title.casefold().split())
+
+def iter_shard_titles(db_file):
+    """(key, title, article_id, target_id) of every page of a shard, redirects pointing to their target."""
+    conn = connect_shard(db_file)
+    c = conn.cursor()
+    if table_exists(c, 'redirects'):
+        c.execute('''
+        SELECT a.title, a.article_id, COALESCE(r.target_id, a.article_id)
+        FROM articles a
+        LEFT JOIN redirects r ON r.source_id = a.article_id
+        ''')
+    else:
+        c.execute('SELECT title, article_id, article_id FROM articles')
+    for title, article_id, target_id in c:
+        key = normalize_key(title)
+        if key:
+            yield key, title, article_id, target_id
+    conn.close()
+
+def write_runs(db_files, run_dir, run_rows):
+    """Sort the titles of all shards in runs of run_rows rows written to run_dir, return their paths."""
+    runs = []
+    def flush(rows):
+        rows.sort()
+        path = os.path.join(run_dir, f'run_{len(runs)}.tsv')
+        with open(path, 'w', encoding='utf-8') as f:
+            # Titles cannot contain tabs or newlines
+            f.writelines(f'{key}\t{title}\t{article_id}\t{target_id}\t{shard}\n' for key, title, article_id, target_id, shard in rows)
+        runs.append(path)
+
+    rows = []
+    for db_file in db_files:
+        shard = shard_number(db_file)
+        for key, title, article_id, target_id in iter_shard_titles(db_file):
+            rows.append((key, title, article_id, target_id, shard))
+            if len(rows) >= run_rows:
+                flush(rows)
+                rows = []
+    if rows:
+        flush(rows)
+    return runs
+
+def iter_run(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key, title, article_id, target_id, shard = line.rstrip('\n').split('\t')
+            yield key, title, int(article_id), int(target_id), int(shard)
+
+class BlobWriter:
+    """Appends strings to a blob file and their end offsets to an int64 file, in batches."""
+    def __init__(self, path):
+        self.data = open(path + '.bin', 'wb')
+        self.offsets = open(path + '.offsets', 'wb')
+        self.offsets.write(np.zeros(1, dtype=np.int64).tobytes())
+        self.position = 0
+        self.pending = []
+
+    def append(self, text):
+        data = text.encode('utf-8')
+        self.data.write(data)
+        self.position += len(data)
+        self.pending.append(self.position)
+        if len(self.pending) >= 65536:
+            self.flush()
+
+    def flush(self):
+        self.offsets.write(np.array(self.pending, dtype=np.int64).tobytes())
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.offsets.close()
+
+def link_scores(target_ids, link_graph_dir):
+    """Number of links to the article every title leads to, or None without a link graph."""
+    if not os.path.exists(os.path.join(link_graph_dir, 'sources_offsets.npy')):
+        return None
+    node_ids = np.load(os.path.join(link_graph_dir, 'node_ids.npy'), mmap_mode='r')
+    in_degrees = np.diff(np.load(os.path.join(link_graph_dir, 'sources_offsets.npy'), mmap_mode='r'))
+    if len(node_ids) == 0:
+        return np.zeros(len(target_ids), dtype=np.float32)
+    nodes = np.minimum(np.searchsorted(node_ids, target_ids), len(node_ids) - 1)
+    return np.where(node_ids[nodes] == target_ids, in_degrees[nodes], 0).astype(np.float32)
+
+def build_title_index(db_files=None, output_dir=TITLE_INDEX_DIR, link_graph_dir=LINK_GRAPH_DIR, run_rows=2000000):
+    """
+    Build the title index of all shards into output_dir.
+
+    Titles are sorted in runs of run_rows rows spilled to disk and merged, so memory does
+    not grow with the number of titles. Titles are ranked by the number of links to the
+    article they lead to when the link graph has been built, else shorter titles first.
+    """
+    start_time = time.time()
+    if db_files is None:
+        db_files = get_db_files()
+    db_files = sorted(db_files, key=shard_number)
+    if not db_files:
+        print("No shards to build the title index from.")
+        return
+
+    tmp_dir = output_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    run_dir = tempfile.mkdtemp(dir=tmp_dir)
+    runs = write_runs(db_files, run_dir, run_rows)
+
+    keys = BlobWriter(os.path.join(tmp_dir, 'keys'))
+    titles = BlobWriter(os.path.join(tmp_dir, 'titles'))
+    count = 0
+    with open(os.path.join(tmp_dir, 'article_ids.i64'), 'wb') as article_ids, \
+         open(os.path.join(tmp_dir, 'target_ids.i64'), 'wb') as target_ids, \
+         open(os.path.join(tmp_dir, 'shards.u16'), 'wb') as shards:
+        batch = []
+        for key, title, article_id, target_id, shard in heapq.merge(*[iter_run(run) for run in runs]):
+            keys.append(key)
+            titles.append(title)
+            batch.append((article_id, target_id, shard))
+            count += 1
+            if len(batch) >= 65536:
+                rows = np.array(batch, dtype=np.int64)
+                article_ids.write(rows[:, 0].tobytes())
+                target_ids.write(rows[:, 1].tobytes())
+                shards.write(rows[:, 2].astype(np.uint16).tobytes())
+                batch = []
+        if batch:
+            rows = np.array(batch, dtype=np.int64)
+            article_ids.write(rows[:, 0].tobytes())
+            target_ids.write(rows[:, 1].tobytes())
+            shards.write(rows[:, 2].astype(np.uint16).tobytes())
+    keys.close()
+    titles.close()
+    shutil.rmtree(run_dir)
+
+    index = TitleIndex(tmp_dir, count=count)
+    scores = link_scores(np.asarray(index.target_ids), link_graph_dir)
+    ranking = 'links'
+    if scores is None:
+        scores = -np.diff(np.asarray(index.title_offsets)).astype(np.float32)
+        ranking = 'length'
+    scores.astype(np.float32).tofile(os.path.join(tmp_dir, 'scores.f32'))
+
+    index = TitleIndex(tmp_dir, count=count)
+    heavy_prefixes, heavy_top = index.find_heavy_prefixes()
+    heavy = BlobWriter(os.path.join(tmp_dir, 'heavy_keys'))
+    for prefix in heavy_prefixes:
+        heavy.append(prefix)
+    heavy.close()
+    np.array(heavy_top, dtype=np.int64).reshape(-1, TOP_K).tofile(os.path.join(tmp_dir, 'heavy_top.i64'))
+
+    with open(os.path.join(tmp_dir, 'index.json'), 'w') as f:
+        json.dump({"count": count, "heavy_count": len(heavy_prefixes), "top_k": TOP_K, "ranking": ranking}, f)
+
+    old_dir = output_dir + '.old'
+    if os.path.exists(output_dir):
+        os.replace(output_dir, old_dir)
+    os.replace(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    print(f"Built the title index of {count} titles ({len(heavy_prefixes)} precomputed prefixes, ranked by {ranking}) "
+          f"in {time.time() - start_time:.1f}s")
+
+class TitleIndex:
+    """
+    Type-ahead over the titles of every shard, memory-mapped.
+
+    keys.bin holds the normalized titles (see normalize_key) in sorted order, back to back,
+    and keys.offsets where each ends; titles.bin/.offsets hold the titles as stored. Row i
+    of article_ids.i64, target_ids.i64 (the article a redirect leads to), shards.u16 and
+    scores.f32 belongs to title i. A prefix is a range of rows found by binary search. Ranges
+    longer than RANK_WINDOW have their TOP_K best rows stored in heavy_top.i64, keyed by the
+    prefixes in heavy_keys, so no query ranks more than RANK_WINDOW rows. Nothing is read
+    until it is used, so opening the index costs a few file maps.
+    """
+    def __init__(self, path=TITLE_INDEX_DIR, count=None):
+        self.path = path
+        header = {}
+        if count is None:
+            with open(os.path.join(path, 'index.json'), 'r') as f:
+                header = json.load(f)
+            count = header["count"]
+        self.count = count
+        self.keys = self._map('keys.bin', np.uint8)
+        self.key_offsets = self._map('keys.offsets', np.int64)
+        self.titles = self._map('titles.bin', np.uint8)
+        self.title_offsets = self._map('titles.offsets', np.int64)
+        self.article_ids = self._map('article_ids.i64', np.int64)
+        self.target_ids = self._map('target_ids.i64', np.int64)
+        self.shards = self._map('shards.u16', np.uint16)
+        self.scores = self._map('scores.f32', np.float32)
+        heavy_count = header.get("heavy_count", 0)
+        self.heavy_keys = self._map('heavy_keys.bin', np.uint8)
+        self.heavy_key_offsets = self._map('heavy_keys.offsets', np.int64)
+        self.heavy_top = self._map('heavy_top.i64', np.int64).reshape(heavy_count, -1) if heavy_count else None
+        self.heavy_count = heavy_count
+
+    def _map(self, name, dtype):
+        path = os.path.join(self.path, name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def key(self, row):
+        return self.keys[self.key_offsets[row]:self.key_offsets[row + 1]].tobytes()
+
+    def title(self, row):
+        return self.titles[self.title_offsets[row]:self.title_offsets[row + 1]].tobytes().decode('utf-8')
+
+    def _bisect(self, key, key_at, count):
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def prefix_range(self, prefix):
+        """Rows [start, stop) whose normalized title starts with the (already normalized) bytes prefix."""
+        start = self._bisect(prefix, self.key, self.count)
+        stop = self._bisect(prefix + KEY_END, self.key, self.count)
+        return start, stop
+
+    def heavy_rows(self, prefix):
+        """Precomputed best rows of a prefix matching more than RANK_WINDOW titles, else None."""
+        heavy_key = lambda row: self.heavy_keys[self.heavy_key_offsets[row]:self.heavy_key_offsets[row + 1]].tobytes()
+        position = self._bisect(prefix, heavy_key, self.heavy_count)
+        if position < self.heavy_count and heavy_key(position) == prefix:
+            return self.heavy_top[position]
+        return None
+
+    def top_rows(self, start, stop, limit):
+        """Rows of [start, stop) with the best scores, best first (ties in title order)."""
+        scores = np.asarray(self.scores[start:stop])
+        if len(scores) > limit:
+            # Everything above the limit-th score, then the first rows tied with it
+            cutoff = -np.partition(-scores, limit - 1)[limit - 1]
+            above = np.flatnonzero(scores > cutoff)
+            best = np.concatenate((above, np.flatnonzero(scores == cutoff)[:limit - len(above)]))
+        else:
+            best = np.arange(len(scores))
+        best = best[np.lexsort((best, -scores[best]))]
+        return start + best
+
+    def find_heavy_prefixes(self):
+        """
+        Every prefix matching more than RANK_WINDOW titles with its TOP_K best rows, in sorted
+        order. Only called while the index is built.
+        """
+        prefixes, tops = [], []
+        pending = [b'']
+        while pending:
+            prefix = pending.pop()
+            start, stop = self.prefix_range(prefix)
+            # Walk the distinct next characters of the prefix one sub-range at a time
+            row = start
+            while row < stop:
+                key = self.key(row)
+                if len(key) == len(prefix):
+                    row += 1
+                    continue
+                # Extend by one whole UTF-8 character
+                length = len(prefix) + 1
+                while length < len(key) and (key[length] & 0xC0) == 0x80:
+                    length += 1
+                child = key[:length]
+                child_start, child_stop = self.prefix_range(child)
+                if child_stop - child_start > RANK_WINDOW:
+                    top = self.top_rows(child_start, child_stop, TOP_K)
+                    prefixes.append(child)
+                    tops.append(np.pad(top, (0, TOP_K - len(top)), constant_values=-1))
+                    pending.append(child)
+                row = child_stop
+        order = sorted(range(len(prefixes)), key=prefixes.__getitem__)
+        return [prefixes[i].decode('utf-8') for i in order], [tops[i] for i in order]
+
+    def search(self, prefix, limit=10):
+        """
+        The best titles starting with prefix (compared normalized), as (title, article_id,
+        shard, target_id) tuples, target_id being the article a redirect leads to.
+        Prefixes with more than RANK_WINDOW titles return at most TOP_K titles.
+        """
+        key = normalize_key(prefix).encode('utf-8')
+        if not key:
+            return []
+        start, stop = self.prefix_range(key)
+        if stop - start > RANK_WINDOW:
+            rows = self.heavy_rows(key)
+            rows = rows[rows >= 0][:limit] if rows is not None else self.top_rows(start, start + RANK_WINDOW, limit)
+        else:
+            rows = self.top_rows(start, stop, limit)
+        return [(self.title(row), int(self.article_ids[row]), int(self.shards[row]), int(self.target_ids[row])) for row in rows]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the title index of the imported shards.")
+    parser.add_argument("db_files", nargs="*", help="Shards to read (default: every db_files/wikipedia_*.db)")
+    parser.add_argument("--output", default=TITLE_INDEX_DIR, help="Directory the index files are written to")
+    parser.add_argument("--run-rows", type=int, default=2000000, help="Titles sorted in memory at a time")
+    args = parser.parse_args()
+
+    build_title_index(args.db_files or None, output_dir=args.output, run_rows=args.run_rows)
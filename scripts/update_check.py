@@ -0,0 +1,189 @@
+"""
+MIT License
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import sys
+import tempfile
+
+import wiki_parser
+from page_counter import counter_
+from finalize import finalize_shard
+from redirects import resolve_redirects
+from starter import table_exists
+from utils import connect_shard, shard_number
+
+HEADER = '''<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="en">
+  <siteinfo>
+    <sitename>Wikipedia</sitename>
+    <dbname>enwiki</dbname>
+  </siteinfo>
+'''
+
+PAGE = '''  <page>
+    <title>{title}</title>
+    <ns>0</ns>
+    <id>{page_id}</id>
+    <revision>
+      <id>{revision_id}</id>
+      <sha1>{sha1}</sha1>
+      <text bytes="{size}" xml:space="preserve">{text}</text>
+    </revision>
+  </page>
+'''
+
+def page_title(page_id):
+    return f"Fixture page {page_id}"
+
+def page_text(page_id, version, sections):
+    """Wikitext of a page: an introduction and sections linking to the next pages."""
+    parts = [f"'''{page_title(page_id)}''' is version {version} of a fixture article. [[Category:Fixture pages]]"]
+    for section in range(sections):
+        parts.append(f"\n== Part {section} ==\nVersion {version} text of part {section} linking to [[{page_title(page_id + section + 1)}]].")
+    return ''.join(parts)
+
+def is_new(page_id, pages, late_every):
+    """Whether a page first appears in version 2: after the last page, or one of the ids version 1 skips."""
+    return page_id > pages or page_id % late_every == 7
+
+def write_fixture_dump(file_path, pages, version=1, sections=8, redirect_every=10, change_every=4, delete_every=25,
+                       late_every=50, added=30):
+    """
+    Write a dump of pages 1..pages with revision ids page_id * 10 + version. Pages 5, 15,
+    25... (every redirect_every-th) redirect to the page 5 ids on, some of which version 2 deletes.
+    Version 1 skips pages 7, 57... (every late_every-th). Version 2 changes every
+    change_every-th page, drops every delete_every-th one and adds the skipped pages and
+    pages after the last.
+    """
+    with open(file_path, 'w', encoding='utf-8') as dump_file:
+        dump_file.write(HEADER)
+        for page_id in range(1, pages + 1 + (added if version > 1 else 0)):
+            if version > 1 and page_id % delete_every == 0 and page_id <= pages:
+                continue
+            if version == 1 and is_new(page_id, pages, late_every):
+                continue
+            page_version = version if page_id % change_every == 0 or is_new(page_id, pages, late_every) else 1
+            if page_id % redirect_every == 5:
+                text = f"#REDIRECT [[{page_title(page_id + 5)}]]"
+            else:
+                text = page_text(page_id, page_version, sections)
+            dump_file.write(PAGE.format(title=page_title(page_id), page_id=page_id, revision_id=page_id * 10 + page_version,
+                                        sha1=f"sha{page_id}v{page_version}", size=len(text), text=text))
+        dump_file.write('</mediawiki>\n')
+
+def expected_revisions(pages, change_every=4, delete_every=25, late_every=50, added=30):
+    """{page_id: revision id} the shards should hold after the update."""
+    revisions = {}
+    for page_id in range(1, pages + added + 1):
+        if page_id % delete_every == 0 and page_id <= pages:
+            continue
+        revisions[page_id] = page_id * 10 + (2 if page_id % change_every == 0 or is_new(page_id, pages, late_every) else 1)
+    return revisions
+
+def check_full_shard(db_file, pages, late_every=50):
+    """Problems of a shard that was full when the update started: it must not have taken new pages."""
+    conn = sqlite3.connect(db_file)
+    article_ids = [row[0] for row in conn.execute('SELECT article_id FROM articles')]
+    conn.close()
+    return [f"new article {article_id} was added to the full {os.path.basename(db_file)}"
+            for article_id in article_ids if is_new(article_id, pages, late_every)]
+
+def check_shards(db_files, revisions):
+    """Return the problems found in the updated shards, an empty list when there are none."""
+    problems = []
+    stored = {}
+    for db_file in db_files:
+        conn = connect_shard(db_file)
+        c = conn.cursor()
+        for article_id, revision_id in conn.execute('SELECT article_id, revision_id FROM articles'):
+            if article_id in stored:
+                problems.append(f"article {article_id} is in {os.path.basename(stored[article_id][0])} and {os.path.basename(db_file)}")
+            stored[article_id] = (db_file, revision_id)
+        for table_name, column in wiki_parser.ARTICLE_TABLES[:-1]:
+            orphans = conn.execute(f'SELECT COUNT(*) FROM {table_name} WHERE {column} NOT IN (SELECT article_id FROM articles)').fetchone()[0]
+            if orphans:
+                problems.append(f"{orphans} rows of {table_name} in {os.path.basename(db_file)} belong to no article")
+        reused = conn.execute('SELECT COUNT(*) FROM article_sections WHERE id IN (SELECT id FROM deleted_sections)').fetchone()[0]
+        if reused:
+            problems.append(f"{reused} sections of {os.path.basename(db_file)} reuse the id of a deleted section")
+        if table_exists(c, 'sections_fts'):
+            # Compares the full-text index with the (decompressed) sections it was built from
+            try:
+                conn.execute("INSERT INTO sections_fts(sections_fts, rank) VALUES ('integrity-check', 1)")
+            except sqlite3.DatabaseError as e:
+                problems.append(f"the full-text index of {os.path.basename(db_file)} is out of date: {e}")
+        dangling = conn.execute('SELECT source_id, target_id FROM redirects WHERE target_id IS NOT NULL').fetchall()
+        conn.close()
+        for source_id, target_id in dangling:
+            if target_id not in revisions:
+                problems.append(f"redirect {source_id} still points to the deleted article {target_id}")
+
+    for page_id, revision_id in revisions.items():
+        if page_id not in stored:
+            problems.append(f"article {page_id} is missing")
+        elif stored[page_id][1] != revision_id:
+            problems.append(f"article {page_id} has revision {stored[page_id][1]} instead of {revision_id}")
+    for article_id in stored.keys() - revisions.keys():
+        problems.append(f"article {article_id} should have been deleted")
+    return problems
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the update mode on a small fixture: import it, apply a changed version and compare.")
+    parser.add_argument("--pages", type=int, default=1000, help="Number of pages of the first version")
+    parser.add_argument("--compress", choices=wiki_parser.METHODS, default=None, help="Compression of the update writes")
+    parser.add_argument("--workers", type=int, default=1, help="Number of parser processes")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # The importer writes to db_files/ under the working directory
+        os.chdir(tmp_dir)
+        os.makedirs('db_files')
+        print(f"Writing and importing {args.pages} fixture pages...")
+        write_fixture_dump('dump_v1.xml', args.pages, version=1)
+        write_fixture_dump('dump_v2.xml', args.pages, version=2)
+        counter_('dump_v1.xml', 'dump_v1_pageCount.json')
+        wiki_parser.parse_dump('dump_v1.xml', 'dump_v1_pageCount.json', db_splinter_size=10, workers=args.workers)
+        db_file = os.path.join('db_files', 'wikipedia_1.db')
+        finalize_shard(db_file)
+        resolve_redirects([db_file])
+
+        # Small enough for the shard to count as full, so new pages go to a new shard, those
+        # whose ids fall inside it included
+        splinter_size = os.path.getsize(db_file) / 2 / 1024 ** 3
+        print(f"\nUpdating with shards of {splinter_size * 1024 ** 2:.1f} KB...")
+        wiki_parser.update_dump('dump_v2.xml', db_splinter_size=splinter_size, workers=args.workers, compression=args.compress)
+        # The shards now overlap in ids; running the update again must not change anything
+        print("\nUpdating again with the same dump...")
+        wiki_parser.update_dump('dump_v2.xml', db_splinter_size=splinter_size, workers=args.workers, compression=args.compress)
+        db_files = sorted(glob.glob(os.path.join('db_files', 'wikipedia_*.db')), key=shard_number)
+        resolve_redirects(db_files)
+
+        problems = check_shards(db_files, expected_revisions(args.pages)) + check_full_shard(db_file, args.pages)
+        os.chdir('/')
+
+    for problem in problems[:20]:
+        print(problem)
+    if problems:
+        print(f"FAILED: {len(problems)} problems in {len(db_files)} shards")
+        sys.exit(1)
+    print(f"OK: {len(db_files)} shards hold every article once, at its new revision")
@@ -26,6 +26,8 @@ import os
 import glob
 from collections import defaultdict
 
+from compression import ShardConnection
+
 def get_connection():
     conn = sqlite3.connect('wikipedia.db')
     conn.execute('PRAGMA journal_mode=WAL;')
@@ -34,6 +36,10 @@ def get_connection():
     conn.execute('PRAGMA mmap_size=30000000000;')  # Adjust based on your system's memory
     return conn
 
+def connect_shard(db_file):
+    """Open a shard, decompressing section_content and wikitables through conn.codec."""
+    return sqlite3.connect(db_file, factory=ShardConnection)
+
 def get_db_files():
     # Get the absolute path of the current script
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -43,10 +49,165 @@ def get_db_files():
     db_files = glob.glob(db_files_path)
     return db_files
 
-def remove_specific_tags(text):
+def shard_number(db_file):
+    match = re.search(r'wikipedia_(\d+)\.db$', db_file)
+    return int(match.group(1)) if match else 0
+
+def normalize_title(title):
+    """
+    Turn a link target into the title of the page it points to, the way MediaWiki does:
+    no leading colon or #fragment, spaces for underscores and an uppercase first letter.
+    """
+    title = title.strip().lstrip(':').split('#', 1)[0]
+    title = ' '.join(title.replace('_', ' ').split())
+    return title[:1].upper() + title[1:]
+
+# Markup the cleaner acts on, found in one left-to-right scan of the text
+CLEANER_TOKENS = re.compile(r'<!--|\{\{|\{\||\|\}|\[\[File:|<ref\b')
+TEMPLATE_BRACES = re.compile(r'\{\{|\}\}')
+LINK_BRACKETS = re.compile(r'\[\[|\]\]')
+# Most templates and refs hold no nested template, these match them in one regex call
+FLAT_TEMPLATE = re.compile(r'\{\{[^{}]*\}\}')
+REF_TAG = re.compile(r'<ref\b[^>]*?(/)?>')
+
+def find_closing(text, start, pattern, opener):
+    """Return the end of the closer matching the opener at start, or -1 when it is never closed."""
+    depth = 0
+    for match in pattern.finditer(text, start):
+        depth += 1 if match.group() == opener else -1
+        if depth == 0:
+            return match.end()
+    return -1
+
+def match_brackets(text, pattern, opener):
+    """Map the start of every opener found by pattern to the end of its closer, in one pass."""
+    ends = {}
+    stack = []
+    for match in pattern.finditer(text):
+        if match.group() == opener:
+            stack.append(match.start())
+        elif stack:
+            ends[stack.pop()] = match.end()
+    return ends
+
+def remove_templates(text):
+    """Remove every {{...}} from text, nested ones included."""
+    ends = match_brackets(text, TEMPLATE_BRACES, '{{')
+    pieces = []
+    position = 0
+    for match in TEMPLATE_BRACES.finditer(text):
+        start = match.start()
+        if start >= position and start in ends:
+            pieces.append(text[position:start])
+            position = ends[start]
+    pieces.append(text[position:])
+    return ''.join(pieces)
+
+def remove_specific_tags(text, infoboxes=None):
+    """
+    Remove templates {{...}}, <!-- ... --> comments, [[File:...]] links, <ref ... /> and <ref>...</ref>
+    from the text, and extract wikitables {|...|} and infoboxes into a JSON string.
+
+    Works in a single left-to-right scan with proper nesting, so the time is linear in the
+    length of the text, and templates, comments and refs spanning several lines are removed
+    as a whole. On markup the old regex chain (remove_specific_tags_regex) handled, the output
+    is the same. Also calls strip() to remove leading and trailing spaces and newlines (this is
+    common and a waste of storage).
+
+    infoboxes, the {key: value} dicts of the infoboxes in text, can be passed by a caller that
+    already has them (the importer takes them from the mwparserfromhell tree); they are stored
+    as given and the infobox templates are only removed.
+
+    Returns:
+        tuple: (clean_text, json_wikitables)
+    """
+    tables = []
+    parsed_infoboxes = []
+    # Output pieces of the text, and of every table still open
+    frames = [[]]
+    # Filled in once a template is found that is never closed, when scanning each one could go quadratic
+    template_ends = None
+    comments_closed = refs_closed = True
+    position = 0
+
+    while True:
+        match = CLEANER_TOKENS.search(text, position)
+        if match is None:
+            break
+        token, start = match.group(), match.start()
+        frames[-1].append(text[position:start])
+        position = match.end()
+
+        if token == '{{':
+            flat = FLAT_TEMPLATE.match(text, start)
+            if flat:
+                end = flat.end()
+            elif template_ends is None:
+                end = find_closing(text, start, TEMPLATE_BRACES, '{{')
+                if end == -1:
+                    template_ends = match_brackets(text, TEMPLATE_BRACES, '{{')
+            else:
+                end = template_ends.get(start, -1)
+            if end == -1:
+                frames[-1].append(token)
+                continue
+            if infoboxes is None and text.startswith('{{Infobox', start):
+                parsed_infoboxes.append(parse_infobox('{{' + remove_templates(text[start + 2:end - 2]) + '}}'))
+            position = end
+        elif token == '<!--':
+            end = text.find('-->', position) if comments_closed else -1
+            if end == -1:
+                # Once a search fails, every later one would too
+                comments_closed = False
+                frames[-1].append(token)
+                continue
+            position = end + len('-->')
+        elif token == '{|':
+            frames.append([token])
+        elif token == '|}':
+            if len(frames) == 1:
+                frames[-1].append(token)
+                continue
+            tables.append(parse_wikitable(''.join(frames.pop()) + token))
+        elif token == '[[File:':
+            end = find_closing(text, start, LINK_BRACKETS, '[[')
+            # An unclosed file link runs to the end of the text
+            position = end if end != -1 else len(text)
+        else:
+            tag = REF_TAG.match(text, start)
+            if tag is None:
+                frames[-1].append(token)
+                continue
+            if tag.group(1):
+                position = tag.end()
+                continue
+            end = text.find('</ref>', tag.end()) if refs_closed else -1
+            if end == -1:
+                refs_closed = False
+                frames[-1].append(token)
+                continue
+            position = end + len('</ref>')
+
+    frames[-1].append(text[position:])
+    # Tables that are never closed stay in the text
+    while len(frames) > 1:
+        unclosed = ''.join(frames.pop())
+        frames[-1].append(unclosed)
+
+    combined_json = {
+        "wikitables": tables,
+        "infoboxes": parsed_infoboxes if infoboxes is None else infoboxes
+    }
+    return ''.join(frames[0]).strip(), json.dumps(combined_json)
+
+def remove_specific_tags_regex(text):
     """
     Remove specific tags like {{...}}, <!-- ... -->, [[File:...]], <ref ... /> and <ref></ref> from the text.
 
+    The original chain of regex passes, kept as the reference remove_specific_tags is checked
+    and benchmarked against (see cleaner_benchmark.py). It does not handle nested templates or
+    markup spanning several lines, and is quadratic on texts with many [[File:...]] links.
+
     Also calls strip() to remove leading and trailing spaces and newlines (this is common and a waste of storage)
     """
     # Remove {{...}} tags
@@ -87,66 +248,14 @@ def extract_wikitables_and_infoboxes(text):
     # Pattern to match wikitables
     wikitable_pattern = re.compile(r'\{\|.*?\|\}', re.DOTALL)
     wikitables = wikitable_pattern.findall(text)
-    json_wikitables = []
-
-    for wikitable in wikitables:
-        table_dict = {"headers": [], "rows": []}
-        table_lines = wikitable.strip().split('\n')
-        headers = []
-        rows = []
-        current_row = []
-        in_header = False
-        
-        for line in table_lines:
-            if line.startswith('{|'):
-                continue
-            elif line.startswith('!'):
-                if not headers:
-                    headers = [header.strip() for header in re.split(r'!!|\|\|', line.strip()[1:])]
-                    table_dict["headers"] = headers
-                in_header = True
-            elif line.startswith('|-'):
-                if current_row:
-                    rows.append(current_row)
-                current_row = []
-                in_header = False
-            elif line.startswith('|'):
-                if in_header:
-                    headers = [header.strip() for header in re.split(r'!!|\|\|', line.strip()[1:])]
-                    table_dict["headers"] = headers
-                else:
-                    cells = [cell.strip() for cell in re.split(r'\|\|', line.strip()[1:])]
-                    current_row.extend(cells)
-        
-        if current_row:
-            rows.append(current_row)
-        
-        for row in rows:
-            row_dict = {}
-            for i, cell in enumerate(row):
-                header = headers[i] if i < len(headers) else f"Column_{i+1}"
-                row_dict[header] = cell
-            table_dict["rows"].append(row_dict)
-        
-        json_wikitables.append(table_dict)
+    json_wikitables = [parse_wikitable(wikitable) for wikitable in wikitables]
 
     clean_text = re.sub(wikitable_pattern, '', text)
 
     # Pattern to match infoboxes
     infobox_pattern = re.compile(r'\{\{Infobox.*?\}\}', re.DOTALL)
     infoboxes = infobox_pattern.findall(text)
-    json_infoboxes = []
-
-    for infobox in infoboxes:
-        infobox_dict = {}
-        lines = infobox.strip().split('\n')
-        for line in lines:
-            if line.startswith('{{Infobox'):
-                continue
-            elif '=' in line:
-                key, value = line.split('=', 1)
-                infobox_dict[key.strip()] = value.strip()
-        json_infoboxes.append(infobox_dict)
+    json_infoboxes = [parse_infobox(infobox) for infobox in infoboxes]
 
     clean_text = re.sub(infobox_pattern, '', clean_text)
 
@@ -157,6 +266,60 @@ def extract_wikitables_and_infoboxes(text):
 
     return json.dumps(combined_json), clean_text
 
+def parse_wikitable(wikitable):
+    """Turn the markup of a {|...|} wikitable into a dict of its headers and rows."""
+    table_dict = {"headers": [], "rows": []}
+    table_lines = wikitable.strip().split('\n')
+    headers = []
+    rows = []
+    current_row = []
+    in_header = False
+    
+    for line in table_lines:
+        if line.startswith('{|'):
+            continue
+        elif line.startswith('!'):
+            if not headers:
+                headers = [header.strip() for header in re.split(r'!!|\|\|', line.strip()[1:])]
+                table_dict["headers"] = headers
+            in_header = True
+        elif line.startswith('|-'):
+            if current_row:
+                rows.append(current_row)
+            current_row = []
+            in_header = False
+        elif line.startswith('|'):
+            if in_header:
+                headers = [header.strip() for header in re.split(r'!!|\|\|', line.strip()[1:])]
+                table_dict["headers"] = headers
+            else:
+                cells = [cell.strip() for cell in re.split(r'\|\|', line.strip()[1:])]
+                current_row.extend(cells)
+    
+    if current_row:
+        rows.append(current_row)
+    
+    for row in rows:
+        row_dict = {}
+        for i, cell in enumerate(row):
+            header = headers[i] if i < len(headers) else f"Column_{i+1}"
+            row_dict[header] = cell
+        table_dict["rows"].append(row_dict)
+
+    return table_dict
+
+def parse_infobox(infobox):
+    """Turn the markup of a {{Infobox ...}} template into a dict of its key = value lines."""
+    infobox_dict = {}
+    lines = infobox.strip().split('\n')
+    for line in lines:
+        if line.startswith('{{Infobox'):
+            continue
+        elif '=' in line:
+            key, value = line.split('=', 1)
+            infobox_dict[key.strip()] = value.strip()
+    return infobox_dict
+
 def get_categories_for_article(article_id):
     conn = get_connection()
     c = conn.cursor()
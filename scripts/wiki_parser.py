@@ -19,26 +19,56 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import mwxml
 import mwparserfromhell
 import sqlite3
 import sys
 import time
-import re
 import json
 import os
 import argparse
-import numpy as np
-import gc
 import psutil
 import os.path
 import csv
+import multiprocessing
+from datetime import timedelta
+import traceback
+from collections import namedtuple
+from functools import partial
 
 from utils import remove_specific_tags
-from page_counter import counter_
-from starter import table_exists
+from page_counter import counter_, scan_page_ids
+from starter import table_exists, column_exists
+from multistream import iter_streams, iter_stream_pages, iter_dump_pages, read_index_page_ids
+from dump_reader import iter_xml_pages
+from finalize import finalize_shards
+from compression import ShardCodec, ShardConnection, load_codec, save_dictionary, train_dictionary, METHODS
+from ingest_metrics import IngestMetrics
+from ingest_filter import IngestFilter, add_filter_arguments, filter_from_args
+from stored_pages import StoredPages
+from redirects import parse_redirect_target, clear_redirect_targets
+from embedding_store import remove_deleted_sections
+from link_graph import extract_links
 
 DB_DIR = "db_files/"
+
+# A page after wikitext parsing, as handed from the worker processes to the writer.
+# timings holds the seconds spent on the page per stage in the worker (see ingest_metrics).
+# infoboxes holds an (infobox_type, key, value) row for every field of the page's infoboxes.
+# redirect_target is the normalized title a redirect page points to, None for other pages.
+# links holds the normalized titles of the articles the page links to, once each.
+ParsedPage = namedtuple('ParsedPage', ['page_id', 'title', 'is_redirect', 'type', 'sections', 'categories', 'infoboxes', 'preview',
+                                       'offset', 'revision_id', 'sha1', 'timings', 'redirect_target', 'links'])
+
+# Every table holding rows of an article, with its article id column, children first
+ARTICLE_TABLES = [
+    ('article_sections', 'article_id'),
+    ('article_categories', 'article_id'),
+    ('infobox_fields', 'article_id'),
+    ('redirects', 'source_id'),
+    ('article_links', 'article_id'),
+    ('articles', 'article_id'),
+]
+
 def get_highest_db_index():
     db_index = 1
     while os.path.exists(DB_DIR+f'wikipedia_{db_index}.db'):
@@ -47,7 +77,8 @@ def get_highest_db_index():
 
 def get_connection(db_index):
     db_path = DB_DIR+ f'wikipedia_{db_index}.db'
-    conn = sqlite3.connect(db_path)
+    # Finalized shards index new sections through wiki_decompress in their full-text triggers
+    conn = sqlite3.connect(db_path, factory=ShardConnection)
     conn.execute('PRAGMA journal_mode=WAL;')
     conn.execute('PRAGMA synchronous=NORMAL;')
     conn.execute('PRAGMA temp_store=MEMORY;')
@@ -55,16 +86,22 @@ def get_connection(db_index):
 
     c = conn.cursor()
 
-    # Check and create the articles table with FTS5 if it doesn't exist
+    # Check and create the articles table if it doesn't exist (finalize adds its full-text index)
     if not table_exists(c, 'articles'):
         c.execute('''
         CREATE TABLE articles (
             article_id INTEGER PRIMARY KEY,
             title TEXT,
             is_redirect INTEGER,
-            type TEXT
+            type TEXT,
+            revision_id INTEGER,
+            sha1 TEXT
         )
         ''')
+    elif not column_exists(c, 'articles', 'revision_id'):
+        # Shards from before updates were supported, their pages all count as changed
+        c.execute('ALTER TABLE articles ADD COLUMN revision_id INTEGER')
+        c.execute('ALTER TABLE articles ADD COLUMN sha1 TEXT')
 
     # Check and create the categories table if it doesn't exist
     if not table_exists(c, 'categories'):
@@ -91,21 +128,67 @@ def get_connection(db_index):
         c.execute('''
         CREATE TABLE checkpoints (
             id INTEGER PRIMARY KEY,
-            last_page_id INTEGER
+            last_page_id INTEGER,
+            byte_offset INTEGER
         )
         ''')
+    elif not column_exists(c, 'checkpoints', 'byte_offset'):
+        # Shards from before byte offset checkpoints resume by page id only
+        c.execute('ALTER TABLE checkpoints ADD COLUMN byte_offset INTEGER')
 
-    # Check and create the article_sections table if it doesn't exist
+    # Check and create the article_sections table if it doesn't exist. Section ids key the
+    # embedding stores, so the ids of deleted sections are never handed out again
     if not table_exists(c, 'article_sections'):
         c.execute('''
         CREATE TABLE article_sections (
-            id INTEGER PRIMARY KEY,
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
             article_id INTEGER,
             section_order INTEGER,
             section_title TEXT,
             section_content TEXT,
             wikitables TEXT,
-            embedding BLOB,
+            FOREIGN KEY(article_id) REFERENCES articles(article_id)
+        )
+        ''')
+
+    # Ids of the sections deleted by updates, for the embedding stores to drop
+    if not table_exists(c, 'deleted_sections'):
+        c.execute('''
+        CREATE TABLE deleted_sections (
+            id INTEGER PRIMARY KEY
+        )
+        ''')
+
+    # Infobox fields get a row each, so "articles whose infobox has key X" is an indexed query
+    if not table_exists(c, 'infobox_fields'):
+        c.execute('''
+        CREATE TABLE infobox_fields (
+            article_id INTEGER,
+            infobox_type TEXT,
+            key TEXT,
+            value TEXT,
+            FOREIGN KEY(article_id) REFERENCES articles(article_id)
+        )
+        ''')
+
+    # Redirect targets by title, target_id is filled in across shards by resolve_redirects
+    if not table_exists(c, 'redirects'):
+        c.execute('''
+        CREATE TABLE redirects (
+            source_id INTEGER PRIMARY KEY,
+            target_title TEXT,
+            target_id INTEGER,
+            FOREIGN KEY(source_id) REFERENCES articles(article_id)
+        )
+        ''')
+
+    # Outgoing links of an article, one newline separated (and compressed) list of titles
+    # per article as they are only ever read whole, by link_graph.py
+    if not table_exists(c, 'article_links'):
+        c.execute('''
+        CREATE TABLE article_links (
+            article_id INTEGER PRIMARY KEY,
+            targets TEXT,
             FOREIGN KEY(article_id) REFERENCES articles(article_id)
         )
         ''')
@@ -114,6 +197,13 @@ def get_connection(db_index):
     return conn, db_path
 
 def load_checkpoint():
+    """
+    Return (last_page_id, byte_offset) of the last commit, or (None, None) for a fresh import.
+
+    byte_offset is where the last committed page (or, for multistream dumps, its bz2 stream)
+    starts in the dump file, so the importer can seek there instead of rescanning the dump.
+    It is None for checkpoints written before offsets were recorded.
+    """
     db_index = get_highest_db_index()
     conn, _ = get_connection(db_index=db_index)
     c = conn.cursor()
@@ -122,30 +212,200 @@ def load_checkpoint():
     c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='checkpoints';")
     if c.fetchone() is None:
         conn.close()
-        return None
+        return None, None
 
-    c.execute('SELECT last_page_id FROM checkpoints WHERE id = 1')
+    c.execute('SELECT last_page_id, byte_offset FROM checkpoints WHERE id = 1')
     result = c.fetchone()
     conn.close()
-    return result[0] if result else None
+    return result if result else (None, None)
 
 def get_db_size(db_path):
     return os.path.getsize(db_path)
 
-def save_checkpoint(last_page_id, conn, c):
-    c.execute('INSERT OR REPLACE INTO checkpoints (id, last_page_id) VALUES (1, ?)', (last_page_id,))
+def save_checkpoint(last_page_id, conn, c, byte_offset=None):
+    c.execute('INSERT OR REPLACE INTO checkpoints (id, last_page_id, byte_offset) VALUES (1, ?, ?)', (last_page_id, byte_offset))
     conn.commit()
 
-def get_category_id(name, c):
-    c.execute('SELECT category_id FROM categories WHERE name = ?', (name,))
-    row = c.fetchone()
-    if row:
-        return row[0]
-    else:
-        c.execute('INSERT INTO categories (name) VALUES (?)', (name,))
-        return c.lastrowid
+class ShardWriter:
+    """
+    Owns the connection to the shard being filled and buffers every insert into it.
+
+    Category ids come from a name -> id dictionary loaded once when the shard is opened, so
+    no SELECT is needed per category link. Articles, sections, new categories and
+    article_categories rows are buffered and written with executemany when flush() is
+    called, together with the checkpoint of the last buffered page, in one transaction.
+
+    With compression ('zlib' or 'zstd') section_content and wikitables are compressed as
+    they are buffered. zstd shards first store sample_sections sections as plain text,
+    train a dictionary on them and compress everything after that with it. A shard that is
+    already compressed keeps its method when compression is not given.
+
+    Articles passed to delete_article are deleted at the start of the next flush, before the
+    buffered inserts, so an article can be replaced in one transaction. The ids of their
+    sections are recorded in deleted_sections. Shards created before article_sections used
+    AUTOINCREMENT get explicit section ids above every stored or deleted one instead. The
+    update mode writes with checkpoint=False, leaving the checkpoint of the full import untouched.
+    """
+    def __init__(self, db_index, compression=None, sample_sections=2000, checkpoint=True):
+        self.checkpoint = checkpoint
+        self.last_page_id = None
+        self.last_offset = None
+        self.compression = compression
+        self.sample_sections = sample_sections
+        self.open(db_index)
+
+    def open(self, db_index):
+        self.db_index = db_index
+        self.conn, self.db_path = get_connection(db_index)
+        self.c = self.conn.cursor()
+
+        self.c.execute('SELECT name, category_id FROM categories')
+        self.category_ids = dict(self.c.fetchall())
+        self.next_category_id = max(self.category_ids.values(), default=0) + 1
+
+        self.c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'article_sections'")
+        self.reuses_section_ids = 'AUTOINCREMENT' not in self.c.fetchone()[0].upper()
+
+        self.samples = None
+        if not self.compression or load_codec(self.conn).compressed:
+            self.codec = load_codec(self.conn, self.compression)
+        elif self.compression == 'zstd':
+            # Store plain text until there is enough of it to train the shard's dictionary
+            self.samples = []
+            self.codec = ShardCodec()
+        else:
+            save_dictionary(self.conn, self.compression)
+            self.conn.commit()
+            self.codec = self.conn.codec = load_codec(self.conn, self.compression)
 
-def validate_last_entry(file_path):
+        self.deleted_articles = []
+        self.articles = []
+        self.sections = []
+        self.new_categories = []
+        self.article_categories = []
+        self.infobox_fields = []
+        self.redirects = []
+        self.article_links = []
+
+    def get_category_id(self, name):
+        category_id = self.category_ids.get(name)
+        if category_id is None:
+            category_id = self.next_category_id
+            self.next_category_id += 1
+            self.category_ids[name] = category_id
+            self.new_categories.append((category_id, name))
+        return category_id
+
+    def add_page(self, parsed_page):
+        # sqlite3 raises UnicodeEncodeError (lone surrogates) only once the row is written; check
+        # up front so a bad page is skipped on its own instead of failing a whole flush
+        parsed_page.title.encode('utf-8')
+        for section in parsed_page.sections:
+            for value in section:
+                value.encode('utf-8')
+        for category in parsed_page.categories:
+            category.encode('utf-8')
+        for field in parsed_page.infoboxes:
+            for value in field:
+                value.encode('utf-8')
+        if parsed_page.redirect_target:
+            parsed_page.redirect_target.encode('utf-8')
+        links = '\n'.join(parsed_page.links)
+        links.encode('utf-8')
+
+        article_id = parsed_page.page_id
+        self.articles.append((article_id, parsed_page.title, parsed_page.is_redirect, parsed_page.type,
+                              parsed_page.revision_id, parsed_page.sha1))
+
+        compress = self.codec.compress
+        for section_order in range(len(parsed_page.sections)):
+            section_title, section_content, wikitables = parsed_page.sections[section_order]
+            self.sections.append((article_id, section_order, section_title, compress(section_content), compress(wikitables)))
+            if self.samples is not None:
+                self.samples.append(section_content)
+        if self.samples is not None and len(self.samples) >= self.sample_sections:
+            self.train_codec()
+
+        for category in parsed_page.categories:
+            self.article_categories.append((article_id, self.get_category_id(category)))
+
+        for infobox_type, key, value in parsed_page.infoboxes:
+            self.infobox_fields.append((article_id, infobox_type, key, value))
+
+        if parsed_page.redirect_target:
+            self.redirects.append((article_id, parsed_page.redirect_target))
+
+        if links:
+            self.article_links.append((article_id, compress(links)))
+
+        self.last_page_id = parsed_page.page_id
+        self.last_offset = parsed_page.offset
+
+    def train_codec(self):
+        try:
+            dictionary = train_dictionary(self.samples)
+        except Exception as e:
+            # Too little (or too uniform) text to train on; plain zstd still compresses well
+            print(f"\nCould not train a zstd dictionary ({e}), compressing without one")
+            dictionary = None
+        save_dictionary(self.conn, 'zstd', dictionary)
+        # The connection decompresses for the full-text triggers of finalized shards
+        self.codec = self.conn.codec = ShardCodec('zstd', dictionary)
+        self.samples = None
+
+    def delete_article(self, article_id):
+        self.deleted_articles.append((int(article_id),))
+
+    def flush(self):
+        c = self.c
+        if self.deleted_articles:
+            c.executemany('INSERT OR IGNORE INTO deleted_sections (id) SELECT id FROM article_sections WHERE article_id = ?',
+                          self.deleted_articles)
+            for table_name, column in ARTICLE_TABLES:
+                c.executemany(f'DELETE FROM {table_name} WHERE {column} = ?', self.deleted_articles)
+            self.deleted_articles = []
+        c.executemany('INSERT INTO articles (article_id, title, is_redirect, type, revision_id, sha1) VALUES (?, ?, ?, ?, ?, ?)', self.articles)
+        if self.reuses_section_ids and self.sections:
+            c.execute('SELECT MAX(IFNULL((SELECT MAX(id) FROM article_sections), 0), IFNULL((SELECT MAX(id) FROM deleted_sections), 0))')
+            first_id = c.fetchone()[0] + 1
+            c.executemany('INSERT INTO article_sections (id, article_id, section_order, section_title, section_content, wikitables) VALUES (?, ?, ?, ?, ?, ?)',
+                          [(first_id + i,) + section for i, section in enumerate(self.sections)])
+        else:
+            c.executemany('INSERT INTO article_sections (article_id, section_order, section_title, section_content, wikitables) VALUES (?, ?, ?, ?, ?)',
+                          self.sections)
+        c.executemany('INSERT INTO categories (category_id, name) VALUES (?, ?)', self.new_categories)
+        c.executemany('INSERT INTO article_categories (article_id, category_id) VALUES (?, ?)', self.article_categories)
+        c.executemany('INSERT INTO infobox_fields (article_id, infobox_type, key, value) VALUES (?, ?, ?, ?)', self.infobox_fields)
+        c.executemany('INSERT INTO redirects (source_id, target_title) VALUES (?, ?)', self.redirects)
+        c.executemany('INSERT INTO article_links (article_id, targets) VALUES (?, ?)', self.article_links)
+        self.articles, self.sections, self.new_categories, self.article_categories = [], [], [], []
+        self.infobox_fields, self.redirects, self.article_links = [], [], []
+
+        if self.checkpoint and self.last_page_id is not None:
+            save_checkpoint(self.last_page_id, self.conn, c, self.last_offset)
+        self.conn.commit()
+
+    def is_full(self, db_splinter_size):
+        return get_db_size(self.db_path) / float(db_splinter_size * 1024 * 1024 * 1024) > 1
+
+    def rotate(self, count):
+        """Vacuum and close the current shard and continue in the next one."""
+        self.flush()
+
+        print(f"\nVacuuming the database after {count} entries...")
+        self.conn.execute('VACUUM;')
+        print("Vacuum completed.")
+
+        self.conn.close()
+        self.open(self.db_index + 1)
+        # Resuming reads the checkpoint of the newest shard, so carry it over
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+def validate_last_entry(file_path, index_path=None, byte_offset=None):
     db_index = get_highest_db_index()
     conn, _ = get_connection(db_index=db_index)
     c = conn.cursor()
@@ -159,48 +419,309 @@ def validate_last_entry(file_path):
         last_article_id, last_title = last_entry
         print(f"Last entry in articles table: ID = {last_article_id}, Title = {last_title}")
 
-        dump = mwxml.Dump.from_file(open(file_path, 'rb'))
-        for page in dump:
-            if page.id > last_article_id:
-                next_article_id = page.id
-                next_title = page.title
-                print(f"Next article to be processed: Page ID = {next_article_id}, Title = {next_title}")
-                return last_article_id < next_article_id
+        for raw_page in read_pages(file_path, last_article_id, index_path, verbose=False, start_offset=byte_offset):
+            print(f"Next article to be processed: Page ID = {raw_page.page_id}, Title = {raw_page.title}")
+            return last_article_id < raw_page.page_id
     else:
         print("No entries found in the articles table.")
         return False
 
-def parse_sections(parsed_content, is_redirect):
-    sections = []
+def clean_section(text, timings=None, infoboxes=None):
+    """remove_specific_tags, adding the time it took to timings['clean'] when given."""
+    if timings is None:
+        return remove_specific_tags(text, infoboxes)
+    start = time.perf_counter()
+    result = remove_specific_tags(text, infoboxes)
+    timings['clean'] += time.perf_counter() - start
+    return result
+
+def is_infobox(template):
+    return template.name.strip().lower().startswith('infobox')
+
+def find_infoboxes(node):
+    """
+    Return (infobox_type, {key: value}) for the node if it is an infobox template, and for the
+    infoboxes embedded in its parameters (e.g. an officeholder box inside an Infobox person).
+    """
+    if node.__class__.__name__ != 'Template':
+        return []
+    templates = [node] if is_infobox(node) else []
+    for param in node.params:
+        templates.extend(template for template in param.value.filter_templates(recursive=True) if is_infobox(template))
+
+    infoboxes = []
+    for template in templates:
+        infobox_type = template.name.strip_code().strip()[len('infobox'):].strip(' _')
+        fields = {}
+        for param in template.params:
+            value = param.value.strip_code().strip()
+            if not value and not any(is_infobox(embedded) for embedded in param.value.filter_templates(recursive=False)):
+                # Values made of templates only, such as {{birth date|...}}, are kept as wikitext
+                value = str(param.value).strip()
+            fields[param.name.strip_code().strip()] = value
+        infoboxes.append((infobox_type, fields))
+    return infoboxes
+
+def split_sections(parsed_content, is_redirect):
+    """
+    Yield (section title, raw section wikitext, infoboxes) for every section of a parsed page,
+    infoboxes being the (infobox_type, {key: value}) of the section's infobox templates.
+    """
     if is_redirect:
-        clean_content, json_tables_infoboxes = remove_specific_tags(parsed_content.strip_code())
-        sections.append(("redirect", clean_content, json_tables_infoboxes))
+        yield "redirect", parsed_content.strip_code(), []
+        return
+
+    current_section_title = "Introduction"
+    current_section_content = []
+    current_infoboxes = []
+
+    for node in parsed_content.nodes:
+        if node.__class__.__name__ == 'Heading':
+            if current_section_content:
+                yield current_section_title, '\n'.join(current_section_content), current_infoboxes
+                current_section_content = []
+                current_infoboxes = []
+            current_section_title = node.title.strip_code().strip()
+        else:
+            current_section_content.append(str(node))
+            current_infoboxes.extend(find_infoboxes(node))
+
+    if current_section_content:
+        yield current_section_title, '\n'.join(current_section_content), current_infoboxes
+
+def parse_sections(parsed_content, is_redirect, timings=None):
+    """Return the (title, clean content, tables and infoboxes JSON) of every section and the page's infobox fields."""
+    sections = []
+    infobox_fields = []
+    for section_title, section_text, infoboxes in split_sections(parsed_content, is_redirect):
+        # The infoboxes come from the parsed tree, the cleaner only has to drop them from the text
+        clean_content, json_tables_infoboxes = clean_section(section_text, timings,
+                                                             [fields for _infobox_type, fields in infoboxes])
+        sections.append((section_title, clean_content, json_tables_infoboxes))
+        for infobox_type, fields in infoboxes:
+            infobox_fields.extend((infobox_type, key, value) for key, value in fields.items())
+    return sections, infobox_fields
+
+def read_pages(file_path, last_page_id=None, index_path=None, verbose=True, start_offset=None, page_filter=None):
+    """
+    Stream a RawPage (id, title, namespace, latest revision text, offset) for every page in the dump.
+
+    Pages up to and including last_page_id are skipped, as are pages without any text and,
+    when page_filter is given, pages for which page_filter(raw_page) is false.
+    When index_path is given, file_path is a multistream .xml.bz2 dump read stream by stream.
+    start_offset (a checkpoint byte offset) seeks straight to the page or stream it points at.
+    """
+    if index_path:
+        pages = iter_dump_pages(file_path, index_path, last_page_id, start_offset=start_offset or 0)
     else:
-        current_section_title = "Introduction"
-        current_section_content = []
-
-        for node in parsed_content.nodes:
-            if node.__class__.__name__ == 'Heading':
-                if current_section_content:
-                    clean_content, json_tables_infoboxes = remove_specific_tags('\n'.join(current_section_content))
-                    sections.append((current_section_title, clean_content, json_tables_infoboxes))
-                    current_section_content = []
-                current_section_title = node.title.strip_code().strip()
+        pages = iter_xml_pages(file_path, start_offset=start_offset or 0)
+
+    for raw_page in pages:
+        page_id = raw_page.page_id
+        if last_page_id is not None and page_id <= last_page_id:
+            if not verbose:
+                continue
+            if last_page_id - page_id > 1000:
+                if int(last_page_id - page_id) % 1000 == 0.0:
+                    print(f"Jumping from {page_id} to {last_page_id}\r", end="")
             else:
-                current_section_content.append(str(node))
+                print(f"Jumping from {page_id} to {last_page_id}\r", end="")
+            continue
+        if page_filter is not None and not page_filter(raw_page):
+            continue
+
+        yield raw_page
+
+def parse_page(raw_page):
+    """
+    Parse the wikitext of a single page into a ParsedPage ready to be written.
+
+    This is the CPU heavy part of the import and runs inside the worker processes.
+    """
+    start = time.perf_counter()
+    timings = {'parse': 0.0, 'clean': 0.0}
+    content = raw_page.text
+    parsed_content = mwparserfromhell.parse(content)
+
+    # Detect categories
+    wikilinks = parsed_content.filter_wikilinks()
+    categories = [str(link.title) for link in wikilinks if link.title.startswith("Category:")]
+
+    # Detect redirects
+    is_redirect = content.strip().lower().startswith("#redirect")
+    redirect_target = parse_redirect_target(wikilinks) if is_redirect else None
+
+    # A redirect's only link is its target, which is in the redirects table
+    links = [] if is_redirect else extract_links(wikilinks)
+
+    # Determine type
+    if is_redirect and categories:
+        type_ = 'redirect_and_categories'
+    elif is_redirect:
+        type_ = 'redirect'
+    elif categories:
+        type_ = 'categories'
+    else:
+        type_ = 'text'
+
+    sections, infobox_fields = parse_sections(parsed_content, is_redirect, timings)
+    timings['parse'] = time.perf_counter() - start - timings['clean']
+    return ParsedPage(raw_page.page_id, raw_page.title, is_redirect, type_, sections, categories, infobox_fields,
+                      content[:500], raw_page.offset, raw_page.revision_id, raw_page.sha1, timings, redirect_target, links)
+
+def iter_page_batches(file_path, last_page_id=None, batch_size=50, start_offset=None, page_filter=None):
+    """Group the raw pages of a plain XML dump into batches, the unit of work of the parser pool."""
+    batch = []
+    for raw_page in read_pages(file_path, last_page_id, start_offset=start_offset, page_filter=page_filter):
+        batch.append(raw_page)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def parse_batch(raw_pages):
+    return [parse_page(raw_page) for raw_page in raw_pages]
+
+def iter_stream_tasks(file_path, index_path, last_page_id=None, start_offset=None):
+    """Turn every bz2 stream of a multistream dump into a unit of work of the parser pool."""
+    for stream in iter_streams(index_path, last_page_id, start_offset=start_offset or 0):
+        yield file_path, stream.offset, last_page_id
+
+def parse_stream(task, page_filter=None):
+    """Decompress and parse a single bz2 stream of a multistream dump."""
+    file_path, offset, last_page_id = task
+    start = time.perf_counter()
+    raw_pages = [raw_page for raw_page in iter_stream_pages(file_path, offset)
+                 if (last_page_id is None or raw_page.page_id > last_page_id)
+                 and (page_filter is None or page_filter(raw_page))]
+    read_seconds = time.perf_counter() - start
+
+    parsed_pages = [parse_page(raw_page) for raw_page in raw_pages]
+    for parsed_page in parsed_pages:
+        parsed_page.timings['read'] = read_seconds / len(parsed_pages)
+    return parsed_pages
+
+def _timed_tasks(make_tasks, task_args):
+    """Yield (task, seconds it took to read) for every unit of work."""
+    tasks = make_tasks(*task_args)
+    while True:
+        start = time.perf_counter()
+        try:
+            task = next(tasks)
+        except StopIteration:
+            return
+        yield task, time.perf_counter() - start
 
-        if current_section_content:
-            clean_content, json_tables_infoboxes = remove_specific_tags('\n'.join(current_section_content))
-            sections.append((current_section_title, clean_content, json_tables_infoboxes))
+def take_filtered(page_filter):
+    """The skip counts page_filter gathered in this process since the last call, by reason."""
+    take_counts = getattr(page_filter, 'take_counts', None)
+    return take_counts() if take_counts else {}
 
-    return sections
+def _reader_worker(make_tasks, task_args, task_queue, workers, page_filter=None):
+    """Reader stage: number the units of work and feed them to the parser processes."""
+    for seq, (task, read_seconds) in enumerate(_timed_tasks(make_tasks, task_args)):
+        task_queue.put((seq, task, read_seconds, take_filtered(page_filter)))
+    for _ in range(workers):
+        task_queue.put(None)
 
-def parse_dump(file_path, total_pages_file=None, db_splinter_size=10):
+def _parse_worker(handler, task_queue, result_queue, page_filter=None):
+    """Parse stage: turn units of work into lists of ParsedPage."""
+    while True:
+        task = task_queue.get()
+        if task is None:
+            result_queue.put(None)
+            return
+        seq, task, read_seconds, filtered = task
+        try:
+            parsed_pages, error = handler(task), None
+        except Exception:
+            parsed_pages, error = None, traceback.format_exc()
+        # Multistream units of work are read, and so filtered, in this process
+        for reason, n in take_filtered(page_filter).items():
+            filtered[reason] = filtered.get(reason, 0) + n
+        result_queue.put((seq, parsed_pages, error, read_seconds, filtered))
+
+def iter_parsed_pages(file_path, last_page_id=None, workers=1, batch_size=50, index_path=None, start_offset=None,
+                      metrics=None, page_filter=None):
+    """
+    Yield ParsedPage objects in dump order.
+
+    With workers > 1 the dump is read by one reader process and parsed by a pool of worker
+    processes, while the caller (the writer) keeps the only SQLite connection. Results are
+    reordered by unit of work so pages are always written, and checkpointed, in dump order.
+
+    A plain XML dump is read by the reader process and handed out in batches of batch_size
+    pages. A multistream dump (index_path given) is handed out one bz2 stream at a time, so
+    decompression happens in the workers as well.
+
+    When metrics (an IngestMetrics) is given, the time spent reading units of work and, with
+    workers > 1, the time the writer waits for parsed pages are added to it. page_filter
+    drops pages before they are parsed (see read_pages), in the process that reads them; the
+    counts of an IngestFilter are sent back with every unit of work and added to metrics.
+    """
+    if index_path:
+        make_tasks, task_args = iter_stream_tasks, (file_path, index_path, last_page_id, start_offset)
+        handler = partial(parse_stream, page_filter=page_filter)
+    else:
+        make_tasks, task_args, handler = iter_page_batches, (file_path, last_page_id, batch_size, start_offset, page_filter), parse_batch
+
+    if workers <= 1:
+        for task, read_seconds in _timed_tasks(make_tasks, task_args):
+            parsed_pages = handler(task)
+            if metrics:
+                metrics.add('read', read_seconds)
+                metrics.add_filtered(take_filtered(page_filter))
+            yield from parsed_pages
+        return
+
+    task_queue = multiprocessing.Queue(maxsize=workers * 4)
+    result_queue = multiprocessing.Queue(maxsize=workers * 4)
+    reader = multiprocessing.Process(target=_reader_worker,
+                                     args=(make_tasks, task_args, task_queue, workers, page_filter),
+                                     daemon=True)
+    parsers = [multiprocessing.Process(target=_parse_worker, args=(handler, task_queue, result_queue, page_filter), daemon=True)
+               for _ in range(workers)]
+    reader.start()
+    for parser in parsers:
+        parser.start()
+
+    try:
+        pending = {}
+        next_seq = 0
+        finished = 0
+        while finished < workers:
+            wait_start = time.perf_counter()
+            result = result_queue.get()
+            if metrics:
+                metrics.add('wait', time.perf_counter() - wait_start)
+            if result is None:
+                finished += 1
+                continue
+            seq, parsed_pages, error, read_seconds, filtered = result
+            if metrics:
+                metrics.add('read', read_seconds)
+                metrics.add_filtered(filtered)
+            if error:
+                raise Exception(f"Worker failed to parse unit of work {seq}:\n{error}")
+            pending[seq] = parsed_pages
+            while next_seq in pending:
+                for parsed_page in pending.pop(next_seq):
+                    yield parsed_page
+                next_seq += 1
+    finally:
+        for process in [reader] + parsers:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+def parse_dump(file_path, total_pages_file=None, db_splinter_size=10, workers=1, index_path=None, commit_every=1000,
+               compression=None, metrics_file=None, prometheus_file=None, metrics_interval=10.0, ingest_filter=None):
     db_index = get_highest_db_index()
     if db_index < 1:
         db_index = 1
-    conn, db_path = get_connection(db_index)
-    c = conn.cursor()
+    shard = ShardWriter(db_index, compression=compression)
+    metrics = IngestMetrics(metrics_file, prometheus_file, metrics_interval)
     
     # Create import_log.csv
     if not os.path.isfile("db_files/import_log.csv"):
@@ -210,216 +731,311 @@ def parse_dump(file_path, total_pages_file=None, db_splinter_size=10):
                 ["count", "pages_per_second", "percentage_complete", "memory in use"]
             )
 
-    with open(file_path, 'rb') as dump_file:
-        dump = mwxml.Dump.from_file(dump_file)
-        count = 0
-        start_time = time.time()
-        prev_time = start_time
-        _printing_text = ""
-
-        # Load total pages from JSON file
-        if total_pages_file:
-            json_path = total_pages_file
-            with open(json_path, 'r') as f:
-                total_pages = json.load(f)["total_pages"]
-        else:
-            total_pages = 0
-
-        last_page_id = load_checkpoint()
-        skip = last_page_id is not None
-        comparison = 0.0
-
-        for page in dump:
-            if skip:
-                if page.id <= last_page_id:
-                    if last_page_id - page.id > 1000:
-                        if int(last_page_id - page.id) % 1000 == 0.0:
-                            print(f"Jumping from {page.id} to {last_page_id}\r", end="")
-                    else:
-                        print(f"Jumping from {page.id} to {last_page_id}\r", end="")
-                    continue
-                skip = False
-
-
-                # Perform the validation check
-                if validate_last_entry(file_path):
-                    print("Validation successful: The last entry in the articles table matches the one after the skip loop.")
-                else:
-                    print("Validation failed: The last entry in the articles table does not match the one after the skip loop.")
-                    raise(Exception("Validation Error"))
-                
-                print()
-                print(f"Commencing intake at Page {page.id}")
-                print()
+    count = 0
+    start_time = time.time()
+    _printing_text = ""
+
+    # Load total pages (and, for newer count files, the dump size) from JSON file
+    file_size = None
+    if total_pages_file:
+        json_path = total_pages_file
+        with open(json_path, 'r') as f:
+            page_counts = json.load(f)
+        total_pages = page_counts["total_pages"]
+        file_size = page_counts.get("file_size")
+    else:
+        total_pages = 0
+
+    last_page_id, checkpoint_offset = load_checkpoint()
+    validate = last_page_id is not None
+    shard.last_page_id, shard.last_offset = last_page_id, checkpoint_offset
+    if checkpoint_offset is not None:
+        print(f"Resuming after page {last_page_id} from byte offset {checkpoint_offset}")
+    last_offset = checkpoint_offset or 0
+
+    for parsed_page in iter_parsed_pages(file_path, last_page_id, workers=workers, index_path=index_path,
+                                         start_offset=checkpoint_offset, metrics=metrics,
+                                         page_filter=ingest_filter if ingest_filter else None):
+        page_id = parsed_page.page_id
+        title = parsed_page.title
+        metrics.add_timings(parsed_page.timings)
+        if parsed_page.offset is not None and parsed_page.offset > last_offset:
+            metrics.count('bytes_read', parsed_page.offset - last_offset)
+            last_offset = parsed_page.offset
+
+        if validate:
+            validate = False
+
+            # Perform the validation check
+            if validate_last_entry(file_path, index_path, byte_offset=checkpoint_offset):
+                print("Validation successful: The last entry in the articles table matches the one after the skip loop.")
+            else:
+                print("Validation failed: The last entry in the articles table does not match the one after the skip loop.")
+                raise(Exception("Validation Error"))
+            
+            print()
+            print(f"Commencing intake at Page {page_id}")
+            print()
+
+        # Check database size and switch to a new one if it exceeds the limit
+        while shard.is_full(db_splinter_size):  # 10 GB limit
+            with metrics.timer('rotate'):
+                shard.rotate(count)
+            metrics.count('shard_rotations')
 
+        try:
+            with metrics.timer('write'):
+                shard.add_page(parsed_page)
+        except UnicodeEncodeError as e:
+            print(f"UnicodeEncodeError: {e} - Skipping page ID {page_id} with title {title}")
+            metrics.count('skipped_pages')
+            continue
+        count += 1
+        metrics.count('pages')
+        metrics.count('sections', len(parsed_page.sections))
+        metrics.count('categories', len(parsed_page.categories))
+        metrics.maybe_emit()
+        # Print the count with carriage return every 100 pages
+        if count % 100 == 0:
+            current_time = time.time()
+            elapsed_time = current_time - start_time
+            pages_per_second = count / elapsed_time
             
-            latest_revision = None
-            for revision in page:
-                latest_revision = revision
-
-            if latest_revision:
-                title = page.title
-                content = latest_revision.text
-                if content:
-                    parsed_content = mwparserfromhell.parse(content)
-                    
-                    # Detect categories
-                    categories = [str(link.title) for link in parsed_content.filter_wikilinks() if link.title.startswith("Category:")]
-                    
-                    # Detect redirects
-                    is_redirect = content.strip().lower().startswith("#redirect")
-
-                    # Determine type
-                    if is_redirect and categories:
-                        type_ = 'redirect_and_categories'
-                    elif is_redirect:
-                        type_ = 'redirect'
-                    elif categories:
-                        type_ = 'categories'
-                    else:
-                        type_ = 'text'
-
-                    # Check database size and switch to a new one if it exceeds the limit
-                    comparison = get_db_size(db_path) / float(db_splinter_size * 1024 * 1024 * 1024)
-
-                    while comparison > 1:  # 10 GB limit
-                        conn.commit()
-
-                        print(f"\nVacuuming the database after {count} entries...")
-                        conn.execute('VACUUM;')
-                        print("Vacuum completed.")
-                        
-                        conn.close()
-                        
-                        db_index += 1
-                        conn, db_path = get_connection(db_index)
-                        c = conn.cursor()
-                        comparison = get_db_size(db_path) / float(db_splinter_size * 1024 * 1024 * 1024)
-
-                    try:
-                        c.execute('INSERT INTO articles (article_id, title, is_redirect, type) VALUES (?, ?, ?, ?)', 
-                                (page.id, title, is_redirect, type_))
-                        article_id = c.lastrowid
-
-                        # Insert sections
-                        sections = parse_sections(parsed_content, is_redirect)
-                        
-                        # Create blank embedding variable with identity matrix, process this later
-                        blank_embedding = np.identity(n=3, dtype=np.float32)
-                        embedding_blob = blank_embedding.tobytes()
-                        
-                        for section_order in range(len(sections)):
-                            section_title, section_content, wikitables = sections[section_order]
-                            c.execute('INSERT INTO article_sections (article_id, section_order, section_title, section_content, wikitables, embedding) VALUES (?, ?, ?, ?, ?, ?)', 
-                                    (article_id, section_order, section_title, section_content, wikitables, embedding_blob))
-
-                        for category in categories:
-                            category_id = get_category_id(category, c)
-                            c.execute('INSERT INTO article_categories (article_id, category_id) VALUES (?, ?)', 
-                                    (article_id, category_id))
-                    except UnicodeEncodeError as e:
-                        print(f"UnicodeEncodeError: {e} - Skipping page ID {page.id} with title {title}")
-                        continue
-                    count += 1
-                    # Print the count with carriage return and commit every 100 pages
-                    if count % 100 == 0:
-                        current_time = time.time()
-                        elapsed_time = current_time - start_time
-                        pages_per_second = count / elapsed_time
-                        
-                        # Monitor memory usage
-                        process = psutil.Process(os.getpid())
-                        memory_info = process.memory_info()
-                        mem_mb = memory_info.rss / (1024 ** 2)
-
-                        percentage_complete = (page.id / total_pages) * 100
-                        print(" "*len(_printing_text),
-                            end="\r")
-
-                        _printing_text = f'Imported {count} pages so far, {pages_per_second:.2f} pages per second, {percentage_complete:.2f}% complete; Memory usage: {mem_mb:.2f} MB'
-                        
-                        print(_printing_text,
-                            end="\r")
-                        
-                        # Update previous time and count for the next derivative calculation
-                        prev_time = current_time
-                        prev_count = count
-                        
-                        save_checkpoint(page.id, conn, c)
-                        conn.commit()
-                        
-
-
-
-                    # Print a page title and the first 500 characters of its content every 1000 pages
-                    if count % 1000 == 0:
-                        print(f'\nPage {count}: {title}')
-                        print(''.join(parsed_content[:500]))
-
-                    if count % 10000 == 0:
-                        with open("db_files/import_log.csv","a",newline="") as fi:
-                            writer = csv.writer(fi)
-                            writer.writerow(
-                                [count, pages_per_second, percentage_complete, psutil.virtual_memory().percent]
-                            )
-                        print("Running GC cleaning.")
-                        gc.collect()
-                    
-                    if count % 400000 == 0:
-                        print("Early return to reset Memory usage!")
-                        return False
-                    
-    save_checkpoint(page.id, conn, c)
-    conn.commit()
-    conn.close()
-    gc.collect()
+            # Monitor memory usage
+            process = psutil.Process(os.getpid())
+            memory_info = process.memory_info()
+            mem_mb = memory_info.rss / (1024 ** 2)
+
+            # Progress by byte position when the dump size is known, page ids are not dense
+            eta_text = ""
+            if file_size and parsed_page.offset is not None:
+                percentage_complete = (parsed_page.offset / file_size) * 100
+                bytes_per_second = (parsed_page.offset - (checkpoint_offset or 0)) / elapsed_time
+                if bytes_per_second > 0:
+                    eta_text = f", ETA {timedelta(seconds=int((file_size - parsed_page.offset) / bytes_per_second))}"
+            else:
+                percentage_complete = (page_id / total_pages) * 100
+            print(" "*len(_printing_text),
+                end="\r")
+
+            _printing_text = f'Imported {count} pages so far, {pages_per_second:.2f} pages per second, {percentage_complete:.2f}% complete{eta_text}; Memory usage: {mem_mb:.2f} MB'
+            
+            print(_printing_text,
+                end="\r")
+
+        # Write the buffered pages and the checkpoint in one transaction
+        if count % commit_every == 0:
+            commit_start = time.perf_counter()
+            shard.flush()
+            metrics.observe_commit(time.perf_counter() - commit_start)
+
+        # Print a page title and the first 500 characters of its content every 1000 pages
+        if count % 1000 == 0:
+            print(f'\nPage {count}: {title}')
+            print(parsed_page.preview)
+
+        if count % 10000 == 0:
+            with open("db_files/import_log.csv","a",newline="") as fi:
+                writer = csv.writer(fi)
+                writer.writerow(
+                    [count, pages_per_second, percentage_complete, psutil.virtual_memory().percent]
+                )
+
+    commit_start = time.perf_counter()
+    shard.close()
+    metrics.observe_commit(time.perf_counter() - commit_start)
+    metrics.emit()
+    print(f"\n{metrics.summary()}")
+    return True
+
+def update_dump(file_path, db_splinter_size=10, workers=1, index_path=None, commit_every=1000, delete_missing=True,
+                compression=None, metrics_file=None, prometheus_file=None, metrics_interval=10.0, count_workers=None,
+                ingest_filter=None):
+    """
+    Bring the shards up to date with a newer dump (or an adds/changes dump) without a full re-import.
+
+    Pages are compared with the stored revision id (and sha1) before they are parsed, so only
+    new and changed pages go through the parser. A changed page replaces the stored article
+    in the shard that holds it; new pages go to the shard their id falls into, or the newest
+    shard when that one is full or their id is past every shard. With delete_missing, stored articles the dump no longer has are deleted, which is
+    only right for a full dump, and redirects to them lose their target_id. Checkpoints are not touched: an interrupted update is simply
+    run again, the pages it already wrote are unchanged by then. ingest_filter restricts the
+    pages considered, unchanged pages are counted as filtered out with reason 'unchanged'.
+    """
+    db_files = [DB_DIR + f'wikipedia_{db_index}.db' for db_index in range(1, get_highest_db_index() + 1)]
+    if not db_files:
+        print("No shards to update, import a dump first.")
+        return False
+
+    print(f"Loading the article and revision ids of {len(db_files)} shards...")
+    stored = StoredPages(db_files)
+    print(f"{len(stored)} articles stored")
+
+    metrics = IngestMetrics(metrics_file, prometheus_file, metrics_interval)
+    page_filter = ingest_filter or IngestFilter()
+    page_filter.add_check('unchanged', stored.changed)
+    file_size = os.path.getsize(file_path)
+    writers = {}
+    added = updated = 0
+    start_time = time.time()
+
+    def get_writer(db_index):
+        shard = writers.get(db_index)
+        if shard is None:
+            shard = writers[db_index] = ShardWriter(db_index, compression=compression, checkpoint=False)
+        return shard
+
+    for parsed_page in iter_parsed_pages(file_path, workers=workers, index_path=index_path, metrics=metrics,
+                                         page_filter=page_filter):
+        page_id = parsed_page.page_id
+        metrics.add_timings(parsed_page.timings)
+
+        db_index = stored.shard_for(page_id)
+        is_update = stored.contains(page_id)
+        shard = get_writer(db_index)
+        # A changed page replaces its article in the shard holding it. New pages never grow a
+        # full shard: those of an older one go to the newest, which moves on when it is full
+        if not is_update and shard.is_full(db_splinter_size) and db_index != stored.newest_index:
+            db_index = stored.newest_index
+            shard = get_writer(db_index)
+        if not is_update and db_index == stored.newest_index and shard.is_full(db_splinter_size):
+            with metrics.timer('rotate'):
+                shard.rotate(added + updated)
+            metrics.count('shard_rotations')
+            del writers[db_index]
+            writers[shard.db_index] = shard
+            stored.newest_index = shard.db_index
+
+        try:
+            with metrics.timer('write'):
+                shard.add_page(parsed_page)
+        except UnicodeEncodeError as e:
+            print(f"UnicodeEncodeError: {e} - Skipping page ID {page_id} with title {parsed_page.title}")
+            metrics.count('skipped_pages')
+            continue
+        if is_update:
+            shard.delete_article(page_id)
+            updated += 1
+        else:
+            added += 1
+        metrics.count('pages')
+        metrics.count('sections', len(parsed_page.sections))
+        metrics.count('categories', len(parsed_page.categories))
+        metrics.maybe_emit()
+
+        count = added + updated
+        if count % 100 == 0:
+            percentage_complete = (parsed_page.offset / file_size) * 100 if parsed_page.offset is not None else 0
+            print(f"Updated {updated} and added {added} pages, {count / (time.time() - start_time):.2f} pages per second, "
+                  f"{percentage_complete:.2f}% of the dump read\r", end="")
+
+        if count % commit_every == 0:
+            commit_start = time.perf_counter()
+            for writer in writers.values():
+                writer.flush()
+            metrics.observe_commit(time.perf_counter() - commit_start)
+
+    deleted = 0
+    deleted_ids = []
+    if delete_missing:
+        print("\nListing the pages of the dump to find deleted ones...")
+        if index_path:
+            dump_page_ids = read_index_page_ids(index_path)
+        else:
+            dump_page_ids = scan_page_ids(file_path, workers=count_workers)
+        for db_index, article_ids in stored.missing(dump_page_ids).items():
+            shard = get_writer(db_index)
+            for article_id in article_ids:
+                shard.delete_article(article_id)
+            deleted += len(article_ids)
+            deleted_ids.extend(article_ids)
+
+    commit_start = time.perf_counter()
+    for writer in writers.values():
+        writer.close()
+    metrics.observe_commit(time.perf_counter() - commit_start)
+    metrics.emit()
+
+    shard_files = [DB_DIR + f'wikipedia_{db_index}.db' for db_index in range(1, get_highest_db_index() + 1)]
+    # Redirects of any shard may point at a deleted article, resolve_redirects looks them up again
+    if deleted_ids:
+        cleared = clear_redirect_targets(shard_files, deleted_ids)
+        print(f"Cleared {cleared} redirect targets of deleted articles")
+    for db_file in shard_files:
+        removed = remove_deleted_sections(db_file)
+        if removed:
+            print(f"Dropped the embeddings of {removed} deleted sections of {os.path.basename(db_file)}")
+
+    print(f"\nUpdated {updated}, added {added} and deleted {deleted} articles across {len(writers)} shards")
+    print(metrics.summary())
     return True
 
-def validate_checkpoint(file_path):
+def validate_checkpoint(file_path, index_path=None):
     """
     Validate and debug that the importer starts on the correct article after an unexpected termination.
     """
-    last_page_id = load_checkpoint()
+    last_page_id, byte_offset = load_checkpoint()
     print(f"Last imported page ID: {last_page_id}")
-    conn, _ = get_connection(db_index=1)
-    c = conn.cursor()
-    
-    dump = mwxml.Dump.from_file(open(file_path, 'rb'))
-    for page in dump:
-        if page.id > last_page_id:
-            latest_revision = None
-            for revision in page:
-                latest_revision = revision
-            if latest_revision:
-                title = page.title
-                content = latest_revision.text
-                print(f"Next article to be processed: Page ID = {page.id}, Title = {title}")
-                print(f"Content (first 500 characters): {content[:500]}")
-                break
 
-    conn.close()
+    for raw_page in read_pages(file_path, last_page_id, index_path, verbose=False, start_offset=byte_offset):
+        print(f"Next article to be processed: Page ID = {raw_page.page_id}, Title = {raw_page.title}")
+        print(f"Content (first 500 characters): {raw_page.text[:500]}")
+        break
 
 if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="Process Wikipedia dump file.")
-    parser.add_argument("file_path", help="Path to the extracted XML file")
+    parser.add_argument("file_path", help="Path to the extracted XML file, or to a multistream .xml.bz2 dump")
     parser.add_argument("db_splinter_size", help="Size of each of the Database splits (Total est: 120Gb)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of parser processes (1 parses in the main process)")
+    parser.add_argument("--commit-every", type=int, default=1000, help="Pages buffered per executemany transaction and checkpoint")
+    parser.add_argument("--skip-finalize", action="store_true", help="Do not build the shard indexes after the import (run scripts/finalize.py later)")
+    parser.add_argument("--finalize-workers", type=int, default=None, help="Number of shards indexed at the same time")
+    parser.add_argument("--count-workers", type=int, default=None, help="Number of processes counting the pages of the dump")
+    parser.add_argument("--compress", choices=METHODS, default=None, help="Compress section_content and wikitables (zstd needs the zstandard package)")
+    parser.add_argument("--update", action="store_true", help="Update the existing shards from a newer dump instead of importing it")
+    parser.add_argument("--no-deletes", action="store_true", help="With --update, keep stored pages missing from the dump (for adds/changes dumps)")
+    parser.add_argument("--metrics-file", help="Append a JSON line with the import metrics to this file every --metrics-interval seconds")
+    parser.add_argument("--prometheus-file", help="Keep the import metrics in this Prometheus text-format file (e.g. for the node_exporter textfile collector)")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="Seconds between two metrics updates")
+    add_filter_arguments(parser)
+    parser.add_argument("--index", help="Path to the -index.txt.bz2 of a multistream dump (guessed from file_path for .xml.bz2 files)")
     
     args = parser.parse_args()
 
     file_path = args.file_path
-    output_path = file_path.replace(".xml", "_pageCount.json")
+    index_path = args.index
+    if file_path.endswith(".xml.bz2"):
+        if index_path is None:
+            index_path = file_path.replace("-multistream.xml.bz2", "-multistream-index.txt.bz2")
+        output_path = file_path.replace(".xml.bz2", "_pageCount.json")
+    else:
+        output_path = file_path.replace(".xml", "_pageCount.json")
 
+    if args.update:
+        # Only new and changed pages are parsed, into the shards that hold them
+        isDone = update_dump(file_path=file_path, db_splinter_size=int(args.db_splinter_size), workers=args.workers, index_path=index_path,
+                             commit_every=args.commit_every, delete_missing=not args.no_deletes, compression=args.compress,
+                             metrics_file=args.metrics_file, prometheus_file=args.prometheus_file, metrics_interval=args.metrics_interval,
+                             count_workers=args.count_workers, ingest_filter=filter_from_args(args))
+        if isDone and not args.skip_finalize:
+            finalize_shards(workers=args.finalize_workers)
+        sys.exit(0 if isDone else 1)
 
-    # The code is meant to exit after 200,000 entries (or whatever the last count % conditional is)
-    counter_(input_file_path=file_path, output_json_path=output_path)
+    counter_(input_file_path=file_path, output_json_path=output_path, index_path=index_path, workers=args.count_workers)
 
     # Import pages
-    isDone = parse_dump(file_path=file_path, total_pages_file=output_path, db_splinter_size=int(args.db_splinter_size))
+    isDone = parse_dump(file_path=file_path, total_pages_file=output_path, db_splinter_size=int(args.db_splinter_size), workers=args.workers, index_path=index_path, commit_every=args.commit_every, compression=args.compress,
+                        metrics_file=args.metrics_file, prometheus_file=args.prometheus_file, metrics_interval=args.metrics_interval,
+                        ingest_filter=filter_from_args(args))
 
     print(f"IS DONE: {isDone}")
 
+    # Build the secondary indexes now that the bulk load is over
+    if isDone and not args.skip_finalize:
+        finalize_shards(workers=args.finalize_workers)
+
     # Validate checkpoint
-    validate_checkpoint(file_path)
+    validate_checkpoint(file_path, index_path)
 
     print('\nValidation completed.')
\ No newline at end of file
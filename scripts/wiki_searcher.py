@@ -20,15 +20,19 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import argparse
-import glob
-import sqlite3
 import os
-from datetime import timedelta, datetime
+from datetime import timedelta
 from functools import wraps
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from utils import get_connection, get_db_files, get_column_names, get_article_counts, get_article_counts_by_type
+from utils import get_db_files, shard_number
+from starter import table_exists
+from category_graph import connect_graph, articles_under_category
+from shard_fanout import configure_pool, merge_ranked, collect_unranked, merge_ranked_page, collect_unranked_page, POOLS
+from shard_pool import shard_connection
+from title_index import TitleIndex, TITLE_INDEX_DIR
+# Results are only cached in processes that call configure_query_cache (the CLI below, the search server)
+from query_cache import cached_search, configure_query_cache, query_cache_stats, DISK_CACHE_FILE
 
 
 def time_execution(func):
@@ -48,24 +52,168 @@ def time_execution(func):
         return result
     return wrapper
 
-def search_article_by_id(article_id):
+def fts_query(text, prefix=False):
+    """FTS5 query matching text as a phrase, or any phrase starting with it when prefix is set."""
+    phrase = '"' + text.replace('"', '""') + '"'
+    return phrase + ' *' if prefix else phrase
+
+def after_condition(score_column, id_column, after):
+    """SQL condition and parameters keeping the rows sorted after the (score, article_id) after."""
+    if after is None:
+        return '1', ()
+    return f'({score_column}, {id_column}) > (?, ?)', tuple(after)
+
+def match_titles(c, title, limit, prefix=False, after=None):
     """
-    Searches for all information about an article by its ID.
-    
-    Parameters:
-        article_id (int): The ID of the article to search for.
-        db_files (list): List of database files to search in.
-    
-    Returns:
-        dict: A dictionary containing all information about the article.
+    (article_id, title, score) of the articles of a shard whose title contains the phrase,
+    best BM25 score (lowest) first, then by id. With after, only those sorted after that
+    (score, article_id). Shards without a full-text index (not finalized yet) fall back to
+    matching the title as a standalone word with LIKE, all scoring 0.
+    """
+    if table_exists(c, 'articles_fts'):
+        condition, params = after_condition('m.score', 'a.article_id', after)
+        c.execute(f'''
+        SELECT a.article_id, a.title, m.score
+        FROM (
+            SELECT rowid, rank AS score
+            FROM articles_fts
+            WHERE articles_fts MATCH ?
+        ) m
+        JOIN articles a ON a.article_id = m.rowid
+        WHERE {condition}
+        ORDER BY m.score, a.article_id
+        LIMIT ?
+        ''', (fts_query(title, prefix), *params, limit))
+        return c.fetchall()
+
+    condition, params = after_condition('0.0', 'article_id', after)
+    c.execute(f'''
+    SELECT article_id, title, 0.0 FROM articles
+    WHERE (title = ?
+    OR title LIKE ?
+    OR title LIKE ?
+    OR title LIKE ?)
+    AND {condition}
+    ORDER BY article_id
+    LIMIT ?
+    ''', (title, f'{title} %', f'% {title}', f'% {title} %', *params, limit))
+    return c.fetchall()
+
+def match_sections(c, text, limit, prefix=False, after=None):
     """
+    (article_id, score) of the articles of a shard with a section containing the phrase,
+    scored by their best matching section, best first, then by id. With after, only those
+    sorted after that (score, article_id). Shards without a full-text index fall back to a
+    LIKE scan of the section text, all scoring 0.
+    """
+    if table_exists(c, 'sections_fts'):
+        condition, params = after_condition('MIN(m.score)', 's.article_id', after)
+        c.execute(f'''
+        SELECT s.article_id, MIN(m.score) AS score
+        FROM (
+            -- rank is bm25(), which cannot be called once the subquery is flattened
+            SELECT rowid, rank AS score
+            FROM sections_fts
+            WHERE sections_fts MATCH ?
+        ) m
+        JOIN article_sections s ON s.id = m.rowid
+        GROUP BY s.article_id
+        HAVING {condition}
+        ORDER BY score, s.article_id
+        LIMIT ?
+        ''', (fts_query(text, prefix), *params, limit))
+        return c.fetchall()
+
+    content = c.connection.codec.content_column('section_content')
+    condition, params = after_condition('0.0', 'article_id', after)
+    c.execute(f'''
+    SELECT DISTINCT article_id, 0.0
+    FROM article_sections
+    WHERE ({content} = ?
+       OR {content} LIKE ?
+       OR {content} LIKE ?
+       OR {content} LIKE ?)
+       AND {condition}
+    ORDER BY article_id
+    LIMIT ?
+    ''', (text, f'{text} %', f'% {text}', f'% {text} %', *params, limit))
+    return c.fetchall()
+
+def find_redirect_target(c, article_id):
+    """
+    Return the id of the article a redirect points to as a one element list, [] when its target
+    is not imported (or not resolved yet) and None when the article is not a redirect.
+    """
+    # Shards imported before redirect targets were stored have no redirects table
+    if not table_exists(c, 'redirects'):
+        return None
+    c.execute('SELECT target_id FROM redirects WHERE source_id = ?', (article_id,))
+    redirect = c.fetchone()
+    if redirect is None:
+        return None
+    return [redirect[0]] if redirect[0] is not None else []
+
+def find_redirect_targets(c, article_ids):
+    """find_redirect_target for a set of articles: {article_id: redirects_to} of the redirects among them."""
+    if not table_exists(c, 'redirects'):
+        return {}
+    rows = fetch_by_ids(c, 'SELECT source_id, target_id FROM redirects WHERE source_id IN ({ids})', article_ids)
+    return {source_id: [target_id] if target_id is not None else [] for source_id, target_id in rows}
+
+# Ids per IN (...) list, well below SQLite's limit on query parameters
+ID_BATCH = 500
+
+def fetch_by_ids(c, query, ids):
+    """Rows of query for all of ids, its {ids} placeholder filled with batches of parameters."""
+    rows = []
+    for start in range(0, len(ids), ID_BATCH):
+        batch = ids[start:start + ID_BATCH]
+        c.execute(query.format(ids=','.join('?' * len(batch))), batch)
+        rows.extend(c.fetchall())
+    return rows
+
+def fetch_sections(c, article_ids, introductionOnly=False):
+    """
+    {article_id: sections} of a set of articles, in section order. With introductionOnly each
+    article gets only its first section.
+    """
+    if introductionOnly:
+        query = '''
+        SELECT article_id, section_title, section_content, wikitables FROM article_sections
+        WHERE id IN (SELECT MIN(id) FROM article_sections WHERE article_id IN ({ids}) GROUP BY article_id)
+        '''
+    else:
+        query = '''
+        SELECT article_id, section_title, section_content, wikitables FROM article_sections
+        WHERE article_id IN ({ids})
+        ORDER BY article_id, section_order
+        '''
+    decompress = c.connection.codec.decompress
+    sections = {}
+    for article_id, section_title, section_content, wikitables in fetch_by_ids(c, query, article_ids):
+        sections.setdefault(article_id, []).append(
+            {'title': section_title, 'content': decompress(section_content), 'wikitables': decompress(wikitables)})
+    return sections
+
+def fetch_categories(c, article_ids):
+    """{article_id: category names} of a set of articles."""
+    query = '''
+    SELECT ac.article_id, c.name FROM article_categories ac
+    INNER JOIN categories c ON c.category_id = ac.category_id
+    WHERE ac.article_id IN ({ids})
+    ORDER BY ac.article_id, ac.category_id
+    '''
+    categories = {}
+    for article_id, name in fetch_by_ids(c, query, article_ids):
+        categories.setdefault(article_id, []).append(name)
+    return categories
+
+def shard_article_by_id(db_file, article_id):
+    """The article with article_id as a one element list if it is in this shard, else []."""
     article_data = None
-    db_files = get_db_files()
-
-    for db_file in db_files:
-        conn = sqlite3.connect(db_file)
+    with shard_connection(db_file) as conn:
         c = conn.cursor()
-        
+
         # Retrieve the article's main details
         query_article = '''
         SELECT article_id, title, is_redirect
@@ -94,8 +242,9 @@ def search_article_by_id(article_id):
             '''
             c.execute(query_sections, (article_id,))
             sections = c.fetchall()
+            decompress = conn.codec.decompress
             article_data['sections'] = [
-                {'title': section[0], 'content': section[1], 'wikitables': section[2]} for section in sections
+                {'title': section[0], 'content': decompress(section[1]), 'wikitables': decompress(section[2])} for section in sections
             ]
 
             # Retrieve categories for the article
@@ -111,27 +260,61 @@ def search_article_by_id(article_id):
 
             # Check if the article is a redirect and find its target
             if article_data['is_redirect']:
-                redirect_query = '''
-                SELECT article_id
-                FROM articles
-                WHERE title = ?
-                '''
-                c.execute(redirect_query, (article_data['title'],))
-                redirect_targets = c.fetchall()
-                article_data['redirects_to'] = [redirect[0] for redirect in redirect_targets]
+                article_data['redirects_to'] = find_redirect_target(c, article_id)
+
+    return [article_data] if article_data else []
+
+@cached_search
+def search_article_by_id(article_id):
+    """
+    Searches for all information about an article by its ID.
+    
+    Parameters:
+        article_id (int): The ID of the article to search for.
+    
+    Returns:
+        dict: A dictionary containing all information about the article.
+    """
+    # An article is in one shard only, the others are cancelled once it is found
+    articles = collect_unranked(shard_article_by_id, get_db_files(), article_id, limit=1)
+    return articles[0] if articles else f"Article with ID {article_id} not found."
 
-        conn.close()
+def shard_articles_by_title(db_file, title, limit, introductionOnly, prefix, after=None, stop_at_redirect=True):
+    """The title matches of one shard (after the (score, article_id) after) with their data, best first."""
+    with shard_connection(db_file) as conn:
+        c = conn.cursor()
+        _text = f"Checking {db_file}, querying..."
+        print(_text)
 
-        # If article data was found in this database, no need to check further databases
-        if article_data:
-            break
+        # Ranked full-text match of the title phrase
+        articles = match_titles(c, title, limit, prefix, after)
 
-    return article_data if article_data else f"Article with ID {article_id} not found."
+        # Keep the articles up to the first redirect (for disambiguations and such)
+        redirects = find_redirect_targets(c, [article_id for article_id, article_title, score in articles])
+        for position, (article_id, article_title, score) in enumerate(articles):
+            if stop_at_redirect and article_id in redirects:
+                articles = articles[:position + 1]
+                break
 
-@time_execution
-def search_articles_by_title(title, limit=1000, introductionOnly=True):
-    results = []
+        _text = f"Found {len(articles)} articles..."
+        print(_text)
+
+        # Sections and categories of all of them at once
+        article_ids = [article_id for article_id, article_title, score in articles]
+        sections = fetch_sections(c, article_ids, introductionOnly)
+        categories = fetch_categories(c, article_ids)
 
+    return [{'id': article_id, 'title': article_title, 'sections': sections.get(article_id, []),
+             'categories': categories.get(article_id, []), 'redirects_to': redirects.get(article_id), 'score': score}
+            for article_id, article_title, score in articles]
+
+@time_execution
+@cached_search
+def search_articles_by_title(title, limit=1000, introductionOnly=True, prefix=False):
+    """
+    Find articles whose title contains title as a phrase (or a phrase prefix with prefix),
+    best BM25 match first across all shards, at most limit of them.
+    """
     # Get DB Files
     db_files = get_db_files()
         
@@ -139,252 +322,280 @@ def search_articles_by_title(title, limit=1000, introductionOnly=True):
     print(f"*"*20)
     print(f"Searching for Articles with string({title}):")
 
-    for db_file in db_files:
-        conn = sqlite3.connect(db_file)
-        c = conn.cursor()
-        _text = f"Checking {db_file}, querying..."
-        print(_text)
-        
-        # Adjusted query to match only standalone occurrences of the word "cat"
-        query_articles = '''
-        SELECT article_id, title FROM articles
-        WHERE title = ? 
-        OR title LIKE ? 
-        OR title LIKE ? 
-        OR title LIKE ?
-        LIMIT ?
-        '''
+    # Search the shards in parallel and merge them by score
+    return merge_ranked(shard_articles_by_title, db_files, title, limit, introductionOnly, prefix,
+                        limit=limit, key=lambda article_data: (article_data['score'], article_data['id']))
 
-        # Execute the article query with specific patterns to match "cat" as a standalone word
-        c.execute(query_articles, (title, f'{title} %', f'% {title}', f'% {title} %', limit))
-        articles = c.fetchall()
+def shard_title_page(db_file, title, introductionOnly, prefix, limit, after):
+    articles = shard_articles_by_title(db_file, title, limit, introductionOnly, prefix, after, stop_at_redirect=False)
+    return [((article_data['score'], article_data['id']), article_data) for article_data in articles]
 
-        print(type(articles))
-        _text = f"Found {len(articles)} articles..."
-        print(_text)
-
-        counter = 1
-        for article_id, article_title in articles:
-            _text = f"Gathering data for article #{counter}"
-            print(_text)
-            print(" "*len(_text))
-            counter += 1
-            article_data = {'id': article_id, 'title': article_title, 'sections': [], 'categories': [], 'redirects_to': None}
-
-
-            # Query to get sections for the article
-            if introductionOnly:
-                query_sections = '''
-                SELECT section_title, section_content, wikitables FROM article_sections
-                WHERE article_id = ?
-                ORDER BY id LIMIT 1
-                '''
-            else:
-                query_sections = '''
-                SELECT section_title, section_content, wikitables FROM article_sections
-                WHERE article_id = ?
-                '''
-            
-            # Execute the sections query
-            c.execute(query_sections, (article_id,))
-            sections = c.fetchall()
-            article_data['sections'] = [{'title': section[0], 'content': section[1], 'wikitables': section[2]} for section in sections]
+@cached_search
+def search_articles_by_title_page(title, page_size=100, cursor=None, introductionOnly=True, prefix=False):
+    """
+    A page of search_articles_by_title, whose shards do not stop at their first redirect.
 
-            # Query to get categories for the article
-            query_categories = '''
-            SELECT c.name FROM categories c
-            INNER JOIN article_categories ac ON c.category_id = ac.category_id
-            WHERE ac.article_id = ?
-            '''
+    Returns:
+        tuple: the articles of the page and the cursor to pass for the next one, None after
+        the last page.
+    """
+    return merge_ranked_page(shard_title_page, sorted(get_db_files(), key=shard_number), title, introductionOnly, prefix,
+                             page_size=page_size, cursor=cursor)
 
-            # Execute the categories query
-            c.execute(query_categories, (article_id,))
-            categories = c.fetchall()
-            article_data['categories'] = [category[0] for category in categories]
+def shard_articles_by_title_grouped_by_category(db_file, title, limit, introductionOnly):
+    """(score, article_data, categories) of the title matches of one shard, best first."""
+    with shard_connection(db_file) as conn:
+        c = conn.cursor()
+        articles = match_titles(c, title, limit)
 
-            # Check if the article is a redirect
-            redirect_query = '''
-            SELECT article_id FROM articles
-            WHERE title = ?
-            '''
+        # Every article is fetched once, whatever the number of its categories
+        article_ids = [article_id for article_id, article_title, score in articles]
+        sections = fetch_sections(c, article_ids, introductionOnly)
+        categories = fetch_categories(c, article_ids)
 
-            # Execute the redirect query
-            c.execute(redirect_query, (article_title,))
-            redirect_articles = c.fetchall()
+    return [(score, {'id': article_id, 'title': article_title, 'sections': sections.get(article_id, [])},
+             categories.get(article_id) or [None])
+            for article_id, article_title, score in articles]
 
-            if redirect_articles:
-                # Include immediate redirects (for disambiguations and such)
-                if len(redirect_articles) > 1:
-                    print(f"Design Flaw: Redirect for '{article_title}' resolves to multiple articles: {redirect_articles}")
-                article_data['redirects_to'] = [redirect_article[0] for redirect_article in redirect_articles]
-                results.append(article_data)
-                break  # Break after the first article with a redirect
-            else:
-                # Else just add the article
-                results.append(article_data)
+@time_execution
+@cached_search
+def search_articles_by_title_grouped_by_category(title, limit=1000, introductionOnly=False):
+    results = {}
+    matches = merge_ranked(shard_articles_by_title_grouped_by_category, get_db_files(), title, limit, introductionOnly,
+                           limit=limit, key=lambda match: (match[0], match[1]['id']))
 
-        conn.close()
+    for score, article_data, categories in matches:
+        for category in categories:
+            if category not in results:
+                results[category] = []
+            results[category].append(article_data)
 
     return results
 
-@time_execution
-def search_articles_by_title_grouped_by_category(title, limit=1000, introductionOnly=False):
-    results = {}
-    db_files = get_db_files()
-    
-    for db_file in db_files:
-        conn = sqlite3.connect(db_file)
+def shard_articles_by_text(db_file, text, limit, prefix, after=None):
+    """
+    (score, title, article_id, categories) of the text matches of one shard (after the
+    (score, article_id) after), best first.
+    """
+    with shard_connection(db_file) as conn:
         c = conn.cursor()
-        
-        # Query to get articles by title and group them by category
-        query_articles = '''
-        SELECT a.article_id, a.title, c.name as category
+        matches = match_sections(c, text, limit, prefix, after)
+
+        query = '''
+        SELECT a.article_id, a.title, GROUP_CONCAT(c.name) as categories
         FROM articles a
         LEFT JOIN article_categories ac ON a.article_id = ac.article_id
         LEFT JOIN categories c ON ac.category_id = c.category_id
-        WHERE a.title = ?
-           OR a.title LIKE ? 
-           OR a.title LIKE ? 
-           OR a.title LIKE ?
-        LIMIT ?
+        WHERE a.article_id IN ({ids})
+        GROUP BY a.article_id
         '''
-        
-        # Execute the query with patterns to match standalone words
-        c.execute(query_articles, (title, f'{title} %', f'% {title}', f'% {title} %', limit))
-        articles = c.fetchall()
-        
-        for article_id, article_title, category in articles:
-            if category not in results:
-                results[category] = []
-            article_data = {'id': article_id, 'title': article_title, 'sections': []}
-
-            # Query to get sections if required
-            if introductionOnly:
-                query_sections = '''
-                SELECT section_title, section_content, wikitables FROM article_sections
-                WHERE article_id = ?
-                ORDER BY id LIMIT 1
-                '''
-            else:
-                query_sections = '''
-                SELECT section_title, section_content, wikitables FROM article_sections
-                WHERE article_id = ?
-                '''
+        articles = {article_id: (article_title, categories)
+                    for article_id, article_title, categories in fetch_by_ids(c, query, [article_id for article_id, score in matches])}
 
-            c.execute(query_sections, (article_id,))
-            sections = c.fetchall()
-            article_data['sections'] = [{'title': section[0], 'content': section[1], 'wikitables': section[2]} for section in sections]
+    return [(score, articles[article_id][0], article_id, articles[article_id][1]) for article_id, score in matches]
 
-            results[category].append(article_data)
+@time_execution
+@cached_search
+def search_articles_by_text(text, limit=100, prefix=False):
+    """
+    Find articles with a section containing text as a phrase (or a phrase prefix with
+    prefix), best BM25 match first across all shards. BM25 uses the term statistics of each
+    shard, which are close to each other as pages are spread evenly over the shards.
 
-        conn.close()
+    Returns:
+        list: (title, article_id, categories) tuples, categories comma separated.
+    """
+    results = merge_ranked(shard_articles_by_text, get_db_files(), text, limit, prefix,
+                           limit=limit, key=lambda result: (result[0], result[2]))
+    return [result[1:] for result in results]
 
-    return results
+def shard_text_page(db_file, text, prefix, limit, after):
+    return [((result[0], result[2]), result[1:]) for result in shard_articles_by_text(db_file, text, limit, prefix, after)]
 
+@cached_search
+def search_articles_by_text_page(text, page_size=100, cursor=None, prefix=False):
+    """
+    A page of search_articles_by_text.
 
-@time_execution
-def search_articles_by_text(text, limit=100):
-    results = []
-    db_files = get_db_files()
+    Returns:
+        tuple: the (title, article_id, categories) tuples of the page and the cursor to pass
+        for the next one, None after the last page.
+    """
+    return merge_ranked_page(shard_text_page, sorted(get_db_files(), key=shard_number), text, prefix,
+                             page_size=page_size, cursor=cursor)
 
-    for db_file in db_files:
-        conn = sqlite3.connect(db_file)
+def shard_articles_by_text_grouped_by_category(db_file, text, limit):
+    """(score, title, article_id, categories) of the text matches of one shard, best first."""
+    with shard_connection(db_file) as conn:
         c = conn.cursor()
+        matches = match_sections(c, text, limit)
 
-        query = '''
-        SELECT a.title, a.article_id, GROUP_CONCAT(c.name) as categories
-        FROM articles a
-        LEFT JOIN article_categories ac ON a.article_id = ac.article_id
-        LEFT JOIN categories c ON ac.category_id = c.category_id
-        WHERE a.article_id IN (
-            SELECT article_id
-            FROM article_sections
-            WHERE section_content = ?
-               OR section_content LIKE ?
-               OR section_content LIKE ?
-               OR section_content LIKE ?
-        )
-        GROUP BY a.article_id
-        LIMIT ?
-        '''
-        
-        # Execute the query with patterns for matching the standalone word
-        c.execute(query, (text, f'{text} %', f'% {text}', f'% {text} %', limit))
-        results.extend(c.fetchall())
-        conn.close()
+        article_ids = [article_id for article_id, score in matches]
+        titles = dict(fetch_by_ids(c, 'SELECT article_id, title FROM articles WHERE article_id IN ({ids})', article_ids))
+        categories = fetch_categories(c, article_ids)
 
-    return results
+    return [(score, titles[article_id], article_id, categories.get(article_id) or [None]) for article_id, score in matches]
 
 @time_execution
+@cached_search
 def search_articles_by_text_grouped_by_category(text, limit=100):
     results = {}
-    db_files = get_db_files()
-
-    for db_file in db_files:
-        conn = sqlite3.connect(db_file)
-        c = conn.cursor()
+    matches = merge_ranked(shard_articles_by_text_grouped_by_category, get_db_files(), text, limit,
+                           limit=limit, key=lambda match: (match[0], match[2]))
 
-        # Query to get articles by text and group by category
-        query = '''
-        SELECT a.title, a.article_id, c.name as category
-        FROM articles a
-        LEFT JOIN article_categories ac ON a.article_id = ac.article_id
-        LEFT JOIN categories c ON ac.category_id = c.category_id
-        WHERE a.article_id IN (
-            SELECT article_id
-            FROM article_sections
-            WHERE section_content = ?
-               OR section_content LIKE ?
-               OR section_content LIKE ?
-               OR section_content LIKE ?
-        )
-        GROUP BY a.article_id, c.name
-        LIMIT ?
-        '''
-        
-        # Execute the query with patterns to match standalone words
-        c.execute(query, (text, f'{text} %', f'% {text}', f'% {text} %', limit))
-        articles = c.fetchall()
-        
-        for article_title, article_id, category in articles:
+    for score, article_title, article_id, categories in matches:
+        for category in categories:
             if category not in results:
                 results[category] = []
             article_data = {'title': article_title, 'id': article_id}
             results[category].append(article_data)
 
-        conn.close()
-
     return results
 
-@time_execution
-def search_articles_by_category(category, limit=100):
-    results = []
-    # Get DB Files
-    db_files = get_db_files()
-    print()
-    for db_file in db_files:
-        _ = f"Checking DB: {db_file}"
-        print(_,end="\r")
-        conn = sqlite3.connect(db_file)
+def shard_articles_by_category(db_file, category, limit, after=None):
+    """(title, article_id) of the articles of a shard in a matching category, by id, from after the id after."""
+    with shard_connection(db_file) as conn:
         c = conn.cursor()
 
+        # Articles are listed once even when several of their categories match
         query = '''
         SELECT a.title, a.article_id
         FROM articles a
         JOIN article_categories ac ON a.article_id = ac.article_id
         JOIN categories c ON ac.category_id = c.category_id
-        WHERE c.name LIKE ?
+        WHERE c.name LIKE ? AND a.article_id > ?
+        GROUP BY a.article_id
+        ORDER BY a.article_id
         LIMIT ?
         '''
-        
-        c.execute(query, (f'%{category}%', limit))
-        results.extend(c.fetchall())
-        conn.close()
-        print(" "*len(_),end="\r")
     
-
+        c.execute(query, (f'%{category}%', after if after is not None else -1, limit))
+        results = c.fetchall()
     return results
 
+@time_execution
+@cached_search
+def search_articles_by_category(category, limit=100):
+    # Unranked, so the shards not searched yet are cancelled once there are limit articles
+    return collect_unranked(shard_articles_by_category, get_db_files(), category, limit, limit=limit)
+
+def shard_category_page(db_file, category, limit, after):
+    return [(article_id, (title, article_id)) for title, article_id in shard_articles_by_category(db_file, category, limit, after)]
+
+@cached_search
+def search_articles_by_category_page(category, page_size=100, cursor=None):
+    """
+    A page of search_articles_by_category, in shard order.
+
+    Returns:
+        tuple: the (title, article_id) tuples of the page and the cursor to pass for the
+        next one, None after the last page.
+    """
+    return collect_unranked_page(shard_category_page, sorted(get_db_files(), key=shard_number), category,
+                                 page_size=page_size, cursor=cursor)
+
+def match_infobox_fields(db_file, key, value, infobox_type, limit, after=None):
+    """
+    ((article_id, field rowid), (title, article_id, infobox_type, value)) of the matching
+    infobox fields of a shard, sorted by article and field, from after the pair after.
+    """
+    with shard_connection(db_file) as conn:
+        c = conn.cursor()
+
+        query = '''
+        SELECT f.article_id, f.rowid, a.title, a.article_id, f.infobox_type, f.value
+        FROM infobox_fields f
+        JOIN articles a ON a.article_id = f.article_id
+        WHERE f.key = ?
+        '''
+        params = [key]
+        if value is not None:
+            query += ' AND f.value = ?'
+            params.append(value)
+        if infobox_type is not None:
+            query += ' AND f.infobox_type = ?'
+            params.append(infobox_type)
+        if after is not None:
+            query += ' AND (f.article_id, f.rowid) > (?, ?)'
+            params.extend(after)
+        query += ' ORDER BY f.article_id, f.rowid LIMIT ?'
+        params.append(limit)
+
+        c.execute(query, params)
+        results = c.fetchall()
+    return [(row[:2], row[2:]) for row in results]
+
+def shard_articles_by_infobox(db_file, key, value, infobox_type, limit):
+    return [result for position, result in match_infobox_fields(db_file, key, value, infobox_type, limit)]
+
+@time_execution
+@cached_search
+def search_articles_by_infobox(key, value=None, infobox_type=None, limit=100):
+    """
+    Find articles whose infobox has the field key, optionally with the given value and infobox type.
+
+    Returns:
+        list: (title, article_id, infobox_type, value) tuples.
+    """
+    return collect_unranked(shard_articles_by_infobox, get_db_files(), key, value, infobox_type, limit, limit=limit)
+
+@cached_search
+def search_articles_by_infobox_page(key, value=None, infobox_type=None, page_size=100, cursor=None):
+    """
+    A page of search_articles_by_infobox, in shard order.
+
+    Returns:
+        tuple: the (title, article_id, infobox_type, value) tuples of the page and the
+        cursor to pass for the next one, None after the last page.
+    """
+    return collect_unranked_page(match_infobox_fields, sorted(get_db_files(), key=shard_number), key, value, infobox_type,
+                                 page_size=page_size, cursor=cursor)
+
+def shard_titles(db_file, article_ids):
+    """(article_id, title) of the articles of article_ids that are in this shard."""
+    with shard_connection(db_file) as conn:
+        return fetch_by_ids(conn.cursor(), 'SELECT article_id, title FROM articles WHERE article_id IN ({ids})', article_ids)
+
+@time_execution
+@cached_search
+def search_articles_by_category_tree(category, max_depth=2, limit=100):
+    """
+    Find the articles in category and in its subcategories up to max_depth levels down.
+
+    The category graph (see category_graph.py) gives the article ids in one read of its
+    closure table, their titles are then looked up by primary key in the shards.
+
+    Returns:
+        list: (title, article_id, depth) tuples, closest categories first.
+    """
+    graph = connect_graph()
+    members = articles_under_category(graph.cursor(), category, max_depth, limit)
+    graph.close()
+
+    # Every article is in one shard, so the lookup stops once all of them are found
+    article_ids = [article_id for article_id, depth in members]
+    titles = dict(collect_unranked(shard_titles, get_db_files(), article_ids, limit=len(article_ids)))
+
+    return [(titles[article_id], article_id, depth) for article_id, depth in members if article_id in titles]
+
+# Opened on first use, reopened when the index is rebuilt
+_title_index = {'index': None, 'signature': None}
+
+def search_titles_by_prefix(prefix, limit=10):
+    """
+    Type-ahead: the best titles starting with prefix from the title index (see title_index.py),
+    without querying the shards.
+
+    Returns:
+        list: (title, article_id, shard, target_id) tuples, target_id being the article a
+        redirect leads to.
+    """
+    stat = os.stat(os.path.join(TITLE_INDEX_DIR, 'index.json'))
+    signature = (stat.st_ino, stat.st_mtime_ns)
+    if _title_index['signature'] != signature:
+        _title_index['index'], _title_index['signature'] = TitleIndex(), signature
+    return _title_index['index'].search(prefix, limit)
+
 from collections import defaultdict
 
 @time_execution
@@ -418,7 +629,14 @@ def general_search(query, limit=100):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Search Wikipedia articles.")
     parser.add_argument("query", help="Search query for Wikipedia articles")
+    parser.add_argument("--pool", choices=POOLS, default='thread', help="Search the shards in parallel threads or processes")
+    parser.add_argument("--pool-workers", type=int, default=None, help="Number of shards searched at the same time")
+    parser.add_argument("--cache-mb", type=int, default=64, help="Memory for cached search results (0 turns the cache off)")
+    parser.add_argument("--disk-cache", action="store_true", help="Also keep search results in db_files/query_cache.db across runs")
     args = parser.parse_args()
+    configure_pool(args.pool, args.pool_workers)
+    configure_query_cache(enabled=args.cache_mb > 0, max_bytes=args.cache_mb * 1024 * 1024,
+                          disk_file=DISK_CACHE_FILE if args.disk_cache else None)
 
     query = args.query
     results1 = search_articles_by_title(query)
@@ -426,6 +644,7 @@ if __name__ == "__main__":
     # results3 = search_articles_by_text_old(query)
     # results4 = search_articles_by_category(query)
     print(results1)
+    print(query_cache_stats())
     # results5 = search_articles_by_title_grouped_by_category(query)
     # results = search_article_by_id(query)
 